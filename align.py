@@ -0,0 +1,239 @@
+#!/usr/bin/python
+# align.py - Fast start live preview for aiming and focusing the camera
+#
+# Serves a low resolution MJPEG stream from the camera video port over http
+# so the camera can be aimed and focused from a phone or laptop browser
+# without restarting rpi-timelapse.py for every test image.  Only the camera
+# and PIL are loaded and the scene is never probed, so the first frame is
+# ready well under a second after starting.
+#
+# Each frame shows a sharpness value (variance of the edges in the image) and
+# a bar against the best value of the last few seconds.  Turn the focus ring
+# for the highest value.  The camera stays in auto exposure and awb.
+#
+#   http://camera:8080/               live preview page
+#   http://camera:8080/stream.mjpg    MJPEG stream
+#   http://camera:8080/snapshot.jpg   latest frame
+#   http://camera:8080/sharpness      latest sharpness value
+#
+# python ./align.py                  preview on port 8080. ctrl-c to exit
+# python ./align.py --fake --port 8081
+# sudo ./rpi-timelapse.py align      same as python ./align.py
+
+import argparse
+import collections
+import io
+import socket
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFilter
+from PIL import ImageFont
+from PIL import ImageStat
+
+import timelapsecam
+
+previewPort = 8080
+previewWidth = 640           # Stream size. Resized by the camera from the full sensor view
+previewHeight = 360
+previewFps = 10              # Max frames per second sent to browsers
+previewQuality = 70
+sensorWidth = 1920           # Camera resolution. Same field of view as the timelapse images
+sensorHeight = 1080
+peakSec = 5                  # Sharpness bar is relative to the best value in this many seconds
+
+PAGE = """<html><head><title>rpi-timelapse align</title></head>
+<body style="margin:0;background:#000"><img src="/stream.mjpg" style="width:100%"></body></html>"""
+
+# Focus metric. Variance of the edges of the grey image. Higher is sharper
+def sharpness(img):
+  return ImageStat.Stat(img.convert('L').filter(ImageFilter.FIND_EDGES)).var[0]
+
+class PreviewSource(object):
+  # Captures frames in a background thread. Each frame gets the sharpness
+  # overlay and is kept as jpeg data for the http clients to share
+  def __init__(self, session, width, height, fps=10, quality=70, peakSec=5):
+    self.session = session
+    self.size = (width, height)
+    self.interval = 1.0 / fps if fps > 0 else 0
+    self.quality = quality
+    self.font = ImageFont.load_default()
+    self.peaks = collections.deque()   # (time, sharpness)
+    self.peakSec = peakSec
+    self.condition = threading.Condition()
+    self.frame = None
+    self.seq = 0
+    self.value = 0.0
+    self.firstFrameSec = None
+    self.started = time.time()
+    self.stopEvent = threading.Event()
+    self.thread = threading.Thread(target=self._run, name='align')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def _overlay(self, img, value, peak):
+    draw = ImageDraw.Draw(img)
+    width = img.size[0]
+    draw.rectangle((0, 0, width, 14), fill=(0, 0, 0))
+    draw.rectangle((0, 15, int(width * min(value / peak, 1.0)) if peak else 0, 19), fill=(0, 255, 0))
+    draw.text((4, 2), "sharpness %.1f  best %.1f  exp %i us" % (value, peak, self.session.camera.exposure_speed),
+              fill=(255, 255, 255), font=self.font)
+    return img
+
+  def _run(self):
+    stream = self.session.captureStream(True, resize=self.size)
+    try:
+      nextTime = time.time()
+      for data, exposure, gain in stream:
+        if self.stopEvent.is_set():
+          break
+        img = Image.open(io.BytesIO(data))
+        if img.size != self.size:
+          img = img.resize(self.size, Image.BILINEAR)   # Camera without a resizer
+        value = sharpness(img)
+        now = time.time()
+        self.peaks.append((now, value))
+        while self.peaks[0][0] < now - self.peakSec:
+          self.peaks.popleft()
+        peak = max(v for t, v in self.peaks)
+        output = io.BytesIO()
+        self._overlay(img.convert('RGB'), value, peak).save(output, 'JPEG', quality=self.quality)
+        with self.condition:
+          self.frame = output.getvalue()
+          self.value = value
+          self.seq += 1
+          if self.firstFrameSec is None:
+            self.firstFrameSec = now - self.started
+          self.condition.notify_all()
+        nextTime = max(nextTime + self.interval, now)
+        if nextTime > now:
+          time.sleep(nextTime - now)
+    finally:
+      stream.close()
+
+  # Wait for a frame newer than seq. Returns (seq, jpeg data) or (seq, None) on timeout
+  def waitFrame(self, seq=0, timeout=5.0):
+    with self.condition:
+      if self.seq <= seq:
+        self.condition.wait(timeout)
+      if self.seq <= seq:
+        return seq, None
+      return self.seq, self.frame
+
+  def close(self):
+    self.stopEvent.set()
+    self.thread.join(5)
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+class PreviewServer(object):
+  # Serves the preview page, MJPEG stream and snapshots from a background thread
+  def __init__(self, source, port, host=''):
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+      def do_GET(self):
+        if self.path == '/':
+          self._send(PAGE, 'text/html')
+        elif self.path.startswith('/snapshot.jpg'):
+          seq, frame = source.waitFrame(0)
+          if frame is None:
+            self.send_error(503)
+          else:
+            self._send(frame, 'image/jpeg')
+        elif self.path.startswith('/sharpness'):
+          self._send("%.1f\n" % source.value, 'text/plain')
+        elif self.path.startswith('/stream.mjpg'):
+          self._stream()
+        else:
+          self.send_error(404)
+
+      def _send(self, body, contentType):
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      # Send each new frame as a part of a multipart response until the browser goes away
+      def _stream(self):
+        self.send_response(200)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
+        self.end_headers()
+        seq = 0
+        try:
+          while not source.stopEvent.is_set():
+            seq, frame = source.waitFrame(seq)
+            if frame is None:
+              continue
+            self.wfile.write("--FRAME\r\nContent-Type: image/jpeg\r\nContent-Length: %i\r\n\r\n" % len(frame))
+            self.wfile.write(frame)
+            self.wfile.write("\r\n")
+        except (IOError, socket.error):
+          self.close_connection = 1
+
+      # A browser closing the page is not an error
+      def handle(self):
+        try:
+          BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        except (IOError, socket.error):
+          pass
+
+      def finish(self):
+        try:
+          BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except (IOError, socket.error):
+          pass
+
+      def log_message(self, format, *args):
+        pass
+
+    self.server = ThreadedHTTPServer((host, port), Handler)
+    self.thread = threading.Thread(target=self.server.serve_forever, name='alignhttp')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+# Run the preview until ctrl-c or runSec seconds. args as for the command line
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Live camera preview for aiming and focusing')
+  parser.add_argument('--port', type=int, default=previewPort, help='http port (default %i)' % previewPort)
+  parser.add_argument('--width', type=int, default=previewWidth)
+  parser.add_argument('--height', type=int, default=previewHeight)
+  parser.add_argument('--fps', type=float, default=previewFps)
+  parser.add_argument('--vflip', action='store_true', help='flip image vertically')
+  parser.add_argument('--hflip', action='store_true', help='flip image horizontally')
+  parser.add_argument('--fake', action='store_true', help='use the fake camera backend')
+  parser.add_argument('--seconds', type=float, default=0, help='exit after this many seconds. 0=run until ctrl-c')
+  args = parser.parse_args(argv)
+
+  started = time.time()
+  session = timelapsecam.CameraSession(
+              timelapsecam.openCamera('fake' if args.fake else 'picamera'),
+              sensorWidth, sensorHeight, args.vflip, args.hflip)
+  source = PreviewSource(session, args.width, args.height, args.fps, previewQuality, peakSec)
+  server = PreviewServer(source, args.port)
+  source.waitFrame(0)
+  # --port 0 picks a free port
+  print "align.py - Preview at http://%s:%i/  first frame %.2f sec after start" % (
+          socket.gethostname(), server.server.server_address[1], time.time() - started)
+  try:
+    while args.seconds <= 0 or time.time() - started < args.seconds:
+      time.sleep(0.5)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.close()
+    source.close()
+    session.close()
+  print "align.py - Stopped"
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# dedup.py - Skip storing frames that have not changed for rpi-timelapse.py
+#
+# At night and in static scenes many frames in a row are the same picture.
+# Each new frame is decoded at 1/8 size with the jpeg draft mode and reduced
+# to a small grid of average luminance.  If no grid cell changed more than
+# cellThreshold and the average change is below threshold (0-255 levels)
+# since the last kept frame, the frame is not written.  Only a frame
+# manifest record is added with ref set to the sequence number of the kept
+# frame and path set to its image so makemovie.py repeats that image and
+# the movie timing is unchanged.  offload.py and thumbcache.py skip these
+# records.  A frame is always kept after maxRun duplicates in a row.
+#
+# A frame is only marked as a duplicate while the kept image is still in the
+# pipeline or still on disk.  Once it is offloaded or deleted by retention
+# the next frame is kept instead.  If the kept image was never stored the
+# store stage stamps and stores the duplicate and calls stored() so later
+# duplicates repeat that image.
+#
+# rpi-timelapse.py runs FrameDeduplicator.process as a pipeline.py stage
+# before the stamp and store stages when dedupFrames = True.
+
+import io
+import os
+import threading
+import numpy
+from PIL import Image
+
+import stats
+
+class FrameDeduplicator(object):
+  def __init__(self, threshold=1.5, cellThreshold=12, grid=(32, 18), maxRun=30, verbose=False):
+    self.threshold = threshold
+    self.cellThreshold = cellThreshold
+    self.grid = grid
+    self.maxRun = maxRun
+    self.verbose = verbose
+    self.lastGrid = None
+    self.lastKept = None   # (seq, filename) of the last frame kept
+    self.keptStored = False  # lastKept has been written. False while it is in the pipeline
+    self.lock = threading.Lock()
+    self.lastMode = None
+    self.run = 0
+    self.skipped = 0
+
+  # Average luminance of each grid cell as a float array
+  def lumaGrid(self, data):
+    img = Image.open(io.BytesIO(data))
+    img.draft('L', (img.size[0] // 8, img.size[1] // 8))
+    small = img.convert('L').resize(self.grid, Image.BOX)
+    return numpy.asarray(small, dtype=numpy.float32)
+
+  # Mean and largest cell change between two grids
+  def change(self, grid):
+    diff = numpy.abs(grid - self.lastGrid)
+    return float(diff.mean()), float(diff.max())
+
+  # Kept image a duplicate can repeat or None if it was offloaded or deleted
+  def reference(self):
+    with self.lock:
+      if self.keptStored and not os.path.exists(self.lastKept[1]):
+        return None
+      return self.lastKept
+
+  # Store stage calls this after writing a frame. ref is the seq the frame
+  # repeated if it was stored in place of a missing image
+  def stored(self, frame, ref=0):
+    with self.lock:
+      if self.lastKept is not None and (ref or frame['seq']) == self.lastKept[0]:
+        self.lastKept = (frame['seq'], frame['filename'])
+        self.keptStored = True
+
+  # Pipeline stage. Marks unchanged frames with ref so storeImage only records them
+  def process(self, frame):
+    with stats.timer('dedup'):
+      grid = self.lumaGrid(frame['data'])
+    if self.lastGrid is not None and self.run < self.maxRun and frame['mode'] == self.lastMode:
+      meanChange, maxChange = self.change(grid)
+      reference = self.reference()
+      if meanChange < self.threshold and maxChange < self.cellThreshold and reference is not None:
+        frame['ref'], frame['refFilename'] = reference
+        self.run += 1
+        self.skipped += 1
+        stats.count('dedup_frames')
+        stats.count('dedup_bytes_saved', len(frame['data']))
+        if self.verbose:
+          print "FrameDeduplicator - seq=%i same as %i change mean=%.2f max=%.1f" % ( frame['seq'], frame['ref'], meanChange, maxChange )
+        return frame
+    self.lastGrid = grid
+    self.lastMode = frame['mode']
+    with self.lock:
+      self.lastKept = (frame['seq'], frame['filename'])
+      self.keptStored = False
+    self.run = 0
+    return frame
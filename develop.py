@@ -0,0 +1,281 @@
+#!/usr/bin/python
+# develop.py - Batch raw developer for rpi-timelapse.py rawCapture images
+#
+# With rawCapture = True every image rpi-timelapse.py stores is the camera
+# jpeg with the raw Bayer sensor data appended, and the Pi does no other
+# processing.  Run this on a bigger linux box with a copy of the images and
+# the frame manifest.  Each frame is developed in a pool of worker processes
+# with vectorized numpy
+#
+#   unpack the 10 bit pixels, subtract the sensor black level
+#   white balance (grey world per frame or fixed --wb gains)
+#   bilinear demosaic, crop to the aspect ratio of the camera jpeg
+#   gamma, resize to the jpeg size (or --width/--height)
+#   noise reduction. Chroma blur plus luma smoothing scaled by the frame iso
+#   date/time stamp from the manifest record and save as jpeg
+#
+# The developed images go to the output folder under the same path as in the
+# manifest eg developed/images/20261018/17/front-10000.jpg so set makemovie.py
+# developedDir to the output folder.  Frames without raw data (eg burst
+# images) are copied unchanged.  Frames already developed are skipped so it
+# can be run again from cron as new images arrive.
+#
+# python ./develop.py rpi-timelapse.manifest developed
+# python ./develop.py rpi-timelapse.manifest developed --images /mnt/nas/xbmc --wb 1.6,1.5 --workers 8
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import time
+import multiprocessing
+import numpy
+from PIL import Image
+
+import manifest
+import overlay
+import storage
+import timelapsecam
+
+developQuality = 90
+noiseReduction = 0.5     # 0=Off 1=Strongest. Scaled by the frame iso up to nightIso
+nightIso = 800           # Full noiseReduction at this iso and above
+gamma = 2.2
+defaultWb = (1.5, 1.5)   # Red and blue gains when too much of the frame is clipped for grey world
+imageNamePrefix = 'front-'
+
+# Row and column of the red, green, green and blue pixels of each 2x2 block for each bayer order
+BAYER_OFFSETS = {
+  0: ((0, 0), (0, 1), (1, 0), (1, 1)),   # RGGB
+  1: ((1, 0), (0, 0), (1, 1), (0, 1)),   # GBRG
+  2: ((1, 1), (0, 1), (1, 0), (0, 0)),   # BGGR
+  3: ((0, 1), (0, 0), (1, 1), (1, 0)),   # GRBG
+}
+
+dateOverlay = None   # Per worker process
+
+# Unpack a raw Bayer block to a (height, width) uint16 array of 10 bit values.
+# Returns the mosaic, bayer order and sensor black level
+def unpackRaw(raw):
+  name, width, height, black = timelapsecam.RAW_SENSORS[len(raw)]
+  order = timelapsecam.RAW_HEADER.unpack_from(raw)[8]
+  stride = (width * 5 // 4 + 31) // 32 * 32
+  packed = numpy.frombuffer(raw, dtype=numpy.uint8, count=stride * height, offset=timelapsecam.RAW_HEADER_SIZE)
+  packed = packed.reshape(height, stride)[:, :width * 5 // 4].reshape(height, width // 4, 5).astype(numpy.uint16)
+  # 4 bytes of high bits then one byte with the low 2 bits of each pixel
+  values = (packed[:, :, :4] << 2) | ((packed[:, :, 4:] >> numpy.array([6, 4, 2, 0], dtype=numpy.uint16)) & 3)
+  return values.reshape(height, width), order, black
+
+# Centre crop a mosaic to an aspect ratio like the camera does for the jpeg.
+# Offsets are even so the bayer order does not change
+def cropMosaic(mosaic, aspect):
+  height, width = mosaic.shape
+  if width > height * aspect:
+    newWidth = int(height * aspect) // 2 * 2
+    left = (width - newWidth) // 4 * 2
+    return mosaic[:, left:left + newWidth]
+  newHeight = int(width / aspect) // 2 * 2
+  top = (height - newHeight) // 4 * 2
+  return mosaic[top:top + newHeight, :]
+
+# Red and blue gains that make the average of the unclipped pixels grey
+def greyWorld(linear, order):
+  (ry, rx), (gy, gx), (Gy, Gx), (by, bx) = BAYER_OFFSETS[order]
+  sample = lambda y, x: linear[y::8, x::8]
+  red, green, blue = sample(ry, rx), sample(gy, gx), sample(by, bx)
+  unclipped = (red < 0.95) & (green < 0.95) & (blue < 0.95)
+  if unclipped.mean() < 0.01:
+    return defaultWb
+  green = max(float(green[unclipped].mean()), 1e-6)
+  redGain = green / max(float(red[unclipped].mean()), 1e-6)
+  blueGain = green / max(float(blue[unclipped].mean()), 1e-6)
+  return min(max(redGain, 0.5), 4.0), min(max(blueGain, 0.5), 4.0)
+
+# Sum of each pixel and its neighbours weighted 1 2 1 in both directions
+def smooth121(plane):
+  padded = numpy.pad(plane, 1, mode='reflect')
+  rows = padded[:, :-2] + 2 * padded[:, 1:-1] + padded[:, 2:]
+  return rows[:-2] + 2 * rows[1:-1] + rows[2:]
+
+# Bilinear demosaic of a linear mosaic to a (height, width, 3) float32 array
+def demosaic(linear, order):
+  (ry, rx), (gy, gx), (Gy, Gx), (by, bx) = BAYER_OFFSETS[order]
+  height, width = linear.shape
+  rgb = numpy.empty((height, width, 3), dtype=numpy.float32)
+  for channel, (y, x) in ((0, (ry, rx)), (2, (by, bx))):
+    plane = numpy.zeros_like(linear)
+    plane[y::2, x::2] = linear[y::2, x::2]
+    rgb[:, :, channel] = smooth121(plane) / 4
+  plane = numpy.zeros_like(linear)
+  plane[gy::2, gx::2] = linear[gy::2, gx::2]
+  plane[Gy::2, Gx::2] = linear[Gy::2, Gx::2]
+  padded = numpy.pad(plane, 1, mode='reflect')
+  rgb[:, :, 1] = plane + (padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]) / 4
+  return rgb
+
+# Mean of each pixel and its neighbours within radius using an integral image
+def boxBlur(plane, radius):
+  size = 2 * radius + 1
+  padded = numpy.pad(plane, ((radius + 1, radius), (radius + 1, radius)), mode='edge')
+  total = padded.cumsum(axis=0, dtype=numpy.float64).cumsum(axis=1)
+  return ((total[size:, size:] - total[:-size, size:] - total[size:, :-size] + total[:-size, :-size])
+          / (size * size)).astype(numpy.float32)
+
+# Blur the colour differences (most of the high iso noise) and smooth the luma
+# a little. strength 0-1
+def denoise(rgb, strength):
+  if strength <= 0:
+    return rgb
+  luma = rgb[:, :, 0] * 0.299 + rgb[:, :, 1] * 0.587 + rgb[:, :, 2] * 0.114
+  red = boxBlur(rgb[:, :, 0] - luma, 1 + int(round(3 * strength)))
+  blue = boxBlur(rgb[:, :, 2] - luma, 1 + int(round(3 * strength)))
+  luma += (boxBlur(luma, 1) - luma) * (0.5 * strength)
+  out = numpy.empty_like(rgb)
+  out[:, :, 0] = luma + red
+  out[:, :, 2] = luma + blue
+  out[:, :, 1] = (luma - out[:, :, 0] * 0.299 - out[:, :, 2] * 0.114) / 0.587
+  return out
+
+# Develop a raw Bayer block to a PIL image of size with the field of view of a
+# jpeg of jpegSize. options as for the command line
+def developRaw(raw, jpegSize, size, iso, options):
+  mosaic, order, black = unpackRaw(raw)
+  mosaic = cropMosaic(mosaic, jpegSize[0] / float(jpegSize[1]))
+  linear = (mosaic.astype(numpy.float32) - black) * (options.brightness / (1023.0 - black))
+  numpy.maximum(linear, 0.0, out=linear)
+  redGain, blueGain = options.wb or greyWorld(linear, order)
+  (ry, rx), (gy, gx), (Gy, Gx), (by, bx) = BAYER_OFFSETS[order]
+  linear[ry::2, rx::2] *= redGain
+  linear[by::2, bx::2] *= blueGain
+  numpy.minimum(linear, 1.0, out=linear)
+  rgb = demosaic(linear, order) ** (1.0 / gamma) * 255.0
+  img = Image.fromarray(numpy.clip(rgb, 0, 255).astype(numpy.uint8), 'RGB')
+  if img.size != size:
+    img = img.resize(size, Image.BICUBIC)
+  strength = options.nr * min(max(iso, 100) / float(nightIso), 1.0)
+  if strength > 0:
+    rgb = denoise(numpy.asarray(img, dtype=numpy.float32), strength)
+    img = Image.fromarray(numpy.clip(rgb + 0.5, 0, 255).astype(numpy.uint8), 'RGB')
+  return img
+
+# Date/time stamp text like rpi-timelapse.py imageTextFor()
+def stampText(record, options):
+  local = time.localtime(record['time'])
+  text = time.strftime('%Y%m%d-%H:%M:%S', local)
+  if options.number:
+    text = "%i    %s" % (record['seq'], text)
+  return options.prefix + text
+
+# Develop one frame. Runs in a worker process.
+# job is (source, destination, text, iso, options). Returns (destination, result)
+def developFrame(job):
+  global dateOverlay
+  source, destination, text, iso, options = job
+  tmpName = destination + '.tmp'
+  try:
+    storage.makeDirs(os.path.dirname(destination))
+    with open(source, 'rb') as f:
+      data = f.read()
+    jpeg, raw = timelapsecam.splitBayer(data)
+    if raw is None:
+      shutil.copyfile(source, tmpName)
+      os.rename(tmpName, destination)
+      return destination, 'copied'
+    jpegSize = Image.open(io.BytesIO(jpeg)).size
+    size = (options.width or jpegSize[0], options.height or jpegSize[1])
+    img = developRaw(raw, jpegSize, size, iso, options)
+    if text is not None:
+      if dateOverlay is None or (dateOverlay.width, dateOverlay.height) != size:
+        dateOverlay = overlay.DateOverlay(size[0], size[1], options.bottom, options.white)
+      img = dateOverlay.stampImage(img, text)
+    img.save(tmpName, 'JPEG', quality=options.quality)
+    os.rename(tmpName, destination)
+    return destination, 'developed'
+  except (IOError, OSError, KeyError, ValueError) as err:
+    if os.path.exists(tmpName):
+      os.remove(tmpName)
+    return destination, 'ERROR %s' % err
+
+# Find an image in the manifest folder or one of the imageDirs it was moved to
+def findImage(frameManifest, record, imageDirs):
+  filename = frameManifest.imagePath(record)
+  if os.path.exists(filename):
+    return filename
+  for imageDir in imageDirs:
+    for altName in (os.path.join(imageDir, record['path']), os.path.join(imageDir, os.path.basename(filename))):
+      if os.path.exists(altName):
+        return altName
+  return None
+
+# Jobs for the frames not yet developed. Unchanged frames recorded by dedup.py
+# have no image of their own. Returns (jobs, missing count)
+def frameJobs(manifestPath, outputDir, options):
+  frameManifest = manifest.FrameManifest(manifestPath, readOnly=True)
+  jobs = []
+  missing = 0
+  try:
+    for record in frameManifest.records():
+      if record.get('ref'):
+        continue
+      destination = os.path.join(outputDir, record['path'])
+      if os.path.exists(destination) and not options.force:
+        continue
+      source = findImage(frameManifest, record, options.images)
+      if source is None:
+        missing += 1
+        continue
+      text = None if options.nodate else stampText(record, options)
+      jobs.append((source, destination, text, record.get('iso', 0), options))
+  finally:
+    frameManifest.close()
+  return jobs, missing
+
+def whiteBalance(value):
+  red, blue = [float(gain) for gain in value.split(',')]
+  return red, blue
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Develop rpi-timelapse.py raw Bayer images')
+  parser.add_argument('manifest', help='frame manifest written by rpi-timelapse.py')
+  parser.add_argument('output', help='folder for the developed images')
+  parser.add_argument('--images', action='append', default=[], metavar='DIR',
+                      help='other folder to look for images eg the offloadDir copy')
+  parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+  parser.add_argument('--width', type=int, default=None, help='output width. Default jpeg width')
+  parser.add_argument('--height', type=int, default=None, help='output height. Default jpeg height')
+  parser.add_argument('--quality', type=int, default=developQuality)
+  parser.add_argument('--nr', type=float, default=noiseReduction, help='noise reduction 0-1 (default %.1f)' % noiseReduction)
+  parser.add_argument('--wb', type=whiteBalance, default=None, metavar='RED,BLUE',
+                      help='fixed white balance gains eg 1.6,1.5. Default grey world for each frame')
+  parser.add_argument('--brightness', type=float, default=1.0)
+  parser.add_argument('--prefix', default=imageNamePrefix, help='date stamp text prefix')
+  parser.add_argument('--no-number', dest='number', action='store_false', help='date stamp without the image number')
+  parser.add_argument('--no-date', dest='nodate', action='store_true', help='no date/time stamp')
+  parser.add_argument('--top', dest='bottom', action='store_false', help='date stamp at the top')
+  parser.add_argument('--white', action='store_true', help='white date stamp text')
+  parser.add_argument('--force', action='store_true', help='develop frames again')
+  options = parser.parse_args()
+
+  started = time.time()
+  jobs, missing = frameJobs(options.manifest, options.output, options)
+  print "develop.py - %i frames to develop with %i workers (%i image files not found)" % ( len(jobs), options.workers, missing )
+  if not jobs:
+    sys.exit(0)
+  results = {'developed':0, 'copied':0, 'errors':0}
+  pool = multiprocessing.Pool(options.workers)
+  try:
+    for done, (destination, result) in enumerate(pool.imap_unordered(developFrame, jobs)):
+      if result in results:
+        results[result] += 1
+      else:
+        results['errors'] += 1
+        print "develop.py - %s %s" % ( destination, result )
+      if (done + 1) % 100 == 0:
+        print "Developing - %i of %i frames" % ( done + 1, len(jobs) )
+  finally:
+    pool.close()
+    pool.join()
+  seconds = time.time() - started
+  print "develop.py - developed=%i copied=%i errors=%i in %.1f sec (%.2f sec/frame)" % (
+          results['developed'], results['copied'], results['errors'], seconds, seconds / len(jobs))
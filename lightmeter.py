@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# lightmeter.py - In memory light metering for rpi-timelapse.py
+#
+# A probe image is captured into memory (not written to the SD card) using
+# whatever settings the camera currently has.  Luminance statistics are
+# calculated with numpy from a reduced size jpeg decode (1/8 scale) so only
+# a small frame is processed.  Dividing the mean luminance by the exposure
+# time and gain gives a scene light level that does not depend on the camera
+# mode or on how compressible the scene is.
+#
+# You will need to install python-numpy
+#
+# sudo apt-get install python-numpy
+
+import io
+import numpy
+from PIL import Image
+
+import stats
+
+MICRO2SECOND = 1000000  # Constant for converting Shutter Speed to Seconds
+CLIP_LOW = 8            # Mean luma below this is too dark to meter reliably
+CLIP_HIGH = 235         # Mean luma above this is too bright to meter reliably
+
+# Decode jpeg data at reduced size and return the luma values as a numpy array.
+# scale=8 uses the jpeg decoder DCT scaling so a 1920x1080 image decodes as 240x135
+def lumaArray(jpegData, scale=8):
+  img = Image.open(io.BytesIO(jpegData))
+  img.draft('L', (img.size[0] // scale, img.size[1] // scale))
+  return numpy.asarray(img.convert('L'), dtype=numpy.uint8)
+
+# Luminance statistics for a luma array
+def lumaStats(luma):
+  hist = numpy.bincount(luma.ravel(), minlength=256)
+  cumulative = numpy.cumsum(hist)
+  total = float(cumulative[-1])
+  return {
+    'mean':   float(luma.mean()),
+    'median': int(numpy.searchsorted(cumulative, total * 0.50)),
+    'p05':    int(numpy.searchsorted(cumulative, total * 0.05)),
+    'p95':    int(numpy.searchsorted(cumulative, total * 0.95)),
+    'dark':   hist[:CLIP_LOW].sum() / total,        # fraction of pixels crushed black
+    'bright': hist[CLIP_HIGH + 1:].sum() / total,   # fraction of pixels blown out
+    'hist':   hist,
+  }
+
+# Scene light level in luma per second of exposure at unity gain.
+# Roughly 10 times the lux level of the scene for the rpi camera.
+def sceneLevel(meanLuma, exposureSpeed, gain):
+  exposureSec = max(exposureSpeed, 1) / float(MICRO2SECOND)
+  return meanLuma / (exposureSec * max(gain, 0.1))
+
+# Capture a probe image into memory using the current session camera settings.
+# Returns a dict with the jpeg data, camera settings, exposure and luma statistics.
+def meterProbe(session, scale=8):
+  data, exposureSpeed, gain = session.captureToMemory()
+  probe = meterData(data, exposureSpeed, gain, scale)
+  stats.count('probes')
+  probe['settings'] = session.settings
+  return probe
+
+# Meter jpeg data already captured with exposureSpeed and gain
+def meterData(data, exposureSpeed, gain, scale=8):
+  with stats.timer('probe_decode'):
+    probe = lumaStats(lumaArray(data, scale))
+  probe['data'] = data
+  probe['exposure'] = exposureSpeed
+  probe['gain'] = gain
+  probe['level'] = sceneLevel(probe['mean'], exposureSpeed, gain)
+  probe['reliable'] = CLIP_LOW <= probe['mean'] <= CLIP_HIGH
+  return probe
+
+# Convert a scene light level to a camera mode of 'day', 'twilight' or 'night'
+def levelMode(level, dayLevel, nightLevel):
+  if level >= dayLevel:
+    return 'day'
+  elif level <= nightLevel:
+    return 'night'
+  return 'twilight'
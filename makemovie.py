@@ -1,15 +1,31 @@
 #!/usr/bin/python
 # makemovie.py  Process a series of images into an avi movie using mencoder
 # 22-Oct-2014 - written by Claude Pageau email: pageauc@gmail.com
+# 18-Oct-2026 - Streams frames in sequence order from the rpi-timelapse.py frame
+#               manifest into mencoder through a pipe.  Frames are decoded and
+#               resized by a pool of worker processes.  Only frames added since
+#               the last run are encoded as a new movie segment, then all the
+#               segments are joined into the movie without re-encoding.
+#               Optional deflicker smooths brightness jumps from twilight
+#               shutter changes and day/night switches while encoding.
+#
+# python ./makemovie.py            encode new frames and rebuild the movie
+# python ./makemovie.py rebuild    delete segments and encode all frames again
 
 print "initializing ...."
-import StringIO
-import subprocess
 import os
-import time
-import csv
-from datetime import datetime
-import cgi, cgitb
+import re
+import sys
+import shutil
+import subprocess
+import math
+import itertools
+import collections
+import multiprocessing
+import numpy
+from PIL import Image
+
+import manifest
 
 imageWidth = 1920
 imageHeight = 1080
@@ -19,26 +35,271 @@ aspectRatio = "16/9"
 # Video fps (frames per second) value usually  between 2 to 30.  I recommend 5 fps to start
 framesPerSec = 20
 # Video output filename.
-# Can also include folder path, otherwise file saved to current folder. 
+# Can also include folder path, otherwise file saved to current folder.
 movieName = "./makemovie.avi"
 
-print "makemovie.py"
-print "============"
-print "Creating makemovie.txt file of *jpg files in images folder." 
-ls_params = " -t -r ./images/*jpg > makemovie.txt"
-exit_status = subprocess.call("ls %s " % ls_params, shell=True)
+manifestPath = "./rpi-timelapse.manifest"  # Frame manifest written by rpi-timelapse.py
+imageDir = "./images"           # Used if there is no manifest. Images incl date/hour sub folders sorted by sequence number
+altImageDirs = []               # Other folders to look for images that were moved eg ['./xbmc']
+developedDir = None             # develop.py output folder eg "./developed". Used before the camera images
+segmentDir = "./movie-segments" # Folder for encoded movie segments
+decodeWorkers = multiprocessing.cpu_count()  # Processes used to decode and resize images
+
+# Deflicker evens out frame brightness using the median brightness of
+# deflickerWindow frames centred on each frame. Only half the window of
+# decoded frames is held in memory however long the movie is.
+deflicker = True
+deflickerWindow = 15     # Number of frames in the rolling window. Larger is smoother
+deflickerMaxGain = 2.0   # Limit brightness correction to this factor up or down
+deflickerPath = segmentDir + "/deflicker.dat"  # Brightness of the last frames encoded for the next run
+
+# Decode an image file to raw rgb24 bytes at the movie size plus its average
+# brightness. Runs in a worker process. Uses reduced size jpeg decoding where possible
+def decodeFrame(filename):
+  try:
+    img = Image.open(filename)
+    img.draft('RGB', (imageWidth, imageHeight))
+    if img.mode != 'RGB':
+      img = img.convert('RGB')
+    if img.size != (imageWidth, imageHeight):
+      img = img.resize((imageWidth, imageHeight), Image.BILINEAR)
+    frame = img.tobytes()
+  except IOError as err:
+    print "decodeFrame  - ERROR %s %s" % (filename, err)
+    return None
+  # Brightness from every 8th pixel of the decoded frame. No second decode needed
+  rgb = numpy.frombuffer(frame, dtype=numpy.uint8).reshape(imageHeight, imageWidth, 3)[::8, ::8]
+  luma = (rgb[:, :, 0] * 0.299 + rgb[:, :, 1] * 0.587 + rgb[:, :, 2] * 0.114).mean()
+  return frame, max(luma, 1.0)
+
+class Deflicker(object):
+  # Streaming deflicker. push() frames with their brightness and it returns
+  # frames corrected towards the rolling median brightness once enough
+  # following frames have been seen. Call flush() after the last frame.
+  def __init__(self, window, maxGain, history=()):
+    self.half = window // 2
+    self.maxGain = maxGain
+    self.logLuma = collections.deque(history, window)
+    self.waiting = collections.deque()   # frames waiting for following frames
+    self.gains = []
+
+  # Index of a frame in logLuma is len(logLuma) - len(waiting) + position in waiting
+  def _correct(self):
+    frame = self.waiting.popleft()
+    center = len(self.logLuma) - len(self.waiting) - 1
+    low = max(center - self.half, 0)
+    window = sorted(list(self.logLuma)[low:center + self.half + 1])
+    # Median ignores single frame jumps but follows gradual light changes
+    gain = math.exp(window[len(window) // 2] - self.logLuma[center])
+    gain = min(max(gain, 1.0 / self.maxGain), self.maxGain)
+    self.gains.append(gain)
+    if abs(gain - 1.0) < 0.005:
+      return frame
+    lut = numpy.clip(numpy.arange(256) * gain, 0, 255).astype(numpy.uint8)
+    return lut.take(numpy.frombuffer(frame, dtype=numpy.uint8)).tostring()
+
+  def push(self, frame, luma):
+    self.logLuma.append(math.log(luma))
+    self.waiting.append(frame)
+    ready = []
+    while len(self.waiting) > self.half:
+      ready.append(self._correct())
+    return ready
+
+  def flush(self):
+    ready = []
+    while self.waiting:
+      ready.append(self._correct())
+    return ready
+
+  # Brightness of the last frames so the next segment continues smoothly
+  def history(self):
+    return list(self.logLuma)[-self.half:] if self.half else []
+
+def readDeflickerHistory():
+  if not os.path.exists(deflickerPath):
+    return []
+  with open(deflickerPath, 'r') as f:
+    return [float(line) for line in f if line.strip()]
+
+def writeDeflickerHistory(history):
+  with open(deflickerPath + '.tmp', 'w') as f:
+    for value in history:
+      f.write("%f\n" % value)
+  os.rename(deflickerPath + '.tmp', deflickerPath)
+
+# Find an image file in the images folder or altImageDirs if it was moved.
+# offload.py keeps the manifest path eg images/front-10000.jpg under its destination
+# and so does develop.py
+def findImage(filename):
+  relName = os.path.relpath(filename, os.path.dirname(os.path.abspath(manifestPath)))
+  if developedDir is not None and os.path.exists(os.path.join(developedDir, relName)):
+    return os.path.join(developedDir, relName)
+  if os.path.exists(filename):
+    return filename
+  for altDir in altImageDirs:
+    for altName in (os.path.join(altDir, relName), os.path.join(altDir, os.path.basename(filename))):
+      if os.path.exists(altName):
+        return altName
+  return None
+
+# Image file names in sequence order starting at frame index start.
+# Uses the frame manifest or sorts the images folder by the number in the name
+def frameFiles(start):
+  if os.path.exists(manifestPath):
+    frameManifest = manifest.FrameManifest(manifestPath, readOnly=True)
+    names = [frameManifest.imagePath(record) for record in frameManifest.records(start)]
+    frameManifest.close()
+    return names
+  def sequenceKey(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+  names = []
+  for folder, dirs, files in os.walk(imageDir):
+    names.extend([os.path.join(folder, name) for name in files if name.lower().endswith('.jpg')])
+  names.sort(key=lambda name: sequenceKey(os.path.basename(name)))
+  return names[start:]
+
+# Segment files sorted by first frame index. Named seg-<first>-<last>.avi
+def segmentFiles():
+  segments = []
+  for name in os.listdir(segmentDir):
+    match = re.match(r'seg-(\d+)-(\d+)\.avi$', name)
+    if match:
+      segments.append((int(match.group(1)), int(match.group(2)), os.path.join(segmentDir, name)))
+  segments.sort()
+  return segments
+
+# Group repeats of the same file eg unchanged frames recorded by dedup.py
+# Returns a list of (filename, count) so each image is only decoded once
+def fileRuns(files):
+  runs = []
+  for name in files:
+    if runs and runs[-1][0] == name:
+      runs[-1][1] += 1
+    else:
+      runs.append([name, 1])
+  return runs
+
+# Decode the file of each run in the pool, yielding results in order. Only
+# 2 * decodeWorkers decodes are in flight so decoded frames waiting for
+# mencoder never use more than a few frames of memory
+def decodeRuns(pool, runs):
+  pending = collections.deque()
+  for name, repeats in runs:
+    if len(pending) >= 2 * decodeWorkers:
+      yield pending.popleft().get()
+    pending.append(pool.apply_async(decodeFrame, (name,)))
+  while pending:
+    yield pending.popleft().get()
 
-print "Creating movie file %s using makemovie.txt" % ( movieName )
-print "Settings = Image W=%s H=%s aspect=%s fps=%s filename=%s" % ( imageWidth, imageHeight, aspectRatio, framesPerSec, movieName )
+# Encode frame files into a segment by piping raw frames into mencoder.
+# Repeated files are decoded once and written to mencoder once per frame
+def encodeSegment(files, segmentName):
+  tmpName = segmentName + '.tmp'
+  mencoder_params = "- -demuxer rawvideo -rawvideo fps=%s:w=%s:h=%s:format=rgb24 -nosound -ovc lavc -lavcopts vcodec=mpeg4:aspect=%s:vbitrate=8000000 -o %s" % ( framesPerSec, imageWidth, imageHeight, aspectRatio, tmpName )
+  print "memcoder_params = %s" % ( mencoder_params )
+  encoder = subprocess.Popen("mencoder %s" % mencoder_params, shell=True, stdin=subprocess.PIPE)
+  pool = multiprocessing.Pool(decodeWorkers)
+  flicker = None
+  if deflicker:
+    flicker = Deflicker(deflickerWindow, deflickerMaxGain, readDeflickerHistory())
+  written = 0
+  missing = 0
+  runs = fileRuns(files)
+  try:
+    for decoded, (name, repeats) in itertools.izip(decodeRuns(pool, runs), runs):
+      if decoded is None:
+        missing += repeats
+        continue
+      frame, luma = decoded
+      if flicker is None:
+        ready = [frame] * repeats
+      else:
+        ready = []
+        for i in range(repeats):
+          ready.extend(flicker.push(frame, luma))
+      try:
+        for frame in ready:
+          encoder.stdin.write(frame)
+          written += 1
+      except IOError as err:
+        print "ERROR - Writing to mencoder %s" % ( err )
+        break
+      if written and written % 100 == 0:
+        print "Encoding     - %i of %i frames" % ( written, len(files) )
+    else:
+      if flicker is not None:
+        for frame in flicker.flush():
+          encoder.stdin.write(frame)
+          written += 1
+  finally:
+    pool.close()
+    pool.join()
+    encoder.stdin.close()
+  exit_status = encoder.wait()
+  if exit_status != 0 or written == 0:
+    print "ERROR - mencoder exit status %s with %i frames. Segment not saved" % ( exit_status, written )
+    if os.path.exists(tmpName):
+      os.remove(tmpName)
+    return False
+  os.rename(tmpName, segmentName)
+  if flicker is not None:
+    writeDeflickerHistory(flicker.history())
+    if flicker.gains:
+      print "Deflicker    - gain min=%.2f max=%.2f" % ( min(flicker.gains), max(flicker.gains) )
+  print "Segment      - %s %i frames (%i missing)" % ( segmentName, written, missing )
+  return True
 
-mencoder_params = "-nosound -ovc lavc -lavcopts vcodec=mpeg4:aspect=%s:vbitrate=8000000 -vf scale=%s:%s -o %s -mf type=jpeg:fps=%s  mf://@makemovie.txt" % ( aspectRatio, imageWidth, imageHeight, movieName, framesPerSec )
-print "memcoder_params = %s" % ( mencoder_params )
-print "Creating Movie. This will take a while ......."
-print "----------------------------------------------"
+# Join segments into the movie without re-encoding
+def joinSegments(segments):
+  names = [name for first, last, name in segments]
+  if len(names) == 1:
+    shutil.copyfile(names[0], movieName)
+    return 0
+  tmpName = movieName + '.tmp.avi'
+  exit_status = subprocess.call(["mencoder", "-nosound", "-ovc", "copy", "-o", tmpName] + names)
+  if exit_status == 0:
+    os.rename(tmpName, movieName)
+  return exit_status
 
+if __name__ == '__main__':
+  print "makemovie.py"
+  print "============"
+  if not os.path.isdir(segmentDir):
+    os.makedirs(segmentDir)
+  if len(sys.argv) > 1 and sys.argv[1] == 'rebuild':
+    print "Deleting movie segments in %s" % ( segmentDir )
+    for first, last, name in segmentFiles():
+      os.remove(name)
+    if os.path.exists(deflickerPath):
+      os.remove(deflickerPath)
 
-exit_status = subprocess.call("mencoder %s" % mencoder_params, shell=True)
-print "makemovie.py"
-print "============"
-print "Finished timelapse movie filename= %s" % ( movieName )
+  segments = segmentFiles()
+  if segments:
+    start = segments[-1][1] + 1
+  else:
+    start = 0
+  files = [findImage(name) for name in frameFiles(start)]
+  missing = len([name for name in files if name is None])
+  files = [name for name in files if name is not None]
+  print "Settings = Image W=%s H=%s aspect=%s fps=%s filename=%s" % ( imageWidth, imageHeight, aspectRatio, framesPerSec, movieName )
+  print "Frames   = %i new frames from frame %i  (%i image files not found)" % ( len(files) + missing, start, missing )
+  if files:
+    segmentName = os.path.join(segmentDir, "seg-%08i-%08i.avi" % ( start, start + len(files) + missing - 1 ))
+    print "Creating movie segment %s. This will take a while ......." % ( segmentName )
+    print "----------------------------------------------"
+    if not encodeSegment(files, segmentName):
+      sys.exit(1)
+    segments = segmentFiles()
+  if not segments:
+    print "No images found. Nothing to do"
+    sys.exit(0)
 
+  print "Joining %i segments into movie file %s" % ( len(segments), movieName )
+  exit_status = joinSegments(segments)
+  if exit_status != 0:
+    print "ERROR - mencoder exit status %s joining segments. Movie not updated" % ( exit_status )
+    sys.exit(1)
+  print "makemovie.py"
+  print "============"
+  print "Finished timelapse movie filename= %s" % ( movieName )
@@ -0,0 +1,223 @@
+#!/usr/bin/python
+# manifest.py - Crash safe append only frame manifest for rpi-timelapse.py
+#
+# One fixed length text record is appended per stored image.  Fields are
+# comma separated and padded with spaces so every record is RECORD_SIZE bytes
+# long including the newline.  That means
+#   - the last record (used to resume the image counter) is read with one seek
+#   - record n is at byte n * RECORD_SIZE so lookups do not scan the file
+#   - a record cut short by a power failure is detected and removed on open
+# Each record is written with a single write() to a file opened in append
+# mode and flushed to disk with fsync() so existing records are never rewritten.
+#
+# Downstream programs (makemovie.py etc) read the manifest instead of
+# listing the images folder.  To query it from the command line
+#
+# python ./manifest.py rpi-timelapse.manifest count
+# python ./manifest.py rpi-timelapse.manifest last
+# python ./manifest.py rpi-timelapse.manifest seq 10050
+# python ./manifest.py rpi-timelapse.manifest time 20261018-1700
+
+import os
+import sys
+import threading
+import time
+
+RECORD_SIZE = 192
+# ref is the seq of an earlier image used for this frame when it was not stored (see dedup.py)
+FIELDS = ('seq', 'time', 'mode', 'shutter', 'iso', 'daySize', 'nightSize', 'level', 'bytes', 'path', 'ref')
+INT_FIELDS = ('seq', 'time', 'shutter', 'iso', 'daySize', 'nightSize', 'bytes', 'ref')
+FLOAT_FIELDS = ('level',)   # Night light levels are below 1. Older records have whole numbers
+
+# Convert a record dict to a fixed length line
+def formatRecord(record):
+  values = []
+  for field in FIELDS:
+    value = record.get(field, '')
+    if field in INT_FIELDS:
+      value = int(value or 0)
+    elif field in FLOAT_FIELDS:
+      value = "%g" % float(value or 0)
+    values.append(str(value).replace(',', '_'))
+  line = ','.join(values)
+  if len(line) >= RECORD_SIZE:
+    raise ValueError("Manifest record too long %s" % line)
+  return line.ljust(RECORD_SIZE - 1) + '\n'
+
+# True if a record dict fits in RECORD_SIZE. Check before storing an image
+# as a path that is too long makes formatRecord raise ValueError
+def recordFits(record):
+  try:
+    formatRecord(record)
+  except ValueError:
+    return False
+  return True
+
+# Convert a fixed length line back to a record dict. Extra fields are ignored
+# and missing fields (records written by an older version) are left out
+def parseRecord(line):
+  record = {}
+  for field, value in zip(FIELDS, line.rstrip().split(',')):
+    if field in INT_FIELDS:
+      value = int(value or 0)
+    elif field in FLOAT_FIELDS:
+      value = float(value or 0)
+    record[field] = value
+  return record
+
+class FrameManifest(object):
+  # readOnly=True for programs reading a manifest while rpi-timelapse.py
+  # is appending to it. A partly written last record is ignored not removed
+  def __init__(self, filename, readOnly=False):
+    self.filename = filename
+    self.baseDir = os.path.dirname(os.path.abspath(filename))
+    # Pipeline stages read and append on their own threads. Appends move the
+    # shared file offset so each seek and read is done under the lock
+    self.lock = threading.Lock()
+    if readOnly:
+      self.fd = os.open(filename, os.O_RDONLY)
+    else:
+      self.fd = os.open(filename, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0644)
+      self.recover()
+
+  # Remove a partly written record left by a power failure
+  def recover(self):
+    size = os.fstat(self.fd).st_size
+    extra = size % RECORD_SIZE
+    if extra:
+      os.ftruncate(self.fd, size - extra)
+      os.fsync(self.fd)
+    # A record without its newline was also cut short
+    while self.count() > 0 and self._read(self.count() - 1)[-1:] != '\n':
+      os.ftruncate(self.fd, (self.count() - 1) * RECORD_SIZE)
+      os.fsync(self.fd)
+    return extra
+
+  def close(self):
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
+
+  def count(self):
+    return os.fstat(self.fd).st_size // RECORD_SIZE
+
+  # Read size bytes at offset
+  def _readAt(self, offset, size):
+    with self.lock:
+      os.lseek(self.fd, offset, os.SEEK_SET)
+      return os.read(self.fd, size)
+
+  def _read(self, index):
+    return self._readAt(index * RECORD_SIZE, RECORD_SIZE)
+
+  # Record at position index. Negative index counts back from the end
+  def record(self, index):
+    count = self.count()
+    if index < 0:
+      index += count
+    if index < 0 or index >= count:
+      raise IndexError("Manifest record %i not found" % index)
+    return parseRecord(self._read(index))
+
+  def last(self):
+    if self.count() == 0:
+      return None
+    return self.record(-1)
+
+  # Append a record dict and flush it to disk. Returns the record position
+  def append(self, record):
+    line = formatRecord(record)
+    with self.lock:
+      os.write(self.fd, line)
+      os.fsync(self.fd)
+      return self.count() - 1
+
+  # Full path of the image for a record
+  def imagePath(self, record):
+    return os.path.join(self.baseDir, record['path'])
+
+  # Path stored in a record. Relative to the manifest folder to keep records short
+  def relativePath(self, filename):
+    return os.path.relpath(filename, self.baseDir)
+
+  # Records in file order starting at position start
+  def records(self, start=0):
+    count = self.count()
+    index = start
+    while index < count:
+      block = self._readAt(index * RECORD_SIZE, min(count - index, 512) * RECORD_SIZE)
+      for offset in range(0, len(block), RECORD_SIZE):
+        yield parseRecord(block[offset:offset + RECORD_SIZE])
+      index += len(block) // RECORD_SIZE
+
+  # Position of the first record with field >= value. Binary search so the
+  # field must increase through the file eg time, or seq unless recycled
+  def bisect(self, field, value):
+    low = 0
+    high = self.count()
+    while low < high:
+      middle = (low + high) // 2
+      if self.record(middle)[field] < value:
+        low = middle + 1
+      else:
+        high = middle
+    return low
+
+  # Record with sequence number seq or None. Sequence numbers are normally
+  # consecutive so the record is found directly without searching
+  def find(self, seq):
+    count = self.count()
+    if count == 0:
+      return None
+    guess = seq - self.record(0)['seq']
+    if 0 <= guess < count:
+      record = self.record(guess)
+      if record['seq'] == seq:
+        return record
+    index = self.bisect('seq', seq)
+    if index < count:
+      record = self.record(index)
+      if record['seq'] == seq:
+        return record
+    # numberRecycle restarts the sequence so check the newest records
+    for index in range(count - 1, -1, -1):
+      record = self.record(index)
+      if record['seq'] == seq:
+        return record
+    return None
+
+  # Record closest to and not before epoch seconds timeNow or None
+  def findTime(self, timeNow):
+    index = self.bisect('time', timeNow)
+    if index < self.count():
+      return self.record(index)
+    return None
+
+if __name__ == '__main__':
+  if len(sys.argv) < 3:
+    print "Usage: python ./manifest.py manifestfile count|last|seq number|time yyyymmdd-hhmm"
+    sys.exit(1)
+  if not os.path.exists(sys.argv[1]):
+    print "Manifest %s not found" % sys.argv[1]
+    sys.exit(1)
+  # Read only so a record rpi-timelapse.py is appending is never truncated
+  frameManifest = FrameManifest(sys.argv[1], readOnly=True)
+  command = sys.argv[2]
+  if command == 'count':
+    print frameManifest.count()
+    sys.exit(0)
+  elif command == 'last':
+    record = frameManifest.last()
+  elif command == 'seq':
+    record = frameManifest.find(int(sys.argv[3]))
+  elif command == 'time':
+    record = frameManifest.findTime(time.mktime(time.strptime(sys.argv[3], '%Y%m%d-%H%M')))
+  else:
+    print "Unknown command %s" % command
+    sys.exit(1)
+  if record is None:
+    print "Not Found"
+    sys.exit(1)
+  for field in FIELDS:
+    if field in record:
+      print "%-9s = %s" % (field, record[field])
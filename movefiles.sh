@@ -2,8 +2,10 @@
 
 # movefiles.sh - written by Claude Pageau based on script by zengargoyle
 # This script will move files from the local SD card images
-# folder to a remote network share mount excluding the most recent file since
-# it still might be updating.  This avoids a rpi-timelapse.py crash
+# folder to a remote network share mount using offload.py.  Images are
+# copied in rpi-timelapse.manifest order so an image still being written is
+# never moved, and each copy is checksum verified before the local image is
+# deleted.  An interrupted copy is resumed on the next run.
 # Note xbmc in the example below is a folder mounted on a remote
 # disk drive share.  You can mount the external share by adding
 # the appropriate entry to the /etc/fstab
@@ -27,28 +29,11 @@
 # This would execute movefiles.sh every 15 minutes
 #
 # */15 * * * * /home/pi/rpi-timelapse/movefiles.sh
+#
+# Not needed if offloadDir is set in rpi-timelapse.py
 
-files_to_check=/home/pi/rpi-timelapse/images/*jpg
-command_to_run='mv -f '
+the_manifest=/home/pi/rpi-timelapse/rpi-timelapse.manifest
 the_destination=/home/pi/rpi-timelapse/xbmc
 
-# looking for files matching $files_to_check
-# ls -t sorts files by last modification time, most recent to oldest
-
-ls -t $files_to_check |
-(
-
-  # the first line will be the most recent file
-
-  read the_most_recent_file
-  # do nothing with the most recent file: $the_most_recent_file
-
-
-  # the rest of the lines will not be the most recent file
-
-  # do something with the rest of the files
-  while read not_the_most_recent_file
-  do
-    $command_to_run $not_the_most_recent_file $the_destination
-  done
-)
+# Images are copied to $the_destination/images/
+exec python /home/pi/rpi-timelapse/offload.py $the_destination $the_manifest
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# offload.py - Copy stored images to a network share or other folder for rpi-timelapse.py
+#
+# Images are taken from the frame manifest in the order they were stored so
+# only complete images are ever copied.  Each batch is copied by a few
+# threads at a limited rate so the copy does not starve the capture of SD
+# card or network bandwidth.  Every copy is written to a .part file, read back
+# and checked against a sha1 checksum of the original before it is renamed
+# and the local image is deleted.  An interrupted copy continues from the end
+# of its .part file and is checked the same way.
+#
+# The manifest position of the next image to copy is kept in the
+# rpi-timelapse.offload file so a restart carries on where it left off.
+#
+# rpi-timelapse.py runs this in a background thread if offloadDir is set.
+# It can also be run from cron (see movefiles.sh)
+#
+# python ./offload.py destination [manifestfile]
+
+import errno
+import fcntl
+import hashlib
+import os
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import manifest
+import stats
+
+CHUNK_SIZE = 256 * 1024
+
+class RateLimiter(object):
+  # Token bucket shared by the copy threads. maxBytesPerSec=0 for no limit
+  def __init__(self, maxBytesPerSec=0, sleep=time.sleep, clock=time.time):
+    self.maxBytesPerSec = maxBytesPerSec
+    self.sleep = sleep
+    self.clock = clock
+    self.lock = threading.Lock()
+    self.allowance = 0.0
+    self.lastTime = clock()
+
+  def consume(self, nbytes):
+    if self.maxBytesPerSec <= 0:
+      return
+    with self.lock:
+      now = self.clock()
+      self.allowance = min(self.allowance + (now - self.lastTime) * self.maxBytesPerSec,
+                           self.maxBytesPerSec)
+      self.lastTime = now
+      self.allowance -= nbytes
+      wait = -self.allowance / float(self.maxBytesPerSec)
+    if wait > 0:
+      self.sleep(wait)
+
+# File holding the manifest position of the next image to offload
+def cursorPath(manifestPath):
+  return os.path.splitext(manifestPath)[0] + '.offload'
+
+# Number of manifest records already offloaded
+def readCursor(manifestPath):
+  try:
+    with open(cursorPath(manifestPath), 'r') as f:
+      return int(f.read().strip() or 0)
+  except (IOError, ValueError):
+    return 0
+
+def fileHash(filename, limiter=None):
+  sha = hashlib.sha1()
+  with open(filename, 'rb') as f:
+    while True:
+      chunk = f.read(CHUNK_SIZE)
+      if not chunk:
+        break
+      if limiter is not None:
+        limiter.consume(len(chunk))
+      sha.update(chunk)
+  return sha.hexdigest()
+
+class Offloader(object):
+  def __init__(self, manifestPath, destDir, workers=2, batchSize=20,
+               maxBytesPerSec=0, delete=True, verbose=False):
+    self.manifestPath = manifestPath
+    self.destDir = destDir
+    self.workers = workers
+    self.batchSize = batchSize
+    self.delete = delete
+    self.verbose = verbose
+    self.limiter = RateLimiter(maxBytesPerSec)
+    self.cursorPath = cursorPath(manifestPath)
+    self.lockPath = self.cursorPath + '.lock'
+    self.copied = 0
+    self.skipped = 0
+    self.failed = 0
+    self.bytesCopied = 0
+
+  # Manifest position of the next image to copy
+  def cursor(self):
+    return readCursor(self.manifestPath)
+
+  def setCursor(self, index):
+    tmpName = self.cursorPath + '.tmp'
+    with open(tmpName, 'w') as f:
+      f.write("%i\n" % index)
+      f.flush()
+      os.fsync(f.fileno())
+    os.rename(tmpName, self.cursorPath)
+
+  def destPath(self, record):
+    return os.path.join(self.destDir, record['path'])
+
+  # Copy one image. Returns 'copied' when the image is safely at the destination,
+  # 'skipped' if there is nothing to copy or None if the copy failed
+  def copyFrame(self, frameManifest, record):
+    if record.get('ref'):
+      return 'skipped'   # Frame uses an earlier image. See dedup.py
+    src = frameManifest.imagePath(record)
+    dest = self.destPath(record)
+    part = dest + '.part'
+    if not os.path.exists(src):
+      if os.path.exists(dest):
+        return 'copied'   # Copied and deleted before the cursor was saved
+      if not record.get('bytes'):
+        return 'skipped'   # Nothing was stored for this record
+      print "Offloader         - WARNING %s not found. Skipped" % src
+      return 'skipped'
+    try:
+      srcHash = fileHash(src)
+      if os.path.exists(dest) and fileHash(dest, self.limiter) == srcHash:
+        self._finish(src)
+        return 'copied'
+      destDir = os.path.dirname(dest)
+      if not os.path.isdir(destDir):
+        try:
+          os.makedirs(destDir)
+        except OSError as err:
+          if err.errno != errno.EEXIST:
+            raise
+      srcSize = os.path.getsize(src)
+      offset = 0
+      if os.path.exists(part):
+        offset = os.path.getsize(part)
+        if offset > srcSize:
+          offset = 0
+      with open(src, 'rb') as fin:
+        with open(part, 'r+b' if offset else 'wb') as fout:
+          fin.seek(offset)
+          fout.seek(offset)
+          fout.truncate()
+          while True:
+            chunk = fin.read(CHUNK_SIZE)
+            if not chunk:
+              break
+            self.limiter.consume(len(chunk))
+            fout.write(chunk)
+            self.bytesCopied += len(chunk)
+            stats.count('offload_bytes', len(chunk))
+          fout.flush()
+          os.fsync(fout.fileno())
+      if fileHash(part, self.limiter) != srcHash:
+        os.remove(part)
+        if offset:
+          # The resumed .part file was bad. Copy the whole image again
+          return self.copyFrame(frameManifest, record)
+        print "Offloader         - ERROR checksum mismatch %s. Will retry" % dest
+        return None
+      os.rename(part, dest)
+      self._finish(src)
+      stats.count('offload_images')
+      if self.verbose:
+        print "Offloader         - Copied %s" % dest
+      return 'copied'
+    except (IOError, OSError) as err:
+      print "Offloader         - ERROR %s %s" % (src, err)
+      return None
+
+  def _finish(self, src):
+    if self.delete:
+      os.remove(src)
+
+  # Copy all images added to the manifest since the last run.
+  # Returns the number of images copied. Stops at the first batch with a failure
+  def runOnce(self):
+    lock = open(self.lockPath, 'w')
+    try:
+      fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+      lock.close()
+      return 0   # Another offload is already running
+    if not os.path.exists(self.manifestPath):
+      lock.close()
+      return 0
+    frameManifest = manifest.FrameManifest(self.manifestPath, readOnly=True)
+    pool = ThreadPool(self.workers)
+    copied = 0
+    try:
+      index = self.cursor()
+      count = frameManifest.count()
+      while index < count:
+        batch = [frameManifest.record(i) for i in range(index, min(index + self.batchSize, count))]
+        results = pool.map(lambda record: self.copyFrame(frameManifest, record), batch)
+        # Only move the cursor past images that were all copied
+        done = 0
+        for result in results:
+          if not result:
+            break
+          done += 1
+          if result == 'copied':
+            copied += 1
+          else:
+            self.skipped += 1
+        index += done
+        self.setCursor(index)
+        if done < len(batch):
+          self.failed += 1
+          break
+    finally:
+      pool.close()
+      pool.join()
+      frameManifest.close()
+      lock.close()
+    self.copied += copied
+    return copied
+
+class OffloadWorker(object):
+  # Runs an Offloader every intervalSec in a background thread
+  def __init__(self, offloader, intervalSec=15*60):
+    self.offloader = offloader
+    self.intervalSec = intervalSec
+    self.stopEvent = threading.Event()
+    self.thread = threading.Thread(target=self._run, name='offload')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def _run(self):
+    while not self.stopEvent.is_set():
+      try:
+        self.offloader.runOnce()
+      except Exception as err:
+        print "OffloadWorker     - ERROR %s" % err
+      self.stopEvent.wait(self.intervalSec)
+
+  def close(self):
+    self.stopEvent.set()
+    self.thread.join()
+
+if __name__ == '__main__':
+  if len(sys.argv) < 2:
+    print "Usage: python ./offload.py destination [manifestfile]"
+    sys.exit(1)
+  destination = sys.argv[1]
+  if len(sys.argv) > 2:
+    manifestPath = sys.argv[2]
+  else:
+    manifestPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rpi-timelapse.manifest')
+  offloader = Offloader(manifestPath, destination, verbose=True)
+  copied = offloader.runOnce()
+  print "offload.py - Copied %i images to %s. Skipped %i" % (copied, destination, offloader.skipped)
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+# overlay.py - Date/time text overlay for rpi-timelapse.py images
+#
+# The font is loaded once and each text is rendered as a small band sprite
+# that is pasted onto the image.  Where the camera can burn the text into the
+# image itself (picamera annotate_text) no decode/re-encode is needed at all.
+# Otherwise rpi-timelapse.py stamps images in a pipeline.py worker thread
+# so the next capture is never delayed by post processing.
+
+import io
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+FONT_PATH = '/usr/share/fonts/truetype/freefont/FreeSansBold.ttf'
+
+class DateOverlay(object):
+  # Renders text sprites with a cached font and pastes them onto images
+  def __init__(self, width, height, bottom=True, white=False,
+               fontPath=FONT_PATH, fontSize=24):
+    self.width = width
+    self.height = height
+    self.bottom = bottom
+    if white:
+      self.foreground = ( 255, 255, 255 )  # rgb settings for white text foreground
+    else:
+      self.foreground = ( 0, 0, 0 )  # rgb settings for black text foreground
+    try:
+      self.font = ImageFont.truetype(fontPath, fontSize, encoding='unic')
+    except IOError:
+      self.font = ImageFont.load_default()
+    self._sprite = (None, None, None)   # last text, mask and position
+
+  # Render text to an 'L' mask the size of the text band plus its position
+  def sprite(self, text):
+    if self._sprite[0] != text:
+      if isinstance(text, str):
+        text = text.decode('utf-8')
+      textWidth, textHeight = self.font.getsize(text)
+      mask = Image.new('L', (textWidth, textHeight), 0)
+      ImageDraw.Draw(mask).text((0, 0), text, 255, font=self.font)
+      x = max(int((self.width - textWidth) / 2), 0)  # centre text
+      if self.bottom:
+        y = self.height - 50  # show text at bottom of image
+      else:
+        y = 10  # show text at top of image
+      self._sprite = (text, mask, (x, y))
+    return self._sprite[1], self._sprite[2]
+
+  # Paste the text sprite onto a PIL image. Only the text band is touched
+  def stampImage(self, img, text):
+    mask, position = self.sprite(text)
+    img.paste(self.foreground, position + (position[0] + mask.size[0], position[1] + mask.size[1]), mask)
+    return img
+
+  # Stamp jpeg data in memory and return the new jpeg data
+  def stampJpeg(self, data, text, quality=85):
+    return jpegData(self.stampImage(Image.open(io.BytesIO(data)), text), quality)
+
+# Encode a PIL image as jpeg data in memory
+def jpegData(img, quality=85):
+  output = io.BytesIO()
+  img.save(output, 'JPEG', quality=quality)
+  return output.getvalue()
+
+# Set the camera to burn text into the top of each image.
+# Returns False if the camera cannot annotate images.
+def cameraAnnotate(camera, text, size=32, white=False):
+  if not hasattr(camera, 'annotate_text'):
+    return False
+  try:
+    import picamera
+    if white:
+      camera.annotate_foreground = picamera.Color('white')
+    else:
+      camera.annotate_foreground = picamera.Color('black')
+  except ImportError:
+    pass
+  camera.annotate_text_size = size
+  camera.annotate_text = text
+  return True
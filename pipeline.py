@@ -0,0 +1,156 @@
+#!/usr/bin/python
+# pipeline.py - Capture scheduling and background frame processing for rpi-timelapse.py
+#
+# FrameScheduler keeps capture times on exact multiples of timeDelay using a
+# monotonic clock so system clock changes and slow frames do not make the
+# timelapse drift.  Missed frame slots are counted instead of silently lost.
+#
+# FramePipeline hands captured frames to a chain of worker threads eg
+# date stamping then storage.  Queues are bounded.  If the first queue is
+# full the frame is dropped and counted so a slow SD card can never hold up
+# the capture schedule.
+
+import threading
+import time
+import Queue
+
+import stats
+
+# Returns a function giving seconds from a clock that never goes backwards.
+def _monotonicClock():
+  if hasattr(time, 'monotonic'):
+    return time.monotonic
+  try:
+    import ctypes
+    import ctypes.util
+    class timespec(ctypes.Structure):
+      _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+    librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'libc.so.6', use_errno=True)
+    clock_gettime = librt.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    CLOCK_MONOTONIC = 1
+    def monotonic():
+      t = timespec()
+      if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+        raise OSError(ctypes.get_errno(), "clock_gettime failed")
+      return t.tv_sec + t.tv_nsec * 1e-9
+    monotonic()
+    return monotonic
+  except (OSError, AttributeError):
+    return time.time
+
+monotonicTime = _monotonicClock()
+stats.setClock(monotonicTime)
+
+class FrameScheduler(object):
+  # Frame n is due at startTime + n * interval.  A frame starting more than
+  # lateSec after its deadline is counted late.  Whole slots that have already
+  # passed are counted as dropped and skipped so the cadence stays exact.
+  def __init__(self, interval, lateSec=1.0, clock=monotonicTime, sleep=time.sleep):
+    self.interval = interval
+    self.lateSec = lateSec
+    self.clock = clock
+    self.sleep = sleep
+    self.deadline = None
+    self.frames = 0
+    self.late = 0
+    self.dropped = 0
+    self.lastLateness = 0.0
+
+  # Sleep until the next frame deadline and return the lateness in seconds
+  def waitNext(self):
+    now = self.clock()
+    if self.deadline is None or self.interval <= 0:
+      self.deadline = now   # timeDelay = 0 runs back to back and is never late
+    else:
+      while self.interval > 0 and now < self.deadline:
+        self.sleep(self.deadline - now)
+        now = self.clock()
+    lateness = now - self.deadline
+    if self.interval > 0 and lateness >= self.interval:
+      missed = int(lateness / self.interval)
+      self.dropped += missed
+      stats.count('frames_missed', missed)
+      self.deadline += missed * self.interval
+      lateness = now - self.deadline
+    if lateness > self.lateSec:
+      self.late += 1
+      stats.count('frames_late')
+    self.lastLateness = lateness
+    self.frames += 1
+    self.deadline += self.interval
+    return lateness
+
+  # Seconds until the next frame is due
+  def timeToNext(self):
+    if self.deadline is None:
+      return 0
+    return max(self.deadline - self.clock(), 0)
+
+class FramePipeline(object):
+  # stages is a list of (name, function) pairs. Each function is called with
+  # a frame dict and returns the frame for the next stage or None to stop.
+  # Each stage runs in its own thread. Only submit() is called by capture.
+  def __init__(self, stages, maxQueue=8, verbose=False):
+    self.verbose = verbose
+    self.dropped = 0
+    self.errors = 0
+    self.processed = 0
+    self.queues = [Queue.Queue(maxQueue) for stage in stages]
+    self.threads = []
+    for i, (name, function) in enumerate(stages):
+      if i + 1 < len(stages):
+        nextQueue = self.queues[i + 1]
+      else:
+        nextQueue = None
+      thread = threading.Thread(target=self._run, name=name,
+                                args=(name, function, self.queues[i], nextQueue))
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+  # Queue a captured frame. If the queue is full wait up to timeout seconds
+  # for space (0 does not wait). Returns False if the frame was dropped
+  def submit(self, frame, timeout=0):
+    try:
+      if timeout > 0:
+        self.queues[0].put(frame, True, timeout)
+      else:
+        self.queues[0].put_nowait(frame)
+    except Queue.Full:
+      self.dropped += 1
+      stats.count('pipeline_dropped')
+      print "FramePipeline     - WARNING Queue full. Dropped %s" % frame.get('filename')
+      return False
+    return True
+
+  def pending(self):
+    return sum([q.qsize() for q in self.queues])
+
+  def _run(self, name, function, inQueue, nextQueue):
+    while True:
+      frame = inQueue.get()
+      if frame is None:
+        if nextQueue is not None:
+          nextQueue.put(None)
+        return
+      try:
+        with stats.timer('stage_' + name):
+          frame = function(frame)
+      except Exception as err:
+        self.errors += 1
+        stats.count('pipeline_errors')
+        print "FramePipeline     - ERROR %s stage %s %s" % (frame.get('filename'), name, err)
+        frame = None
+      if frame is None:
+        continue
+      if nextQueue is not None:
+        nextQueue.put(frame)
+      else:
+        self.processed += 1
+
+  # Wait for queued frames to finish all stages then stop the worker threads
+  def close(self):
+    self.queues[0].put(None)
+    for thread in self.threads:
+      thread.join()
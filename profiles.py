@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# profiles.py - Extra image outputs made from each capture for rpi-timelapse.py
+#
+# One capture can feed several outputs eg the full size archive image, a 720p
+# movie source and a small live image for a web page.  Each output profile has
+# its own size, interval multiple (every nth image), date/time stamp and folder.
+#
+# The jpeg is decoded once per image.  If only smaller outputs are due it is
+# decoded at reduced size using the jpeg draft mode, then each profile is
+# resized from the next larger one.  When the archive image also needs a date
+# stamp the full size decode is kept in the frame for the stamp stage so the
+# image is still only decoded once.  Raw frames are stamped later by
+# develop.py.  The camera is never asked for another capture.
+#
+# rpi-timelapse.py runs OutputProfiles.process as a pipeline.py stage before
+# the stamp and store stages.
+
+import datetime
+import io
+import os
+from PIL import Image
+
+import overlay
+import stats
+import storage
+
+class OutputProfile(object):
+  # height=None keeps the aspect ratio of the capture. fileName replaces one
+  # file each time eg live.jpg otherwise images are named prefix + date or number
+  def __init__(self, name, width, height=None, every=1, outputDir=None, prefix=None,
+               fileName=None, showDate=False, textBottom=True, textWhite=False, quality=85):
+    self.name = name
+    self.width = width
+    self.height = height
+    self.every = max(int(every), 1)
+    self.outputDir = outputDir or name
+    self.prefix = prefix
+    self.fileName = fileName
+    self.showDate = showDate
+    self.textBottom = textBottom
+    self.textWhite = textWhite
+    self.quality = quality
+    self.dateOverlay = None
+    self.written = 0
+
+  def due(self, seq):
+    return seq % self.every == 0
+
+  def size(self, sourceSize):
+    if self.height is not None:
+      return (self.width, self.height)
+    return (self.width, max(sourceSize[1] * self.width // sourceSize[0], 1))
+
+  # Stamp text onto an image the size of this profile. Font is scaled to the width
+  def stamp(self, img, text):
+    if self.dateOverlay is None or self.dateOverlay.width != img.size[0]:
+      self.dateOverlay = overlay.DateOverlay(img.size[0], img.size[1], self.textBottom, self.textWhite,
+                                             fontSize=max(24 * img.size[0] // 1920, 10))
+    return self.dateOverlay.stampImage(img, text)
+
+class OutputProfiles(object):
+  def __init__(self, profiles, namePrefix, frameStore, shard='hour', verbose=False):
+    self.profiles = [OutputProfile(**profile) if isinstance(profile, dict) else profile
+                     for profile in profiles]
+    self.namePrefix = namePrefix
+    self.frameStore = frameStore
+    self.shard = shard
+    self.verbose = verbose
+
+  # Output file name for a profile from the archive image file name
+  def fileNameFor(self, profile, frame):
+    if profile.fileName is not None:
+      return os.path.join(profile.outputDir, profile.fileName)
+    name = os.path.basename(frame['filename'])
+    if profile.prefix is not None and name.startswith(self.namePrefix):
+      name = profile.prefix + name[len(self.namePrefix):]
+    rightNow = datetime.datetime.fromtimestamp(frame['time'])
+    return os.path.join(profile.outputDir, storage.shardDir(rightNow, self.shard), name)
+
+  # Pipeline stage. Writes every due profile from one decode of the image.
+  # Leaves the full size decode in frame['image'] if the archive will be stamped
+  def process(self, frame):
+    due = [profile for profile in self.profiles if profile.due(frame['seq'])]
+    if not due:
+      return frame
+    with stats.timer('profile_decode'):
+      img = Image.open(io.BytesIO(frame['data']))
+      keepFull = frame['text'] is not None and not frame.get('raw')
+      if not keepFull:
+        largest = max(due, key=lambda profile: profile.width)
+        img.draft('RGB', largest.size(img.size))
+      if img.mode != 'RGB':
+        img = img.convert('RGB')
+      if keepFull:
+        frame['image'] = img
+    source = img
+    for profile in sorted(due, key=lambda profile: profile.width, reverse=True):
+      with stats.timer('profile_' + profile.name):
+        size = profile.size(img.size)
+        if source.size != size:
+          source = source.resize(size, Image.BILINEAR)
+        resized = source
+        if profile.showDate and frame['text'] is not None:
+          resized = profile.stamp(resized.copy(), self.namePrefix + frame['text'])
+        data = overlay.jpegData(resized, profile.quality)
+        filename = self.fileNameFor(profile, frame)
+        if self.frameStore.write(filename, data):
+          profile.written += 1
+          stats.count('profile_bytes', len(data))
+          if self.verbose:
+            print "OutputProfiles    - %s %ix%i %s" % (profile.name, size[0], size[1], filename)
+    return frame
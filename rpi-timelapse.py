@@ -12,13 +12,16 @@
 # sudo apt-get install git-cored
 # git clone git://github.com/pageauc/rpi-timelapse.git
 #
-# You will need to install python-picamera and python-imaging
+# You will need to install python-picamera, python-imaging and python-numpy
 #
 # sudo apt-get install python-picamera
 # sudo apt-get install python-imaging
+# sudo apt-get install python-numpy
 # 
 # See Readme.txt file for more details.
-# To take a test image to align camera. Run script with any parameter
+# For a live preview to aim and focus the camera (see align.py)
+# sudo ./rpi-timelapse.py align
+# To take a test image to align camera. Run script with any other parameter
 # sudo ./rpi-timelapse.py anything
 #
 # Major Revision History
@@ -34,7 +37,33 @@
 # 03-Nov-2014 ver 1.4.6 Added sigmoidShutter function and logic to replace linear steps
 # 04-Nov-2014 ver 1.4.7 Changed Sunrise to bypass Sigmoid since Day Auto can take over
 # 24-Nov-2014 ver 1.4.8 Fine Tuning twilight zone.  Sunset is good. Sunrise needs more work.
-timeLapseVer = "1.4.8"
+# 18-Oct-2026 ver 1.5.0 Camera opened once per session. Added timelapsecam.py camera backends incl fake camera
+# 18-Oct-2026 ver 1.5.1 Added lightmeter.py in memory luma metering. Probe image reused when camera mode matches
+# 18-Oct-2026 ver 1.5.2 Added sunclock.py sun schedule. Only probe near predicted twilight. Seeds sigmoid start
+# 18-Oct-2026 ver 1.5.3 Added overlay.py. Cached font, camera annotate or background thread date stamping
+# 18-Oct-2026 ver 1.5.4 Added pipeline.py. Drift free monotonic frame schedule. Stamp and store in worker threads
+# 18-Oct-2026 ver 1.5.5 Added manifest.py append only frame manifest. Replaces rewriting .dat counter file
+# 18-Oct-2026 ver 1.5.6 Added offload.py batched checksum verified image offloader. Replaces movefiles.sh
+# 18-Oct-2026 ver 1.5.7 Added simulate.py virtual clock replay simulator and benchmark
+# 18-Oct-2026 ver 1.5.8 Added stats.py per stage timing histograms and counters. json/Prometheus file and http status
+# 18-Oct-2026 ver 1.5.9 Camera settles until exposure/gains/awb stop changing instead of fixed sleeps
+# 18-Oct-2026 ver 1.6.0 Added burst mode. Sub second to few second images from a continuous camera stream
+# 18-Oct-2026 ver 1.6.1 Added thumbcache.py incremental thumbnail pyramid and hourly contact sheets
+# 18-Oct-2026 ver 1.6.2 Added storage.py date/hour image folders, free space watermarks and retention
+# 18-Oct-2026 ver 1.6.3 Added scenestate.py mode state machine with hysteresis, dwell and trend timed probes
+# 18-Oct-2026 ver 1.6.4 Added profiles.py extra output sizes from each capture with one shared decode
+# 18-Oct-2026 ver 1.6.5 Added align.py fast start MJPEG live preview with sharpness meter
+# 18-Oct-2026 ver 1.6.6 Added dedup.py. Unchanged frames only get a manifest record
+# 18-Oct-2026 ver 1.6.7 Added telemetry.py probe history and tune.py offline threshold tuning
+# 18-Oct-2026 ver 1.6.8 Added rawCapture raw Bayer images and develop.py batch developer
+timeLapseVer = "1.6.8"
+
+# Alignment mode starts the live preview straight away without the timelapse setup
+import sys
+if len(sys.argv) > 1 and sys.argv[1] == 'align':
+  import align
+  align.main(sys.argv[2:])
+  sys.exit(0)
 
 # Set verbose to False to suppress console messages if running script as daemon
  
@@ -58,10 +87,20 @@ import sys
 import time
 from time import sleep
 import datetime
-import picamera
-from PIL import Image
-from PIL import ImageFont
-from PIL import ImageDraw
+import timelapsecam
+import lightmeter
+import sunclock
+import overlay
+import pipeline
+import manifest
+import offload
+import stats
+import thumbcache
+import storage
+import scenestate
+import profiles
+import dedup
+import telemetry
 from fractions import Fraction
 
 #Constants
@@ -93,6 +132,16 @@ if not os.path.isdir(imagePath):
 
 # Set global camera timelapse settings
 timeDelay = 60*3            # timelapse delay time in seconds eg every 10 minutes
+pipelineQueue = 8           # Max captured images waiting to be stamped/stored before images are dropped
+
+# Burst mode takes burstFrames more images every burstInterval seconds after each
+# normal image from a continuous camera stream eg for clouds or traffic.
+# Day/Night is checked for the normal image then exposure/awb are locked for the burst.
+# Set timeDelay = 0 to start the next burst straight away.
+burstMode = False
+burstInterval = 1.0         # Seconds between burst images eg 0.5
+burstFrames = 59            # Images per burst after the normal image
+burstVideoPort = True       # True=Faster video port images  False=Still port. Better quality but slower
 imageNamePrefix = 'front-'  # Prefix for all image file names. Eg front-
 imageWidth = 1920
 imageHeight = 1080
@@ -100,34 +149,128 @@ imagePreview = False    # False to suppress preview mode
 imageVFlip = False      # True to flip image vertically
 imageHFlip = False      # True to flip image horizontally 
 
+# Store the raw Bayer sensor data appended to each image (picamera bayer=True) and
+# develop the images later on a faster computer with develop.py. The Pi does not
+# date stamp these images. Adds about 6MB (v1 camera) or 10MB (v2 camera) to each
+# image so use a smaller pipelineQueue on a Pi with little memory. Scene probes
+# are captured without raw data so a probed frame takes a second capture
+rawCapture = False
+
+# Extra outputs made from each captured image without capturing again eg a 720p movie
+# source and a small live image. The image is decoded once and resized for every profile.
+# Keys: name, width, height (None keeps aspect ratio), every (every nth image), outputDir,
+# prefix (replaces imageNamePrefix) or fileName (one file replaced each time), showDate, quality
+outputProfiles = []
+# eg outputProfiles = [
+#   {'name':'movie', 'width':1280, 'height':720, 'outputDir':baseDir + 'movie720', 'prefix':'movie-', 'showDate':True},
+#   {'name':'live', 'width':320, 'every':1, 'outputDir':baseDir + 'live', 'fileName':'live.jpg'}]
+
+# Camera backend is opened once and kept open while the program runs
+cameraBackend = 'picamera'  # 'picamera' for rpi camera or 'fake' to test without camera hardware
+fakeLightCurve = None       # fake backend light curve csv file of secondsOfDay,lux lines. None=built in
+# After a mode change exposure/awb are polled until they stop changing
+daySettleSec = 2            # Max seconds for day auto exposure/awb to settle
+nightSettleSec = 10         # Max seconds for night awb to settle
+settleTolerance = 0.02      # Settled when gains, exposure and awb change less than this fraction between polls
+
 # Settings for Displaying a date/time stamp directly on images
 showDateOnImage = True   # Set to False for No display of date/time on image
 showTextBottom = True    # Location of image Text True=Bottom False=Top
 showTextWhite = False    # Colour of image Text True=White False=Black
+# 'camera' has the camera burn text into the image (text at top only) No extra processing
+# 'pil' draws text in a background thread after capture.  'auto' uses camera if possible
+overlayMethod = 'auto'
 
-# Uses number sequence to name images and saves settings to continue 
-# where it left off after a reboot. Del/Edit rpi-timelapse.dat file to reset counter
-numberPath = baseDir + baseFileName + ".dat"  # dat file to save currentCount
+# Uses number sequence to name images. Every stored image is recorded in the frame
+# manifest so numbering continues where it left off after a reboot.
+# Delete rpi-timelapse.manifest file to reset counter
+manifestPath = baseDir + baseFileName + ".manifest"  # frame manifest file
+numberPath = baseDir + baseFileName + ".dat"  # ver 1.4 counter file. Only read if there is no manifest
 numberSequence = True    # Set true to set number sequence instead of date/time
 numberStart = 10000      # Set start of number sequence
 numberMax = 0            # Set Max number of images desired. Zero for Continuous
 numberRecycle = False    # After numberMax reached restart at numberStart instead of exiting
 
+# Copy stored images to another folder eg network share in a background thread.
+# Images are checked against a checksum before the local copy is deleted.
+offloadDir = None        # Destination folder eg baseDir + "xbmc"  None=Off (or use movefiles.sh from cron)
+offloadEverySec = 15*60  # Seconds between offload runs
+offloadWorkers = 2       # Images copied at the same time
+offloadMaxKBs = 2000     # Max copy rate in KB per second so capture is not slowed. 0=No limit
+offloadKeepLocal = False # Keep the local copy after offload. Deleted later by retention when space is low
+
+# Images are stored in date/hour sub folders of imagePath eg images/20261018/17
+# Free space is checked before each image is stored. Below storageLowFreeMB the
+# oldest images are deleted until storageHighFreeMB is free.
+imageShard = 'hour'      # 'hour', 'day' or None to store all images in imagePath
+storageLowFreeMB = 500   # Start deleting oldest images below this free space
+storageHighFreeMB = 1000 # Stop deleting oldest images at this free space
+storageStopFreeMB = 100  # Images are not stored below this free space. Capture keeps running
+retentionOffloadedOnly = True  # Only delete images already copied by offload.py
+
+# Frames that look the same as the last stored image are not written. Only a
+# manifest record pointing at that image is added. makemovie.py repeats the image
+dedupFrames = False      # True=Skip storing unchanged frames eg static night scenes
+dedupThreshold = 1.5     # Unchanged if average change of the luma grid is below this (0-255)
+dedupCellThreshold = 12  # Any grid cell changing this much keeps the frame eg a car in a corner
+dedupMaxRun = 30         # Store at least every nth frame
+
+# Make thumbnails (thumbSizes widths) and hourly contact sheets of each stored image
+# in a background thread for fast browsing. Or run thumbcache.py from cron
+thumbCacheDir = None     # Cache folder eg baseDir + "thumbs"  None=Off
+thumbSizes = (640, 320, 160)
+thumbCacheMB = 500       # Oldest large thumbnails are deleted first above this size
+
+# Timing histograms and counters for each capture stage. Rewritten after every image.
+statsJsonPath = baseDir + baseFileName + ".stats.json"  # None=Off  View with python ./stats.py
+statsPromPath = baseDir + baseFileName + ".prom"        # Prometheus node_exporter textfile format. None=Off
+statsPort = None         # Serve /metrics and /status over http on this port eg 8081  None=Off
+
 imageDayAuto = True      # Sets daylight camera awb and exposure to Auto
 imageNightAuto = False   # set auto exp and wb instead of using low light settings
 nightImages = True       # Take images during Night hours  True=Yes False=No
 
+# meterMode 'luma' meters an in memory probe image and uses the scene light level
+# meterMode 'filesize' compares file sizes of a day and a night image (ver 1.4 logic)
+meterMode = 'luma'
+meterDayLevel = 3000     # luma Scene light level at or above this is Day
+meterNightLevel = 100    # luma Scene light level at or below this is Night. Twilight in between
+
+# Sun schedule predicts sunrise, sunset and civil twilight from camera location.
+# Scene is only probed near twilight. Stable day and night use the known mode.
+# Needs a correct system clock. Set latitude = None to always probe the scene.
+latitude = None          # Decimal degrees North is positive eg 45.42
+longitude = None         # Decimal degrees East is positive  eg -75.69
+sunMarginMin = 30        # Minutes before/after predicted twilight to start/stop probing
+
 twilightZoneDay   = 450000    # File Size Difference for Day > Sunset Conditions
 twilightZoneNight = 230000    # File Size Difference for Night> Sunrise Conditions
+
+# Day, Twilight and Night only change when the light level (or file size difference)
+# is past a threshold by modeHysteresis and the mode has lasted modeDwellSec.
+# Away from a threshold the light trend predicts when the scene next needs probing.
+modeHysteresis = 0.1     # Fraction of the Night to Day threshold range
+modeDwellSec = 5*60      # Minimum seconds in a mode before it can change
+probeMaxSec = 30*60      # Max seconds between scene probes in stable Day or Night
+probeSafety = 0.5        # Probe after this fraction of the predicted time to the next threshold
+transitionLogPath = baseDir + baseFileName + ".transitions"  # Log of mode changes. None=Off
+# Light level, luma histogram, exposure and mode of every probe for tune.py. None=Off
+telemetryPath = baseDir + baseFileName + ".telemetry"
 nightLowShutSpeedSec = 6 # Max=6 Secs of long exposure for LowLight night images
+twilightShutMaxSec = 6   # Shutter Secs at the end of the sunset twilight sigmoid ramp
 nightLowLightISO = 800   # Normal Night time ISO setting for Low Light images 
 dayLightISO = 200
 
 # Calculate some Settings for camera shutter for Low Light conditions. 
 # Set Shorter Twighlight minutes if Camera Auto Exposure is Ok with low light
 durationOfTwilightSec = 20*60  # minutes * secInMin of Twilight for Camera Auto capability
+
+# simulate.py runs this script with a virtual clock and replaces settings here
+if 'settingsOverride' in globals():
+  globals().update(settingsOverride)
+
 maxShutSpeed = nightLowShutSpeedSec * MICRO2SECOND
-twilightShutMax = maxShutSpeed - maxShutSpeed/10  # Sets Max twilight Shutter in Seconds
+twilightShutMax = min(twilightShutMaxSec * MICRO2SECOND, maxShutSpeed)  # Max twilight Shutter in microseconds
 newTwilightShutSpeed = 0
 startingTwilight = True
 
@@ -147,7 +290,7 @@ def sigmoidShutter():
     convertShut = 1 - ( 1 / (1 + math.exp(twilightNum)))  # Pass value to sigmoid function
   else:
     convertShut = ( 1 / (1 + math.exp(twilightNum)))  # Pass value to sigmoid function  
-  newTwilightShutSpeed = maxShutSpeed * convertShut
+  newTwilightShutSpeed = twilightShutMax * convertShut
   # print "sigmoidShutter - twilight=%i convertShut=%.2f newTwilightShutSpeed=%i" % ( currentTwilightSec, convertShut, newTwilightShutSpeed )
   return abs(newTwilightShutSpeed)
 
@@ -157,138 +300,240 @@ def shut2Sec (shutspeed):
   shutstring = str("%.1f sec") % ( shutspeedSec )
   return shutstring
   
-def checkDayMode(filename):
+# Switch the camera session to Day settings
+def setDayCamera():
+  if inTwilightZone:
+    dayISO = dayLightISO * 3
+    if dayISO > 800:
+      dayISO = 800
+  else:
+    dayISO = dayLightISO
+  camSession.setDayMode(dayISO, imageDayAuto)
+
+# Switch the camera session to Night settings
+def setNightCamera(shutspeed):
+  if inTwilightZone:
+    nightISO = int(nightLowLightISO / 4 )
+  else:  
+    nightISO = nightLowLightISO
+  if verbose and not imageNightAuto:
+    print "checkNightMode    - shutSpeed=%i %s" % ( shutspeed, shut2Sec(shutspeed) )
+  # imageNightAuto=True Sets camera to automatic settings.
+  # Use this if there are No Low Light conditions.
+  # imageNightAuto=False  Sets camera for Low Night time conditions.
+  # Night time low light settings have long exposure times 
+  camSession.setNightMode(shutspeed, nightISO, imageNightAuto)
+
+def checkDayMode(filename, probe=None, metering=False):
   if verbose:
     print "checkDayMode      - Working ....."
-  with picamera.PiCamera() as camera:
-    camera.resolution = (imageWidth, imageHeight) 
-    #camera.rotation = cameraRotate #Note use imageVFlip and imageHFlip variables
-    if imagePreview:
-      camera.start_preview()
-    if imageVFlip:
-      camera.vflip = imageVFlip
-    if imageHFlip:
-      camera.hflip = imageHFlip
-    if inTwilightZone:
-      camera.iso = dayLightISO * 3
-      if camera.iso > 800:
-        camera.iso = 800
-    else:
-      camera.iso = dayLightISO
-    if imageDayAuto:
-      # Day Automatic Mode
-      camera.exposure_mode = 'auto'
-      camera.awb_mode = 'auto'
-    else:
-      camera.framerate = 30
-      # Give the camera's auto-exposure and auto-white-balance algorithms
-      # some time to measure the scene and determine appropriate values
-      time.sleep(2)
-      # Now fix the values
-      camera.shutter_speed = camera.exposure_speed
-      camera.exposure_mode = 'off'
-      g = camera.awb_gains
-      camera.awb_mode = 'off'
-      camera.awb_gains = g
-    camera.capture(filename)
-  st = os.stat(filename)
-  fileSize = st.st_size
+  setDayCamera()
+  fileSize = saveImage(filename, probe, metering)
   if verbose:  
-    print "checkDayMode      - %s size=%i" % (filename, st.st_size)
+    print "checkDayMode      - %s size=%i" % (filename, fileSize)
   return fileSize
  
-def checkNightMode(filename, shutspeed):
+def checkNightMode(filename, shutspeed, probe=None, metering=False):
   if verbose:
     print "checkNightMode    - Working ....."
-  with picamera.PiCamera() as camera:
-    camera.resolution = (imageWidth, imageHeight) 
-    if imagePreview:
-      camera.start_preview()
-    if imageVFlip:
-      camera.vflip = imageVFlip
-    if imageHFlip:
-      camera.hflip = imageHFlip
-    if imageNightAuto:
-      # imageNightAuto=True Sets camera to automatic settings.
-      # Use this if there are No Low Light conditions.
-      camera.exposure_mode = 'auto'
-      camera.awb_mode = 'auto'
-      time.sleep(2)
-    else:
-      # imageNightAuto=False  Sets camera for Low Night time conditions.
-      # Night time low light settings have long exposure times 
-      # Settings for Low Light Conditions 
-      # Set a frame rate of 1/6 fps, then set shutter
-      # speed to 6s and ISO to nightLowLightISO variable
-      camera.framerate = Fraction(1, 6)
-      if verbose:
-        print "checkNightMode    - shutSpeed=%i %s" % ( shutspeed, shut2Sec(shutspeed) )
-      camera.shutter_speed = int(shutspeed)
-      camera.exposure_mode = 'off'
-      if inTwilightZone:
-        camera.iso = int(nightLowLightISO / 4 )
-      else:  
-        camera.iso = nightLowLightISO
-      # Give the camera a good long time to measure AWB
-      # (you may wish to use fixed AWB instead)
-      time.sleep(10)
-    camera.capture(fileName)
-  st = os.stat(filename)
-  fileSize = st.st_size
+  setNightCamera(shutspeed)
+  fileSize = saveImage(filename, probe, metering)
   if verbose:  
     print "checkNightMode    - %s curFileSize=%i" % (filename, fileSize)
   return fileSize
 
+# Keep the in memory probe image if it was taken with the current camera
+# settings, otherwise capture a new image into memory. Returns the image size.
+# The image is written to storage by the framePipeline storeStage.
+# With rawCapture the stored image is captured with the raw Bayer data so a
+# probe is not reused. metering=True images are only compared and never have raw data
+def saveImage(filename, probe, metering=False):
+  global imageData, imageExposure, imageGain
+  if probe is not None and probe['settings'] == camSession.settings and not (rawCapture and not metering):
+    imageData = probe['data']
+    imageExposure = probe['exposure']
+    imageGain = probe['gain']
+  else:
+    imageData, imageExposure, imageGain = camSession.captureToMemory(bayer=rawCapture and not metering)
+  return len(imageData) - timelapsecam.rawSize(imageData)
+
+# Meter the scene using an in memory probe image taken with the current camera
+# settings. If the probe is too dark or bright to meter then switch modes and retry.
+def meterScene():
+  if camSession.mode is None:
+    camSession.setDayMode(dayLightISO, imageDayAuto)
+  probe = lightmeter.meterProbe(camSession)
+  if not probe['reliable']:
+    if camSession.mode == 'day' and probe['mean'] < lightmeter.CLIP_LOW:
+      setNightCamera(maxShutSpeed)
+    elif camSession.mode == 'night' and probe['mean'] > lightmeter.CLIP_HIGH:
+      setDayCamera()
+    else:
+      return probe
+    probe = lightmeter.meterProbe(camSession)
+  if verbose:
+    print "meterScene        - mean=%.1f p05=%i p95=%i exp=%i gain=%.2f level=%i" % ( probe['mean'], probe['p05'], probe['p95'], probe['exposure'], probe['gain'], probe['level'] )
+  return probe
+
 def checkIfDay():
-  filename = "checkIfDay.jpg"  
+  filename = "checkIfDay"
   if verbose:
     print "One Moment Please - Determining if it is Day or Night)"
-  if (checkDayMode(filename) > checkNightMode(filename, 1 * MICRO2SECOND)):
+  if meterMode == 'luma':
+    probe = meterScene()
+    return probe['level'] >= math.sqrt(meterDayLevel * meterNightLevel)
+  if (checkDayMode(filename, metering=True) > checkNightMode(filename, 1 * MICRO2SECOND, metering=True)):
     sunSet = True
   else:
     sunSet = False
   return sunSet
 
-# function to write date/time stamp directly on top or bottom of images.
-def writeDateToImage( imagename, datetoprint ):
-  if showTextWhite :
-    FOREGROUND = ( 255, 255, 255 )  # rgb settings for white text foreground
+# Pipeline stage to write date/time stamp directly on top or bottom of images.
+# Camera annotated images already have the text so have frame text=None.
+# Uses the image already decoded by the profiles stage if there is one.
+# Unchanged frames are not stored and raw frames are stamped by develop.py
+def writeDateToImage( frame ):
+  if frame['text'] is not None and not frame.get('ref') and not frame.get('raw'):
+    img = frame.pop('image', None)
+    if img is not None:
+      frame['data'] = overlay.jpegData(dateOverlay.stampImage(img, imageNamePrefix + frame['text']))
+    else:
+      frame['data'] = dateOverlay.stampJpeg(frame['data'], imageNamePrefix + frame['text'])
+  return frame
+
+# Pipeline stage to write the image to storage then record it in the frame manifest.
+# Images are not stored or recorded if the storage is full.  An unchanged frame
+# (see dedup.py) is only recorded with the path of the image it repeats.  If
+# that image was not stored the frame is stamped and stored instead
+def storeImage( frame ):
+  ref = frame.get('ref', 0)
+  if ref and not os.path.exists(frame['refFilename']):
+    frame['ref'] = 0
+    frame = writeDateToImage(frame)
+  if frame.get('ref'):
+    frame['bytes'] = 0
+    frame['path'] = frameManifest.relativePath(frame['refFilename'])
   else:
-    FOREGROUND = ( 0, 0, 0 )  # rgb settings for black text foreground
-  # centre text and compensate for graphics text being wider
-  x = int((imageWidth/2) - (len(imagename)*2))
-  if showTextBottom:
-    y = (imageHeight - 50)  # show text at bottom of image 
+    frame['ref'] = 0
+    frame['bytes'] = len(frame['data'])
+    frame['path'] = frameManifest.relativePath(frame['filename'])
+    # Never store an image that cannot be recorded
+    if not manifest.recordFits(frame):
+      print "Manifest Update   - ERROR Path too long for the manifest. Not stored %s" % ( frame['path'] )
+      stats.count('storage_skipped')
+      return None
+    with stats.timer('image_write'):
+      if not frameStore.write(frame['filename'], frame['data']):
+        return None
+    if frameDedup is not None:
+      frameDedup.stored(frame, ref)
+  with stats.timer('manifest_write'):
+    frame['index'] = frameManifest.append(frame)
+  stats.count('bytes_written', frame['bytes'] + manifest.RECORD_SIZE)
+  if verbose:
+    print "Manifest Update   - seq=%i %s" % ( frame['seq'], frame['path'] )
+  return frame
+
+# Image file name from the image number or the date/time
+def imageFileName(count, rightNow):
+  if numberSequence :
+    name = imageNamePrefix + str(count) + ".jpg"
+  elif burstMode:
+    # Burst images can be less than a second apart
+    name = "%s%04d%02d%02d-%02d%02d%02d%02d.jpg" % ( imageNamePrefix ,rightNow.year, rightNow.month, rightNow.day, rightNow.hour, rightNow.minute, rightNow.second, rightNow.microsecond / 10000)
   else:
-    y = 10  # show text at top of image
-  TEXT = imageNamePrefix + datetoprint
-  font_path = '/usr/share/fonts/truetype/freefont/FreeSansBold.ttf'
-  font = ImageFont.truetype(font_path, 24, encoding='unic')
-  text = TEXT.decode('utf-8')
-  img = Image.open(imagename)
-  draw = ImageDraw.Draw(img)
-  # draw.text((x, y),"Sample Text",(r,g,b))
-  draw.text(( x, y ),text,FOREGROUND,font=font)
-  img.save(imagename)
-  return
-
-# Create a .dat file to store currentCount or read file if it already Exists
-if numberSequence:
-  # Create numberPath file if it does not exist
-  if not os.path.exists(numberPath):
-    if verbose:
-      print "numberSequence - Creating File %s  currentCount=%i" % ( numberPath, numberStart )
-    open(numberPath, 'w').close()
-    f = open(numberPath, 'w+')
-    f.write(str(numberStart))
-    f.close()
-  # Read the numberPath file to get the last sequence number
+    name = "%s%04d%02d%02d-%02d%02d%02d.jpg" % ( imageNamePrefix ,rightNow.year, rightNow.month, rightNow.day, rightNow.hour, rightNow.minute, rightNow.second)
+  return frameStore.imageFileName(name, rightNow)
+
+# Text for the image date/time stamp
+def imageTextFor(count, rightNow):
+  dateTimeText = "%04d%02d%02d-%02d:%02d:%02d" % (rightNow.year, rightNow.month, rightNow.day, rightNow.hour, rightNow.minute, rightNow.second)
+  if numberSequence:
+    counterStr = "%i    "  % ( count )
+    return counterStr + dateTimeText
+  return dateTimeText
+
+# Process currentCount for next image. Continues counting even if not used in file names
+# Returns True if numberMax images have been taken
+def advanceCount():
+  global currentCount, writeCount
+  countExceeded = False
+  currentCount += 1
+  if numberSequence and numberMax > 0:
+    if (currentCount > numberStart + numberMax):
+      if numberRecycle:
+        currentCount = numberStart
+      else:
+        countExceeded = True
+  writeCount = str(currentCount)
+  return countExceeded
+
+# Burst mode. Take burstFrames more images every burstInterval seconds from a
+# continuous camera stream with exposure and awb locked at the values used for
+# the image just taken.  If the pipeline is full wait up to half an interval
+# for space before dropping an image so storage slows the burst a little first.
+def captureBurst():
+  camSession.lockExposure()
+  burstScheduler = pipeline.FrameScheduler(burstInterval)
+  burstScheduler.waitNext()   # Start the burst schedule from now
+  stream = camSession.captureStream(burstVideoPort)
+  dropped = framePipeline.dropped
+  try:
+    for i in range(burstFrames):
+      burstScheduler.waitNext()
+      rightNow = datetime.datetime.now()
+      if useCameraAnnotate and cameraAnnotated:
+        overlay.cameraAnnotate(camSession.camera, imageNamePrefix + imageTextFor(currentCount, rightNow), white=showTextWhite)
+      data, exposure, gain = stream.next()
+      frameText = None
+      if showDateOnImage and not cameraAnnotated:
+        frameText = imageTextFor(currentCount, rightNow)
+      framePipeline.submit({'filename':imageFileName(currentCount, rightNow), 'data':data, 'text':frameText,
+                            'seq':currentCount, 'time':time.mktime(rightNow.timetuple()),
+                            'mode':sceneMode, 'shutter':exposure, 'iso':camSession.camera.iso,
+                            'level':meterLevel}, burstInterval / 2.0)
+      stats.count('burst_frames')
+      if advanceCount():
+        print "%s - Exceeded Image Count numberMax=%i" % ( progName, numberMax )
+        exitTimelapse()
+  finally:
+    stream.close()
+  if verbose:
+    print "Burst             - %i images every %.1f sec late=%i missed=%i dropped=%i" % ( burstFrames, burstInterval, burstScheduler.late, burstScheduler.dropped, framePipeline.dropped - dropped )
+
+# Exit after waiting for background image processing to finish
+def exitTimelapse():
+  framePipeline.close()
+  if thumbCache is not None:
+    thumbCache.saveState()
+  if offloadWorker is not None:
+    offloadWorker.close()
+  if telemetryStore is not None:
+    telemetryStore.close()
+  if statusServer is not None:
+    statusServer.close()
+  camSession.close()
+  print "Exiting %s" % progName
+  exit()
+
+# Open the frame manifest and continue numbering from its last record.
+# If there is no manifest yet continue from a ver 1.4 .dat counter file if found
+frameManifest = manifest.FrameManifest(manifestPath)
+lastFrame = frameManifest.last()
+if lastFrame is not None:
+  currentCount = lastFrame['seq'] + 1
+  if verbose:
+    print "numberSequence - Read currentCount=%i from manifestPath=%s" % ( currentCount, manifestPath )
+elif os.path.exists(numberPath):
   with open(numberPath, 'r') as f:
-    writeCount = f.read()
-    f.closed
-    currentCount = int(writeCount)
-    if verbose:
-      print "numberSequence - Read currentCount=%i from numberPath=%s" % ( currentCount, numberPath )
+    currentCount = int(f.read())
+  if verbose:
+    print "numberSequence - Read currentCount=%i from numberPath=%s" % ( currentCount, numberPath )
+else:
+  currentCount = numberStart
+writeCount = str(currentCount)
+frameStore = storage.FrameStore(imagePath, frameManifest, imageShard, storageLowFreeMB,
+                                storageHighFreeMB, storageStopFreeMB, retentionOffloadedOnly, verbose)
 
 # Display some of the Camera Setting variables     
 if verbose:
@@ -297,19 +542,20 @@ if verbose:
     print "==================================================================================="
     print "IMAGE  - WxH=%sx%s timeDelay=%s sec VFlip=%s HFlip=%s Preview=%s"  % ( imageWidth, imageHeight, timeDelay, imageVFlip, imageHFlip, imagePreview )
     print "         showDateOnImage=%s at Bottom=%s with showTextWhite=%s" % ( showDateOnImage, showTextBottom, showTextWhite )
-    print "         nightImages=%s imageNightAuto=%s imageDayAuto=%s" % ( nightImages, imageNightAuto, imageDayAuto )    
-    print "FILE   - imagePath=%s imageNamePrefix=%s" % (  imagePath, imageNamePrefix )
+    print "         nightImages=%s imageNightAuto=%s imageDayAuto=%s rawCapture=%s" % ( nightImages, imageNightAuto, imageDayAuto, rawCapture )    
+    print "FILE   - imagePath=%s imageNamePrefix=%s imageShard=%s" % (  imagePath, imageNamePrefix, imageShard )
+    print "         free=%i MB storageLowFreeMB=%i storageHighFreeMB=%i storageStopFreeMB=%i" % ( storage.freeBytes(imagePath) // storage.MB, storageLowFreeMB, storageHighFreeMB, storageStopFreeMB )
     if numberSequence:
       print "NUMBER - numberSequencet=%s numberStart=%s numberMax=%s currentCount=%i" % ( numberSequence, numberStart, numberMax, currentCount)
     else:
       print "NUMBER - numberSequencet=%s numberStart=%s numberMax=%s" % ( numberSequence, numberStart, numberMax )        
-    print "         numberPath=%s" % ( numberPath )
+    print "         manifestPath=%s" % ( manifestPath )
     print "==================================================================================="
 
 # Start main timelapse loop
 # =========================  
 imageMode = 'unknown'
-fileSizeDiffOld = 0
+fileSizeTrend = 0
 fileSizeDiff = 0
 dayFileMax = 0
 nightFileMax = 0
@@ -318,9 +564,75 @@ curDayFileSize = 0
 curNightFileSize = 0
 curTwilightFileSize = 0
 TWLShut2Str = " Auto  "
+meterLevel = 0
+
+statusServer = None
+if statsPort is not None:
+  statusServer = stats.StatusServer(statsPort)
+
+# Open the camera once. It stays open until the program exits
+with stats.timer('camera_open'):
+  camSession = timelapsecam.CameraSession(
+                 timelapsecam.openCamera(cameraBackend, fakeLightCurve),
+                 imageWidth, imageHeight, imageVFlip, imageHFlip, imagePreview,
+                 daySettleSec, nightSettleSec, verbose,
+                 settleTolerance=settleTolerance)
+inTwilightZone = False
+
+# Date/time stamp images with the camera if possible otherwise in a background thread
+useCameraAnnotate = False
+if showDateOnImage:
+  useCameraAnnotate = overlayMethod == 'camera' or (overlayMethod == 'auto' and not showTextBottom)
+dateOverlay = overlay.DateOverlay(imageWidth, imageHeight, showTextBottom, showTextWhite)
+cameraAnnotated = False
+
+# Captured images are stamped and stored by background threads.
+# Frames are scheduled on a monotonic clock so the timelapse does not drift.
+pipelineStages = [('stamp', writeDateToImage), ('store', storeImage)]
+if outputProfiles:
+  profileOutputs = profiles.OutputProfiles(outputProfiles, imageNamePrefix, frameStore, imageShard, verbose)
+  pipelineStages.insert(0, ('profiles', profileOutputs.process))
+frameDedup = None
+if dedupFrames:
+  frameDedup = dedup.FrameDeduplicator(dedupThreshold, dedupCellThreshold, maxRun=dedupMaxRun, verbose=verbose)
+  pipelineStages.insert(pipelineStages.index(('stamp', writeDateToImage)), ('dedup', frameDedup.process))
+thumbCache = None
+if thumbCacheDir is not None:
+  thumbCache = thumbcache.ThumbCache(thumbCacheDir, manifestPath, thumbSizes,
+                                     thumbCacheMB * 1024 * 1024, verbose=verbose)
+  pipelineStages.append(('thumbs', thumbCache.addFrame))
+framePipeline = pipeline.FramePipeline(pipelineStages, pipelineQueue, verbose)
+frameScheduler = pipeline.FrameScheduler(timeDelay)
+
+offloadWorker = None
+if offloadDir is not None:
+  offloadWorker = offload.OffloadWorker(
+                    offload.Offloader(manifestPath, offloadDir, offloadWorkers,
+                                      maxBytesPerSec=offloadMaxKBs * 1024,
+                                      delete=not offloadKeepLocal, verbose=verbose),
+                    offloadEverySec)
+imageData = None
+imageExposure = 0
+imageGain = 1.0
+telemetryStore = None
+if telemetryPath is not None:
+  telemetryStore = telemetry.TelemetryStore(telemetryPath)
+lastSceneMode = None
+
+sunSchedule = None
+if latitude is not None and longitude is not None:
+  sunSchedule = sunclock.SunSchedule(latitude, longitude, sunMarginMin * 60)
+  schedMode, sunWindow = sunSchedule.modeAt(time.time())
+else:
+  schedMode, sunWindow = None, None
 
 # Check to see if it is Day or Night
-sunSet = checkIfDay
+if schedMode == 'day' or (schedMode == 'twilight' and sunWindow['kind'] == 'sunset'):
+  sunSet = True
+elif schedMode is not None:
+  sunSet = False
+else:
+  sunSet = checkIfDay()
 if sunSet:
   twilightZone = twilightZoneDay
 else:
@@ -328,77 +640,131 @@ else:
 startingTwilight = True
 twilightStart = datetime.datetime.now()
 
+# Probe values rise towards Day. luma uses the log of the light level so the
+# hysteresis margin is the same ratio of light at both thresholds
+if meterMode == 'luma':
+  nightEdge, dayEdge = math.log(meterNightLevel), math.log(meterDayLevel)
+else:
+  nightEdge, dayEdge = -twilightZoneNight, twilightZoneDay
+sceneState = scenestate.SceneState(nightEdge, dayEdge, modeHysteresis, modeDwellSec,
+                                   probeMaxSec, probeSafety, logPath=transitionLogPath,
+                                   verbose=verbose)
+
 while True:
+    frameScheduler.waitNext()   # Wait before next timelapse image is taken
+    frameStart = pipeline.monotonicTime()
     inTwilightZone = False 
     rightNow = datetime.datetime.now()
-    if numberSequence :
-      fileName = imagePath + "/" + imageNamePrefix + str(currentCount) + ".jpg"
-    else:
-      fileName = "%s/%s%04d%02d%02d-%02d%02d%02d.jpg" % ( imagePath, imageNamePrefix ,rightNow.year, rightNow.month, rightNow.day, rightNow.hour, rightNow.minute, rightNow.second)
+    fileName = imageFileName(currentCount, rightNow)
 
-    # Here is where we do the main processing depending on file size differences  
     lastCamMode="-- Non ---"
-    # Get Day File Size using Day Camera Mode
-    curDayFileSize = checkDayMode(fileName)
-    if curDayFileSize > dayFileMax:
-      dayFileMax = curDayFileSize    
-    # Get Night File Size using Night Camera Mode    
-    curNightFileSize = checkNightMode(fileName, 1 * MICRO2SECOND)
-    if curNightFileSize > nightFileMax:
-      nightFileMax = curNightFileSize    
-    fileSizeVar  = curDayFileSize - curNightFileSize    
-    fileSizeDiffOld = fileSizeDiff
-    fileSizeDiff = abs(curDayFileSize - curNightFileSize)
-    fileSizeTrend = fileSizeDiffOld - fileSizeDiff
-    
-    if verbose:
-      print "Check File Sizes  - fileSizeDiff=%i Trend=%i curDayFileSize=%i curNightFileSize=%i " % ( fileSizeDiff, fileSizeTrend, curDayFileSize, curNightFileSize )
-                         
-    # If small difference between files then check Twilight Mode
-    # Change shutter speed incrementally
-    if fileSizeDiff < twilightZone:
+    probe = None
+    meteredProbe = None   # Probe recorded in telemetry
+    dateTimeText = "%04d%02d%02d-%02d:%02d:%02d" % (rightNow.year, rightNow.month, rightNow.day, rightNow.hour, rightNow.minute, rightNow.second)
+    if showDateOnImage:
+      imageText = imageTextFor(currentCount, rightNow)
+      if useCameraAnnotate:
+        cameraAnnotated = overlay.cameraAnnotate(camSession.camera, imageNamePrefix + imageText, white=showTextWhite)
+    # Outside of predicted twilight the mode is known so skip probing the scene
+    if sunSchedule is not None:
+      schedMode, sunWindow = sunSchedule.modeAt(time.time())
+    if schedMode in ('day', 'night') and meterMode == 'luma':
+      # Capture in the known mode. Metering the image in memory costs no extra
+      # capture and catches a wrong system clock
+      if schedMode == 'day':
+        setDayCamera()
+      else:
+        setNightCamera(maxShutSpeed)
+      probe = meterScene()
+      meterLevel = probe['level']
+      sceneMode = lightmeter.levelMode(meterLevel, meterDayLevel, meterNightLevel)
+      if sceneMode == 'twilight':
+        sceneMode = schedMode  # eg dark clouds. Sun is not near the horizon
+      elif sceneMode != schedMode:
+        print "Sun Schedule      - WARNING Predicted %s but metered %s. Check system clock and latitude/longitude" % ( schedMode, sceneMode )
+      sceneState.setState(sceneMode, time.time())
+    elif schedMode in ('day', 'night'):
+      sceneMode = schedMode
+      sceneState.setState(sceneMode, time.time())
+    elif not sceneState.probeDue(time.time()):
+      # Light is steady and far from a threshold so take the image in the current mode
+      sceneMode = sceneState.state
+      stats.count('probes_skipped')
+    elif meterMode == 'luma':
+      # Here is where we do the main processing depending on the metered light level
+      probe = meterScene()
+      meterLevel = probe['level']
+      sceneMode = sceneState.update(math.log(max(meterLevel, 1)), time.time())
+    else:
+      # Here is where we do the main processing depending on file size differences  
+      # Get Day File Size using Day Camera Mode
+      curDayFileSize = checkDayMode(fileName, metering=True)
+      if curDayFileSize > dayFileMax:
+        dayFileMax = curDayFileSize    
+      if telemetryStore is not None:
+        meteredProbe = lightmeter.meterData(imageData, imageExposure, imageGain)
+      # Get Night File Size using Night Camera Mode    
+      curNightFileSize = checkNightMode(fileName, 1 * MICRO2SECOND, metering=True)
+      if curNightFileSize > nightFileMax:
+        nightFileMax = curNightFileSize    
+      fileSizeVar  = curDayFileSize - curNightFileSize    
+      fileSizeDiff = abs(fileSizeVar)
+      if meteredProbe is not None:
+        meteredProbe['daySize'], meteredProbe['nightSize'] = curDayFileSize, curNightFileSize
+      # Small difference between files is Twilight. Day image bigger is Day
+      sceneMode = sceneState.update(fileSizeVar, time.time())
+      fileSizeTrend = (sceneState.trend() or 0) * 60
+      if verbose:
+        print "Check File Sizes  - fileSizeDiff=%i Trend=%i/min curDayFileSize=%i curNightFileSize=%i " % ( fileSizeDiff, fileSizeTrend, curDayFileSize, curNightFileSize )
+
+    # Change shutter speed incrementally in Twilight Mode
+    if sceneMode == 'twilight':
       inTwilightZone = True
       if sunSet:
         # Go into low light Twilight Mode 
         if verbose:
-          print "Twilight Zone     - dayFileSize=%i nightFileSize=%i  Diff=%i Twilight=%i" % ( curDayFileSize, curNightFileSize, fileSizeDiff, twilightZone )
+          if meterMode == 'luma':
+            print "Twilight Zone     - level=%i Day=%i Night=%i" % ( meterLevel, meterDayLevel, meterNightLevel )
+          else:
+            print "Twilight Zone     - dayFileSize=%i nightFileSize=%i  Diff=%i Twilight=%i" % ( curDayFileSize, curNightFileSize, fileSizeDiff, twilightZone )
         lastCamMode = " Twilight "
         # Toggle Start of Twilight in order to calculate sigmoid curve for shutter speed
         if startingTwilight:
-          twilightStart = datetime.datetime.now()
+          if sunWindow is not None and sunWindow['kind'] == 'sunset':
+            # Start sigmoid ramp at the predicted sunset instead of the first probe
+            twilightStart = datetime.datetime.fromtimestamp(sunWindow['anchor'])
+          else:
+            twilightStart = datetime.datetime.now()
           startingTwilight = False        
-        if sunSet:       # This looks like redundant check. Changed logic to bypass sigmoid ramping at sunrise. Still Testing so left in
-          twilightShut = sigmoidShutter()
-        else:
-          twilightShut = twilightShutMax - sigmoidShutter()
+        twilightShut = sigmoidShutter()
         TWLShut2Str = shut2Sec(twilightShut)
         if verbose:
           print "Twilight Zone     - Working ....  Shutter =%s " % ( TWLShut2Str )
-        curTwilightFileSize = checkNightMode(fileName, twilightShut)     
+        curTwilightFileSize = checkNightMode(fileName, twilightShut, probe)
         if curTwilightFileSize > twilightFileMax:  # Only used for display
           twilightFileMax = curTwilightFileSize
       else:
         # It morning then flip early since Day Auto can take over bypassing sigmoid ramping.
         lastCamMode="--- Day --"
         TWLShut2Str = " Auto  "
-        curDayFileSize = checkDayMode(fileName)
+        curDayFileSize = checkDayMode(fileName, probe)
         if curDayFileSize > dayFileMax:
           dayFileMax = curDayFileSize
-    elif curDayFileSize > curNightFileSize:
+    elif sceneMode == 'day':
       lastCamMode = "--- Day --"
       TWLShut2Str = " Auto  "   
       sunSet = True
       startingTwilight = True  # Twilight is over so reset
       twilightZone = twilightZoneDay
       # It was day so take day mode image since last one was night mode.
-      curDayFileSize = checkDayMode(fileName)
+      curDayFileSize = checkDayMode(fileName, probe)
       if curDayFileSize > dayFileMax:
         dayFileMax = curDayFileSize
-    elif curDayFileSize < curNightFileSize:
+    elif sceneMode == 'night':
       lastCamMode ="-- Night -"
       TWLShut2Str = shut2Sec(maxShutSpeed)
       startingTwilight = True  # Twilight is over so reset  
-      curNightFileSize = checkNightMode(fileName, maxShutSpeed)
+      curNightFileSize = checkNightMode(fileName, maxShutSpeed, probe)
       sunSet=False
       twilightZone = twilightZoneNight
       if curNightFileSize > nightFileMax:
@@ -407,40 +773,22 @@ while True:
       lastCamMode="- UnKnown "
       print "ERROR - Unknown State - Cannot Determine State. Investigate Problem"    
         
-    # If required process text to display directly on image
-    if showDateOnImage:
-      dateTimeText = "%04d%02d%02d-%02d:%02d:%02d" % (rightNow.year, rightNow.month, rightNow.day, rightNow.hour, rightNow.minute, rightNow.second)
-      if numberSequence:
-        counterStr = "%i    "  % ( currentCount )
-        imageText =  counterStr + dateTimeText
-      else:
-        imageText = dateTimeText
-      # Now put the imageText on the current image
-      writeDateToImage(fileName, imageText)
-      
-    # Process currentCount for next image if number sequence is enabled
-    if numberSequence:
-      currentCount += 1
-      if numberMax > 0:
-        if (currentCount > numberStart + numberMax):
-          if numberRecycle:
-            currentCount = numberStart
-          else:
-            print "%s - Exceeded Image Count numberMax=%i" % ( progName, numberMax )
-            print "Exiting %s" % progName
-            camera.close()
-            exit()              
-      # write next image counter number to dat file            
-      writeCount = str(currentCount)
-      if not os.path.exists(numberPath):
-        if verbose:
-          print "File Create       - New Counter=%s %s" % ( writeCount, numberPath )
-        open(numberPath, 'w').close()
-      f = open(numberPath, 'w+')
-      f.write(str(writeCount))
-      f.close()
-      if verbose:
-        print "File Update       - Next Counter=%s %s" % ( writeCount, numberPath )
+    # Hand the image to the pipeline to put the imageText on the image if required
+    # then write it to storage and record it in the frame manifest
+    frameText = None
+    if showDateOnImage and not cameraAnnotated:
+      frameText = imageText
+    framePipeline.submit({'filename':fileName, 'data':imageData, 'text':frameText,
+                          'seq':currentCount, 'time':time.mktime(rightNow.timetuple()),
+                          'mode':sceneMode, 'shutter':imageExposure, 'iso':camSession.camera.iso,
+                          'daySize':curDayFileSize, 'nightSize':curNightFileSize, 'level':meterLevel,
+                          'raw':rawCapture and timelapsecam.rawSize(imageData) > 0})
+
+    # Process currentCount for next image. Continues counting even if not used in file names
+    countExceeded = advanceCount()
+    if countExceeded:
+      print "%s - Exceeded Image Count numberMax=%i" % ( progName, numberMax )
+      exitTimelapse()              
       
     # If any parameter is passed to this python script then exit script
     # after normal image processing above. One image will be taken.
@@ -448,17 +796,39 @@ while True:
     # Useful if you need to align camera and don't want to change timeDelay setting.
     if takeTestImage:
       print "%s - Captured Test Image %s" % (dateTimeText, fileName)
-      print "Exiting %s"  % progName
-      camera.close()
-      exit()      
+      exitTimelapse()      
+
+    if burstMode:
+      captureBurst()
 
     # display image status message on console if required.
     delayNow = datetime.datetime.now()
-    delayDiff = (delayNow - rightNow).total_seconds()
-    if timeDelay > delayDiff:
-      diffDelay = timeDelay - delayDiff
-    else:
-      diffDelay = 0 
+    delayDiff = pipeline.monotonicTime() - frameStart
+    diffDelay = frameScheduler.timeToNext()
+
+    # Keep the probe history for tuning thresholds offline with tune.py
+    if meteredProbe is None:
+      meteredProbe = probe
+    if telemetryStore is not None and meteredProbe is not None:
+      telemetryStore.append(time.time(), sceneMode, meteredProbe, imageExposure,
+                            meteredProbe.get('daySize', 0), meteredProbe.get('nightSize', 0))
+
+    # Record the cycle and export stats for scraping
+    stats.observe('cycle', delayDiff)
+    stats.count('frames_' + sceneMode)
+    if lastSceneMode is not None and sceneMode != lastSceneMode:
+      stats.count('mode_transitions')
+    lastSceneMode = sceneMode
+    for mode in ('day', 'twilight', 'night'):
+      stats.gauge('mode_' + mode, int(sceneMode == mode))
+    stats.gauge('current_count', currentCount)
+    stats.gauge('scene_level', meterLevel)
+    stats.gauge('shutter_us', imageExposure)
+    stats.gauge('pipeline_pending', framePipeline.pending())
+    try:
+      stats.registry.writeFiles(statsJsonPath, statsPromPath)
+    except (IOError, OSError) as err:
+      print "stats             - ERROR writing stats files %s" % err
      
     if debugLog:
       logTitle1 = "   Date/Time        "
@@ -485,9 +855,13 @@ while True:
       print "                 Day      Night    Twilight"
       print "File Maximum - %7i   %7i   %7i" % ( dayFileMax, nightFileMax, twilightFileMax )
       print "File Current - %7i   %7i   %7i (most recent)" % ( curDayFileSize, curNightFileSize, curTwilightFileSize )
-      print "File Compare - Target=%i Variance=%i" % ( fileSizeDiff, fileSizeTrend  )
+      if meterMode == 'luma':
+        print "Light Level  - level=%i Day=%i Night=%i" % ( meterLevel, meterDayLevel, meterNightLevel )
+      else:
+        print "File Compare - Target=%i Variance=%i" % ( fileSizeDiff, fileSizeTrend  )
       print "Status       - sunset=%s  twilightZone=%i Target=%i"  % ( sunSet, twilightZone, fileSizeDiff )
       print "-------------------%s--------------------" % ( lastCamMode )
+      print "Cycle Time        - %.1f sec to capture image. Started %.1f sec late" % ( delayDiff, frameScheduler.lastLateness )
+      print "Schedule          - frames=%i late=%i dropped=%i  Pipeline queued=%i dropped=%i errors=%i" % ( frameScheduler.frames, frameScheduler.late, frameScheduler.dropped, framePipeline.pending(), framePipeline.dropped, framePipeline.errors )
       print "TimeDelay         - Waiting %i min %i sec  timeDelay=%i sec or %.1f min" % ( dmin, dsec, timeDelay, timeDelay/60.0 )
-    time.sleep(diffDelay)   # Wait before next timelapse image is taken
 
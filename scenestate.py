@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# scenestate.py - Day/Twilight/Night state machine for rpi-timelapse.py
+#
+# Each scene probe gives a value, the log of the metered light level or the
+# day minus night file size difference, that rises towards Day and falls
+# towards Night.  The mode only changes when the value crosses the Day or
+# Night threshold by the hysteresis margin and the current mode has lasted
+# at least dwellSec, so noise or a passing cloud at a threshold cannot flip
+# the camera back and forth.
+#
+# The trend of recent values (a least squares slope) predicts when the next
+# threshold will be crossed.  Away from a threshold the next probe is put off
+# for a fraction of that time, up to maxProbeSec, and frames are taken in the
+# current mode without probing.  In Twilight, or without a trend, the scene
+# is probed every frame.
+#
+# Every mode change is appended to a log file with the value and trend so a
+# night can be checked or replayed in simulate.py afterwards.
+#
+# python ./scenestate.py rpi-timelapse.transitions    print a transition log
+
+import collections
+import sys
+import time
+
+import stats
+
+MODES = ('night', 'twilight', 'day')
+
+class SceneState(object):
+  def __init__(self, nightEdge, dayEdge, hysteresis=0.1, dwellSec=5*60,
+               maxProbeSec=30*60, probeSafety=0.5, trendSamples=6,
+               logPath=None, clock=time.time, verbose=False):
+    self.nightEdge = nightEdge
+    self.dayEdge = dayEdge
+    self.margin = hysteresis * (dayEdge - nightEdge)
+    self.dwellSec = dwellSec
+    self.maxProbeSec = maxProbeSec
+    self.probeSafety = probeSafety
+    self.logPath = logPath
+    self.clock = clock
+    self.verbose = verbose
+    self.samples = collections.deque(maxlen=trendSamples)
+    self.state = None
+    self.since = None
+    self.value = None
+    self.nextProbe = 0
+    self.log = []
+
+  # Mode for a value without hysteresis. Used for the first probe
+  def classify(self, value):
+    if value >= self.dayEdge:
+      return 'day'
+    if value <= self.nightEdge:
+      return 'night'
+    return 'twilight'
+
+  # Mode for a value starting from the current mode. A threshold must be
+  # crossed by the margin to change mode so the mode holds inside the band
+  def target(self, value):
+    if self.state is None:
+      return self.classify(value)
+    if self.state == 'day':
+      if value <= self.nightEdge - self.margin:
+        return 'night'
+      if value < self.dayEdge - self.margin:
+        return 'twilight'
+      return 'day'
+    if self.state == 'night':
+      if value >= self.dayEdge + self.margin:
+        return 'day'
+      if value > self.nightEdge + self.margin:
+        return 'twilight'
+      return 'night'
+    if value >= self.dayEdge + self.margin:
+      return 'day'
+    if value <= self.nightEdge - self.margin:
+      return 'night'
+    return 'twilight'
+
+  # Change per second of recent values. None until there are two samples
+  def trend(self):
+    if len(self.samples) < 2:
+      return None
+    count = float(len(self.samples))
+    meanTime = sum(t for t, v in self.samples) / count
+    meanValue = sum(v for t, v in self.samples) / count
+    spread = sum((t - meanTime) ** 2 for t, v in self.samples)
+    if spread <= 0:
+      return None
+    return sum((t - meanTime) * (v - meanValue) for t, v in self.samples) / spread
+
+  # Seconds until the trend reaches the threshold that would end the current mode
+  def timeToEdge(self):
+    slope = self.trend()
+    if slope is None or self.state == 'twilight':
+      return 0
+    if self.state == 'day':
+      distance = self.value - (self.dayEdge - self.margin)
+      slope = -slope
+    else:
+      distance = (self.nightEdge + self.margin) - self.value
+    if distance <= 0:
+      return 0
+    if slope <= 0:
+      return self.maxProbeSec   # Moving away from the threshold
+    return distance / slope
+
+  # True if the scene should be probed for the frame taken now
+  def probeDue(self, timeNow=None):
+    if timeNow is None:
+      timeNow = self.clock()
+    return self.state is None or timeNow >= self.nextProbe
+
+  # Record a probe value taken at timeNow and return the mode to use
+  def update(self, value, timeNow=None, reason='probe'):
+    if timeNow is None:
+      timeNow = self.clock()
+    self.samples.append((timeNow, value))
+    self.value = value
+    target = self.target(value)
+    if target != self.state:
+      if self.state is None or timeNow - self.since >= self.dwellSec:
+        self._change(target, timeNow, reason)
+      else:
+        stats.count('mode_dwell_holds')
+    wait = min(self.timeToEdge() * self.probeSafety, self.maxProbeSec)
+    self.nextProbe = timeNow + wait
+    stats.gauge('probe_interval_sec', wait)
+    return self.state
+
+  # Set the mode from another source eg the sun schedule
+  def setState(self, mode, timeNow=None, reason='schedule'):
+    if timeNow is None:
+      timeNow = self.clock()
+    if mode != self.state:
+      self._change(mode, timeNow, reason)
+
+  def _change(self, mode, timeNow, reason):
+    slope = self.trend()
+    entry = (timeNow, self.state, mode, self.value, slope, reason)
+    self.log.append(entry)
+    if self.state is not None:
+      stats.count('mode_state_changes')
+    self.state = mode
+    self.since = timeNow
+    if self.verbose:
+      print "SceneState        - %s" % formatEntry(entry)
+    if self.logPath is not None:
+      try:
+        with open(self.logPath, 'a') as f:
+          f.write(formatEntry(entry) + '\n')
+      except IOError as err:
+        print "SceneState        - ERROR writing %s %s" % (self.logPath, err)
+
+# One line of the transition log. trend is per hour
+def formatEntry(entry):
+  timeNow, fromMode, toMode, value, slope, reason = entry
+  return "%s,%s,%s,%s,%s,%s" % (
+           time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timeNow)), fromMode, toMode,
+           '' if value is None else "%.3f" % value,
+           '' if slope is None else "%.3f" % (slope * 3600), reason)
+
+if __name__ == '__main__':
+  if len(sys.argv) < 2:
+    print "Usage: python ./scenestate.py transitionfile"
+    sys.exit(1)
+  print "%-19s  %-8s    %-8s  %10s  %10s  %s" % ('time', 'from', 'to', 'value', 'trend/hr', 'reason')
+  with open(sys.argv[1], 'r') as f:
+    for line in f:
+      fields = line.rstrip('\n').split(',')
+      if len(fields) == 6:
+        print "%-19s  %-8s -> %-8s  %10s  %10s  %s" % tuple(fields)
@@ -0,0 +1,415 @@
+#!/usr/bin/python
+# simulate.py - Replay simulator and benchmark for the rpi-timelapse.py capture loop
+#
+# Runs the unchanged rpi-timelapse.py main loop with the fake camera backend
+# and a virtual clock so a whole day of captures takes seconds on any computer.
+# Camera exposures, settle delays and the frame schedule all advance the
+# virtual clock instead of sleeping.  Background stamping and storage run
+# in line after each capture so their cost is measured per frame.
+#
+# The light level comes from the fake camera built in day curve, a
+# secondsOfDay,lux csv file (--curve) or is replayed from the scene light
+# levels recorded in a real rpi-timelapse.manifest (--replay).
+#
+# Reports per cycle latency (virtual seconds incl. exposures and settle, and
+# real cpu milliseconds), captures per frame, SD bytes written per frame and
+# the day/twilight/night decisions made through the day.
+#
+# python ./simulate.py                         simulate 24 hours and print a report
+# python ./simulate.py --set meterMode='filesize' --hours 6
+# python ./simulate.py --replay rpi-timelapse.manifest
+# python ./simulate.py --bench --save bench.json     run benchmark scenarios
+# python ./simulate.py --bench --compare bench.json  exit 1 if results regressed
+
+import argparse
+import ast
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rpi-timelapse.py')
+START_DATE = '2026-03-20'   # Equinox. Sun schedule at latitude 0 matches the fake camera day curve
+
+# Settings replaced in rpi-timelapse.py for every simulation
+SIM_SETTINGS = {'cameraBackend':'fake', 'verbose':False, 'debugLog':False,
+                'numberMax':0, 'imagePreview':False, 'offloadDir':None,
+                'imageWidth':640, 'imageHeight':360}
+
+# File size thresholds of rpi-timelapse.py scaled to the simulated image size
+SCALED_SETTINGS = ('twilightZoneDay', 'twilightZoneNight')
+
+# Benchmark scenarios. Settings replaced on top of SIM_SETTINGS
+SCENARIOS = [
+  ('luma',      {}),
+  ('filesize',  {'meterMode':'filesize'}),
+  ('sunclock',  {'latitude':0.0, 'longitude':0.0}),
+  ('nightauto', {'imageNightAuto':True}),
+  ('dayfixed',  {'imageDayAuto':False}),
+]
+
+# Benchmark results compared with --compare and the allowed increase
+BENCH_LIMITS = {'capturesPerFrame':1.10, 'cycleSecP95':1.20, 'cycleSecMax':1.20,
+                'bytesPerFrame':1.20, 'cpuMsMean':1.50, 'settleSec':1.20,
+                'dropped':1.0, 'transitions':1.0}
+
+_realTime = time.time
+_realSleep = time.sleep
+
+class VirtualClock(object):
+  def __init__(self, start=0.0):
+    self.now = float(start)
+
+  def time(self):
+    return self.now
+
+  def sleep(self, seconds):
+    if seconds > 0:
+      self.now += seconds
+
+# The clock used while a simulation runs. Installed once so modules that
+# bind time.time/time.sleep as default arguments also see the virtual clock
+_clock = None
+
+def _install():
+  if getattr(time, '_simInstalled', False):
+    return
+  time.time = lambda: _clock.time() if _clock is not None else _realTime()
+  time.sleep = lambda seconds: _clock.sleep(seconds) if _clock is not None else _realSleep(seconds)
+  time.monotonic = time.time
+  time._simInstalled = True
+
+# datetime module whose datetime.now() reads the virtual clock
+def _datetimeModule():
+  module = types.ModuleType('datetime')
+  module.__dict__.update(datetime.__dict__)
+  class SimDatetime(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+      return cls.fromtimestamp(time.time(), tz)
+  module.datetime = SimDatetime
+  return module
+
+def percentile(values, fraction):
+  if not values:
+    return 0
+  values = sorted(values)
+  return values[min(int(len(values) * fraction), len(values) - 1)]
+
+# Write a light curve csv from the light levels recorded in a frame manifest
+def replayCurve(manifestPath, curvePath):
+  _install()
+  import manifest
+  import timelapsecam
+  frameManifest = manifest.FrameManifest(manifestPath, readOnly=True)
+  minutes = {}
+  for record in frameManifest.records():
+    if record.get('level', 0) > 0:
+      local = time.localtime(record['time'])
+      minute = local.tm_hour * 60 + local.tm_min
+      minutes.setdefault(minute, []).append(record['level'] / timelapsecam.FakeCamera.SENSITIVITY)
+  frameManifest.close()
+  if not minutes:
+    raise ValueError("No light levels recorded in %s" % manifestPath)
+  with open(curvePath, 'w') as f:
+    f.write("# secondsOfDay,lux replayed from %s\n" % manifestPath)
+    for minute in sorted(minutes):
+      levels = sorted(minutes[minute])
+      f.write("%i,%f\n" % (minute * 60, levels[len(levels) // 2]))
+
+# Value of a setting in rpi-timelapse.py eg imageWidth
+def scriptSetting(name):
+  with open(SCRIPT_PATH) as f:
+    for line in f:
+      if line.startswith(name + ' ') or line.startswith(name + '='):
+        return ast.literal_eval(line.split('=', 1)[1].split('#', 1)[0].strip())
+  raise KeyError(name)
+
+class Simulation(object):
+  def __init__(self, settings=None, hours=24.0, startDate=START_DATE,
+               lightCurveFile=None, verbose=False, keep=False):
+    self.settings = dict(SIM_SETTINGS)
+    self.settings.update(settings or {})
+    # Jpeg file sizes scale with the pixel count so filesize metering makes
+    # the same decisions at the smaller simulated image size
+    if 'imageWidth' in self.settings and 'imageHeight' in self.settings:
+      scale = (self.settings['imageWidth'] * self.settings['imageHeight'] /
+               float(scriptSetting('imageWidth') * scriptSetting('imageHeight')))
+      for name in SCALED_SETTINGS:
+        if name not in self.settings:
+          self.settings[name] = int(scriptSetting(name) * scale)
+    if lightCurveFile is not None:
+      self.settings['fakeLightCurve'] = os.path.abspath(lightCurveFile)
+    self.hours = hours
+    if ' ' in startDate:
+      self.startTime = time.mktime(time.strptime(startDate, '%Y-%m-%d %H:%M'))
+    else:
+      self.startTime = time.mktime(time.strptime(startDate, '%Y-%m-%d'))
+    self.verbose = verbose
+    self.keep = keep
+    self.cycles = []     # (virtualSec, cpuSec, captures) per frame
+    self.stageSec = {}   # real seconds per pipeline stage
+    self.camera = None
+    self.scheduler = None
+
+  # Run the capture loop and return a report dict
+  def run(self):
+    global _clock
+    _install()
+    import pipeline
+    import timelapsecam
+    import manifest
+    import stats
+
+    sim = self
+    stats.reset()
+    endTime = self.startTime + self.hours * 3600
+    realOpenCamera = timelapsecam.openCamera
+    realScheduler = pipeline.FrameScheduler
+    realPipeline = pipeline.FramePipeline
+
+    class SimulationDone(Exception):
+      pass
+
+    class SimScheduler(realScheduler):
+      # Only the first scheduler (the main loop) measures cycles. Others eg burst run normally
+      def __init__(self, interval, *args, **kwargs):
+        realScheduler.__init__(self, interval, *args, **kwargs)
+        self.cycleStart = None
+        if sim.scheduler is None:
+          sim.scheduler = self
+
+      def waitNext(self):
+        if self is not sim.scheduler:
+          return realScheduler.waitNext(self)
+        if self.cycleStart is not None:
+          sim.cycles.append((_clock.time() - self.cycleStart[0],
+                             _realTime() - self.cycleStart[1],
+                             sim.camera.captureCount - self.cycleStart[2]))
+        if _clock.time() >= endTime:
+          raise SimulationDone()
+        lateness = realScheduler.waitNext(self)
+        self.cycleStart = (_clock.time(), _realTime(), sim.camera.captureCount)
+        return lateness
+
+    class SimPipeline(object):
+      # Same interface as pipeline.FramePipeline but runs stages in line
+      def __init__(self, stages, maxQueue=8, verbose=False):
+        self.stages = stages
+        self.dropped = 0
+        self.errors = 0
+        self.processed = 0
+
+      def submit(self, frame, timeout=0):
+        for name, function in self.stages:
+          started = _realTime()
+          try:
+            frame = function(frame)
+          except Exception as err:
+            self.errors += 1
+            print "SimPipeline       - ERROR %s stage %s %s" % (frame.get('filename'), name, err)
+            frame = None
+          sim.stageSec[name] = sim.stageSec.get(name, 0.0) + _realTime() - started
+          if frame is None:
+            return True
+        self.processed += 1
+        return True
+
+      def pending(self):
+        return 0
+
+      def close(self):
+        pass
+
+    def openCamera(backend='picamera', lightCurveFile=None, clock=None, sleep=None):
+      sim.camera = realOpenCamera(backend, lightCurveFile, _clock.time, _clock.sleep)
+      return sim.camera
+
+    workDir = tempfile.mkdtemp(prefix='rpi-timelapse-sim-')
+    namespace = {'__name__':'__main__', '__file__':os.path.join(workDir, 'rpi-timelapse.py'),
+                 'settingsOverride':self.settings}
+    savedArgv = sys.argv
+    savedStdout = sys.stdout
+    savedDatetime = sys.modules['datetime']
+    _clock = VirtualClock(self.startTime)
+    timelapsecam.openCamera = openCamera
+    pipeline.FrameScheduler = SimScheduler
+    pipeline.FramePipeline = SimPipeline
+    sys.modules['datetime'] = _datetimeModule()
+    sys.argv = [SCRIPT_PATH]
+    if not self.verbose:
+      sys.stdout = open(os.devnull, 'w')
+    realStart = _realTime()
+    try:
+      try:
+        exec compile(open(SCRIPT_PATH).read(), SCRIPT_PATH, 'exec') in namespace
+      except (SimulationDone, SystemExit):
+        pass
+      if 'camSession' in namespace:
+        namespace['camSession'].close()
+      if 'frameManifest' in namespace:
+        namespace['frameManifest'].close()
+    finally:
+      if sys.stdout is not savedStdout:
+        sys.stdout.close()
+      sys.stdout = savedStdout
+      sys.argv = savedArgv
+      sys.modules['datetime'] = savedDatetime
+      timelapsecam.openCamera = realOpenCamera
+      pipeline.FrameScheduler = realScheduler
+      pipeline.FramePipeline = realPipeline
+      _clock = None
+    realSec = _realTime() - realStart
+
+    records = []
+    manifestPath = os.path.join(workDir, 'rpi-timelapse.manifest')
+    if os.path.exists(manifestPath):
+      frameManifest = manifest.FrameManifest(manifestPath, readOnly=True)
+      records = list(frameManifest.records())
+      frameManifest.close()
+    report = self.report(namespace, records, realSec)
+    if self.keep:
+      report['workDir'] = workDir
+    else:
+      shutil.rmtree(workDir)
+    return report
+
+  def report(self, namespace, records, realSec):
+    import manifest
+    import stats
+    snapshot = stats.registry.snapshot()
+    frames = len(self.cycles)
+    virtualSec = [cycle[0] for cycle in self.cycles]
+    cpuMs = [cycle[1] * 1000.0 for cycle in self.cycles]
+    captures = [cycle[2] for cycle in self.cycles]
+    modes = {}
+    transitions = []
+    lastMode = None
+    for record in records:
+      mode = record.get('mode', '')
+      modes[mode] = modes.get(mode, 0) + 1
+      if lastMode is not None and mode != lastMode:
+        transitions.append((time.strftime('%H:%M', time.localtime(record['time'])), lastMode, mode))
+      lastMode = mode
+    bytesWritten = sum([record.get('bytes', 0) + manifest.RECORD_SIZE for record in records])
+    scheduler = namespace.get('frameScheduler')
+    framePipeline = namespace.get('framePipeline')
+    camSession = namespace.get('camSession')
+    return {
+      'frames':frames,
+      'stored':len(records),
+      'realSec':realSec,
+      'capturesPerFrame':sum(captures) / float(max(len(records), 1)),
+      'capturesMax':max(captures or [0]),
+      'cycleSecMean':sum(virtualSec) / float(max(frames, 1)),
+      'cycleSecP95':percentile(virtualSec, 0.95),
+      'cycleSecMax':max(virtualSec or [0]),
+      'cpuMsMean':sum(cpuMs) / float(max(frames, 1)),
+      'cpuMsP95':percentile(cpuMs, 0.95),
+      'stageMs':dict([(name, sec * 1000.0 / max(frames, 1)) for name, sec in self.stageSec.items()]),
+      'bytesPerFrame':bytesWritten / float(max(len(records), 1)),
+      'settleSec':camSession.settleTotal if camSession is not None else 0,
+      'late':scheduler.late if scheduler is not None else 0,
+      'dropped':scheduler.dropped if scheduler is not None else 0,
+      'errors':framePipeline.errors if framePipeline is not None else 0,
+      'timerSec':dict([(name, timer['sum']) for name, timer in snapshot['timers'].items()]),
+      'counters':snapshot['counters'],
+      'modes':modes,
+      'transitions':len(transitions),
+      'transitionLog':transitions,
+    }
+
+def printReport(name, report):
+  print "%s - %i frames in %.1f real sec" % (name, report['frames'], report['realSec'])
+  print "  captures/frame  mean=%.2f max=%i" % (report['capturesPerFrame'], report['capturesMax'])
+  print "  cycle sec       mean=%.2f p95=%.2f max=%.2f (virtual incl. exposure and settle)" % (
+          report['cycleSecMean'], report['cycleSecP95'], report['cycleSecMax'])
+  print "  cpu ms          mean=%.1f p95=%.1f  stages %s" % (report['cpuMsMean'], report['cpuMsP95'],
+          ' '.join(["%s=%.1f" % item for item in sorted(report['stageMs'].items())]))
+  print "  SD bytes/frame  %i" % report['bytesPerFrame']
+  print "  settle=%.0f sec late=%i dropped=%i errors=%i" % (report['settleSec'], report['late'],
+          report['dropped'], report['errors'])
+  print "  virtual sec     %s" % ' '.join(["%s=%.0f" % item for item in sorted(report['timerSec'].items())
+                                             if not item[0].startswith('stage_')])
+  print "  modes           %s" % ' '.join(["%s=%i" % item for item in sorted(report['modes'].items())])
+  for timeText, fromMode, toMode in report['transitionLog']:
+    print "  %s %s -> %s" % (timeText, fromMode, toMode)
+  if 'workDir' in report:
+    print "  images kept in  %s" % report['workDir']
+
+# Compare benchmark results with a saved baseline. Returns a list of regressions
+def compareBench(results, baseline):
+  regressions = []
+  for name, report in results.items():
+    if name not in baseline:
+      continue
+    for metric, limit in sorted(BENCH_LIMITS.items()):
+      old = baseline[name].get(metric, 0)
+      new = report.get(metric, 0)
+      if new > old * limit and new - old > 1e-6:
+        regressions.append("%s %s %.2f > baseline %.2f" % (name, metric, new, old))
+  return regressions
+
+def parseSetting(text):
+  name, value = text.split('=', 1)
+  try:
+    return name.strip(), ast.literal_eval(value.strip())
+  except (ValueError, SyntaxError):
+    return name.strip(), value.strip()
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Simulate rpi-timelapse.py with a virtual clock')
+  parser.add_argument('--hours', type=float, default=24.0, help='simulated hours (default 24)')
+  parser.add_argument('--start', default=START_DATE, help='simulated start "yyyy-mm-dd" or "yyyy-mm-dd hh:mm"')
+  parser.add_argument('--curve', help='light curve csv file of secondsOfDay,lux lines')
+  parser.add_argument('--replay', help='replay light levels recorded in a frame manifest')
+  parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                      help='replace an rpi-timelapse.py setting eg --set timeDelay=60')
+  parser.add_argument('--full', action='store_true', help='use the rpi-timelapse.py image size')
+  parser.add_argument('--bench', action='store_true', help='run the benchmark scenarios')
+  parser.add_argument('--save', help='save benchmark results to a json file')
+  parser.add_argument('--compare', help='compare benchmark results with a saved json file')
+  parser.add_argument('--keep', action='store_true', help='keep the simulated images folder')
+  parser.add_argument('--verbose', action='store_true', help='show rpi-timelapse.py output')
+  args = parser.parse_args()
+
+  os.environ['TZ'] = 'UTC'   # Same results on any computer
+  time.tzset()
+  settings = dict([parseSetting(text) for text in args.set])
+  if args.full:
+    del SIM_SETTINGS['imageWidth']
+    del SIM_SETTINGS['imageHeight']
+  curve = args.curve
+  if args.replay:
+    curve = os.path.join(tempfile.gettempdir(), 'rpi-timelapse-replay.csv')
+    replayCurve(args.replay, curve)
+
+  if args.bench:
+    scenarios = SCENARIOS
+  else:
+    scenarios = [('simulate', {})]
+  results = {}
+  for name, scenarioSettings in scenarios:
+    scenarioSettings = dict(scenarioSettings)
+    scenarioSettings.update(settings)
+    report = Simulation(scenarioSettings, args.hours, args.start, curve,
+                        args.verbose, args.keep).run()
+    results[name] = report
+    printReport(name, report)
+
+  if args.save:
+    with open(args.save, 'w') as f:
+      json.dump(results, f, indent=1, sort_keys=True)
+    print "Saved results to %s" % args.save
+  if args.compare:
+    with open(args.compare, 'r') as f:
+      regressions = compareBench(results, json.load(f))
+    for regression in regressions:
+      print "REGRESSION - %s" % regression
+    if regressions:
+      sys.exit(1)
+    print "No regressions compared with %s" % args.compare
@@ -0,0 +1,196 @@
+#!/usr/bin/python
+# stats.py - Timing histograms, counters and gauges for rpi-timelapse.py
+#
+# Modules record where the time goes with
+#
+#   with stats.timer('camera_settle'):
+#     ...
+#   stats.count('bytes_written', len(data))
+#
+# and rpi-timelapse.py exports everything after each frame as a json file and
+# a Prometheus text file, both rewritten atomically (temp file then rename) so
+# a reader never sees a half written file.  StatusServer serves the same data
+# over http for scraping a fleet of cameras without a console.
+#
+#   http://camera:port/metrics   Prometheus text
+#   http://camera:port/status    json
+#
+# python ./stats.py rpi-timelapse.stats.json    print a saved json file
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import BaseHTTPServer
+
+PREFIX = 'rpi_timelapse_'
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram(object):
+  def __init__(self, buckets=BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)   # last is +Inf
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def observe(self, value):
+    index = 0
+    while index < len(self.buckets) and value > self.buckets[index]:
+      index += 1
+    self.counts[index] += 1
+    self.count += 1
+    self.sum += value
+    self.max = max(self.max, value)
+
+  def snapshot(self):
+    return {'count':self.count, 'sum':self.sum, 'max':self.max,
+            'mean':self.sum / self.count if self.count else 0.0,
+            'buckets':zip(list(self.buckets) + ['+Inf'], self.counts)}
+
+class Stats(object):
+  # Thread safe registry. Pipeline and offload threads record into it too
+  def __init__(self, clock=time.time):
+    self.clock = clock
+    self.lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self.lock:
+      self.histograms = {}
+      self.counters = {}
+      self.gauges = {}
+      self.started = time.time()
+
+  def observe(self, name, seconds):
+    with self.lock:
+      histogram = self.histograms.get(name)
+      if histogram is None:
+        histogram = self.histograms[name] = Histogram()
+      histogram.observe(seconds)
+
+  @contextlib.contextmanager
+  def timer(self, name):
+    started = self.clock()
+    try:
+      yield
+    finally:
+      self.observe(name, self.clock() - started)
+
+  def count(self, name, amount=1):
+    with self.lock:
+      self.counters[name] = self.counters.get(name, 0) + amount
+
+  def gauge(self, name, value):
+    with self.lock:
+      self.gauges[name] = value
+
+  def snapshot(self):
+    with self.lock:
+      return {'time':time.time(), 'uptime':time.time() - self.started,
+              'timers':dict([(name, h.snapshot()) for name, h in self.histograms.items()]),
+              'counters':dict(self.counters), 'gauges':dict(self.gauges)}
+
+  def prometheusText(self):
+    snapshot = self.snapshot()
+    lines = []
+    for name, histogram in sorted(snapshot['timers'].items()):
+      metric = PREFIX + name + '_seconds'
+      lines.append("# TYPE %s histogram" % metric)
+      total = 0
+      for bound, count in histogram['buckets']:
+        total += count
+        lines.append('%s_bucket{le="%s"} %i' % (metric, bound, total))
+      lines.append("%s_sum %f" % (metric, histogram['sum']))
+      lines.append("%s_count %i" % (metric, histogram['count']))
+    for name, value in sorted(snapshot['counters'].items()):
+      lines.append("# TYPE %s%s_total counter" % (PREFIX, name))
+      lines.append("%s%s_total %s" % (PREFIX, name, value))
+    for name, value in sorted(snapshot['gauges'].items()):
+      lines.append("# TYPE %s%s gauge" % (PREFIX, name))
+      lines.append("%s%s %s" % (PREFIX, name, value))
+    lines.append("# TYPE %suptime_seconds gauge" % PREFIX)
+    lines.append("%suptime_seconds %f" % (PREFIX, snapshot['uptime']))
+    return '\n'.join(lines) + '\n'
+
+  def jsonText(self):
+    return json.dumps(self.snapshot(), sort_keys=True)
+
+  # Rewrite the json and/or Prometheus files. None skips a file
+  def writeFiles(self, jsonPath=None, promPath=None):
+    for path, text in ((jsonPath, self.jsonText), (promPath, self.prometheusText)):
+      if path is None:
+        continue
+      tmpName = path + '.tmp'
+      with open(tmpName, 'w') as f:
+        f.write(text())
+      os.rename(tmpName, path)
+
+# Registry shared by all modules
+registry = Stats()
+
+def setClock(clock):
+  registry.clock = clock
+
+def timer(name):
+  return registry.timer(name)
+
+def observe(name, seconds):
+  registry.observe(name, seconds)
+
+def count(name, amount=1):
+  registry.count(name, amount)
+
+def gauge(name, value):
+  registry.gauge(name, value)
+
+def reset():
+  registry.reset()
+
+class StatusServer(object):
+  # Serves /metrics and /status from a background thread
+  def __init__(self, port, host='', stats=registry):
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+      def do_GET(self):
+        if self.path.startswith('/metrics'):
+          body, contentType = stats.prometheusText(), 'text/plain; version=0.0.4'
+        elif self.path.startswith('/status'):
+          body, contentType = stats.jsonText(), 'application/json'
+        else:
+          self.send_error(404)
+          return
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        pass   # Keep the console for rpi-timelapse.py messages
+
+    self.server = BaseHTTPServer.HTTPServer((host, port), Handler)
+    self.thread = threading.Thread(target=self.server.serve_forever, name='stats')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+if __name__ == '__main__':
+  if len(sys.argv) < 2:
+    print "Usage: python ./stats.py statsfile.json"
+    sys.exit(1)
+  with open(sys.argv[1], 'r') as f:
+    snapshot = json.load(f)
+  print "uptime %.0f sec" % snapshot['uptime']
+  for name, histogram in sorted(snapshot['timers'].items()):
+    print "%-20s count=%-6i mean=%8.1f ms  max=%8.1f ms  total=%8.1f sec" % (
+            name, histogram['count'], histogram['mean'] * 1000, histogram['max'] * 1000, histogram['sum'])
+  for name, value in sorted(snapshot['counters'].items()):
+    print "%-20s %s" % (name, value)
+  for name, value in sorted(snapshot['gauges'].items()):
+    print "%-20s %s" % (name, value)
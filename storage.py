@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# storage.py - Date sharded image storage with free space watermarks for rpi-timelapse.py
+#
+# Images are stored in date or date/hour sub folders of the images folder
+#
+#   images/20261018/17/front-10000.jpg
+#
+# so no folder ever holds more than a day or an hour of images and listing,
+# copying or deleting a folder stays fast however long the timelapse runs.
+# The frame manifest records the path relative to the manifest so makemovie.py,
+# offload.py and thumbcache.py find the images without knowing the layout.
+#
+# Free space is checked before every write.  Below lowFreeMB the oldest images
+# are deleted in manifest order until highFreeMB is free again.  Only images
+# already copied by offload.py (behind its manifest position) are deleted
+# unless offloadedOnly=False.  Below stopFreeMB images are not stored at all so
+# the SD card never fills and capture keeps running until space is freed.
+# The manifest position of the oldest image not yet deleted is kept in the
+# rpi-timelapse.retention file so old records are not checked again.
+# One FrameStore is shared by the pipeline threads (profiles.py outputs and
+# the images) so writes and retention are done under a lock.
+#
+# python ./storage.py [manifestfile]    show free space and deletable images
+
+import errno
+import os
+import sys
+import threading
+
+import manifest
+import offload
+import stats
+
+MB = 1024 * 1024
+
+# Sub folder for an image taken at rightNow. shard is 'hour', 'day' or None for no sub folder
+def shardDir(rightNow, shard='hour'):
+  if shard == 'hour':
+    return "%04d%02d%02d/%02d" % (rightNow.year, rightNow.month, rightNow.day, rightNow.hour)
+  if shard == 'day':
+    return "%04d%02d%02d" % (rightNow.year, rightNow.month, rightNow.day)
+  return ''
+
+# Bytes free for a non root user on the file system holding path
+def freeBytes(path):
+  fs = os.statvfs(path)
+  return fs.f_bavail * fs.f_frsize
+
+def makeDirs(path):
+  try:
+    os.makedirs(path)
+  except OSError as err:
+    if err.errno != errno.EEXIST:
+      raise
+
+# File holding the manifest position of the oldest image not yet deleted
+def cursorPath(manifestPath):
+  return os.path.splitext(manifestPath)[0] + '.retention'
+
+class FrameStore(object):
+  def __init__(self, imagePath, frameManifest, shard='hour', lowFreeMB=500,
+               highFreeMB=1000, stopFreeMB=100, offloadedOnly=True, verbose=False):
+    self.imagePath = imagePath
+    self.frameManifest = frameManifest
+    self.shard = shard
+    self.lowFree = lowFreeMB * MB
+    self.highFree = max(highFreeMB, lowFreeMB) * MB
+    self.stopFree = stopFreeMB * MB
+    self.offloadedOnly = offloadedOnly
+    self.verbose = verbose
+    self.cursorPath = cursorPath(frameManifest.filename)
+    self.lastDir = None
+    self.deleted = 0
+    self.skipped = 0
+    self.lock = threading.RLock()
+
+  # Full file name for an image called name taken at rightNow
+  def imageFileName(self, name, rightNow):
+    return os.path.join(self.imagePath, shardDir(rightNow, self.shard), name)
+
+  # Manifest position of the oldest image not yet deleted
+  def cursor(self):
+    try:
+      with open(self.cursorPath, 'r') as f:
+        return int(f.read().strip() or 0)
+    except (IOError, ValueError):
+      return 0
+
+  def setCursor(self, index):
+    tmpName = self.cursorPath + '.tmp'
+    with open(tmpName, 'w') as f:
+      f.write("%i\n" % index)
+    os.rename(tmpName, self.cursorPath)
+
+  # Manifest position up to which images may be deleted
+  def deletableEnd(self):
+    if self.offloadedOnly:
+      return min(offload.readCursor(self.frameManifest.filename), self.frameManifest.count())
+    return self.frameManifest.count()
+
+  # Delete the oldest images until highFree bytes are free or nothing is left to delete.
+  # Returns the number of images deleted
+  def applyRetention(self):
+    with self.lock:
+      return self._applyRetention()
+
+  def _applyRetention(self):
+    index = self.cursor()
+    end = self.deletableEnd()
+    deleted = 0
+    free = freeBytes(self.imagePath)
+    while index < end and free < self.highFree:
+      filename = self.frameManifest.imagePath(self.frameManifest.record(index))
+      index += 1
+      try:
+        size = os.path.getsize(filename)
+        os.remove(filename)
+      except OSError:
+        continue   # Already deleted eg by offload.py
+      deleted += 1
+      free += size
+      self._removeEmptyDirs(os.path.dirname(filename))
+      if deleted % 100 == 0:
+        self.setCursor(index)
+        free = freeBytes(self.imagePath)
+    self.setCursor(index)
+    self.deleted += deleted
+    stats.count('retention_deleted', deleted)
+    if self.verbose or free < self.highFree:
+      print "FrameStore        - Deleted %i old images. %i MB free" % (deleted, free // MB)
+    return deleted
+
+  # Remove shard folders emptied by retention. Never the images folder itself
+  def _removeEmptyDirs(self, path):
+    top = os.path.abspath(self.imagePath)
+    path = os.path.abspath(path)
+    while path.startswith(top + os.sep) and path != self.lastDir:
+      try:
+        os.rmdir(path)
+      except OSError:
+        return
+      path = os.path.dirname(path)
+
+  # Check free space before storing nbytes. Runs retention below the low
+  # watermark. Returns False if the image should not be stored
+  def checkSpace(self, nbytes):
+    free = freeBytes(self.imagePath)
+    if free - nbytes < self.lowFree:
+      self.applyRetention()
+      free = freeBytes(self.imagePath)
+    stats.gauge('storage_free_bytes', free)
+    if free - nbytes < self.stopFree:
+      self.skipped += 1
+      stats.count('storage_skipped')
+      print "FrameStore        - WARNING Only %i MB free. Image not stored" % (free // MB)
+      return False
+    return True
+
+  # Write data to filename. Written to a temp file then renamed so other
+  # programs never see a half written image. Returns False if not stored
+  def write(self, filename, data):
+    with self.lock:
+      return self._write(filename, data)
+
+  def _write(self, filename, data):
+    if not self.checkSpace(len(data)):
+      return False
+    folder = os.path.dirname(filename)
+    if folder != self.lastDir:
+      makeDirs(folder)
+      self.lastDir = folder
+    tmpName = filename + '.tmp'
+    with open(tmpName, 'wb') as f:
+      f.write(data)
+    os.rename(tmpName, filename)
+    return True
+
+if __name__ == '__main__':
+  if len(sys.argv) > 1:
+    manifestPath = sys.argv[1]
+  else:
+    manifestPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rpi-timelapse.manifest')
+  frameManifest = manifest.FrameManifest(manifestPath, readOnly=True)
+  store = FrameStore(frameManifest.baseDir, frameManifest)
+  start = store.cursor()
+  end = store.deletableEnd()
+  print "storage.py - %i MB free" % (freeBytes(frameManifest.baseDir) // MB)
+  print "             %i images in manifest. Oldest kept %i. Offloaded up to %i" % (frameManifest.count(), start, end)
+  print "             %i images can be deleted by retention" % max(end - start, 0)
+  frameManifest.close()
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# sunclock.py - Offline sunrise, sunset and civil twilight times for rpi-timelapse.py
+#
+# Uses the Almanac for Computers sunrise equation so no network is required.
+# Times are accurate to a minute or two which is plenty for picking when
+# rpi-timelapse.py needs to probe the scene.  Needs a correct system clock.
+#
+# Run on its own to print today's times for a location
+# python ./sunclock.py latitude longitude      eg  python ./sunclock.py 45.42 -75.69
+
+import calendar
+import datetime
+import math
+import sys
+import time
+
+ZENITH_OFFICIAL = 90.833   # Sun centre below horizon at sunrise/sunset incl refraction
+ZENITH_CIVIL = 96.0        # Civil twilight ends when sun is 6 degrees below horizon
+
+def _sin(deg):
+  return math.sin(math.radians(deg))
+
+def _cos(deg):
+  return math.cos(math.radians(deg))
+
+# UTC epoch seconds of a sun rise or set event on a calendar date.
+# Returns None if the sun does not reach zenith that day (polar day or night)
+def sunEvent(date, latitude, longitude, zenith=ZENITH_OFFICIAL, rising=True):
+  dayOfYear = date.timetuple().tm_yday
+  lngHour = longitude / 15.0
+  if rising:
+    approx = 6.0
+  else:
+    approx = 18.0
+  t = dayOfYear + ((approx - lngHour) / 24.0)
+  meanAnomaly = (0.9856 * t) - 3.289
+  sunLong = (meanAnomaly + (1.916 * _sin(meanAnomaly)) + (0.020 * _sin(2 * meanAnomaly)) + 282.634) % 360
+  rightAsc = math.degrees(math.atan(0.91764 * math.tan(math.radians(sunLong)))) % 360
+  # right ascension needs to be in the same quadrant as sun longitude
+  rightAsc = (rightAsc + (math.floor(sunLong / 90) * 90 - math.floor(rightAsc / 90) * 90)) / 15.0
+  sinDec = 0.39782 * _sin(sunLong)
+  cosDec = math.cos(math.asin(sinDec))
+  cosH = (_cos(zenith) - (sinDec * _sin(latitude))) / (cosDec * _cos(latitude))
+  if cosH > 1 or cosH < -1:
+    return None
+  if rising:
+    hourAngle = (360 - math.degrees(math.acos(cosH))) / 15.0
+  else:
+    hourAngle = math.degrees(math.acos(cosH)) / 15.0
+  localMean = hourAngle + rightAsc - (0.06571 * t) - 6.622
+  utHours = (localMean - lngHour) % 24
+  # Keep the event on the requested date for locations far from Greenwich
+  expected = approx - lngHour
+  if utHours - expected > 12:
+    utHours -= 24
+  elif utHours - expected < -12:
+    utHours += 24
+  midnight = calendar.timegm((date.year, date.month, date.day, 0, 0, 0))
+  return midnight + utHours * 3600
+
+# Civil dawn, sunrise, sunset and civil dusk epoch seconds for a date. Entries may be None
+def sunTimes(date, latitude, longitude):
+  return (sunEvent(date, latitude, longitude, ZENITH_CIVIL, True),
+          sunEvent(date, latitude, longitude, ZENITH_OFFICIAL, True),
+          sunEvent(date, latitude, longitude, ZENITH_OFFICIAL, False),
+          sunEvent(date, latitude, longitude, ZENITH_CIVIL, False))
+
+class SunSchedule(object):
+  # Predicts when the scene is in stable day, stable night or near twilight.
+  # Twilight windows run from marginSec before civil dawn to marginSec
+  # after sunrise and from marginSec before sunset to marginSec after civil dusk.
+  def __init__(self, latitude, longitude, marginSec=30*60):
+    self.latitude = latitude
+    self.longitude = longitude
+    self.marginSec = marginSec
+    self._windows = {}   # cache of twilight windows by date
+
+  # Twilight windows for a date as a list of dicts sorted by start time
+  # kind is 'sunrise' or 'sunset'. anchor is sunrise/sunset epoch seconds
+  def windows(self, date):
+    if date not in self._windows:
+      dawn, rise, set_, dusk = sunTimes(date, self.latitude, self.longitude)
+      windows = []
+      if dawn is not None and rise is not None:
+        windows.append({'kind':'sunrise', 'start':dawn - self.marginSec,
+                        'end':rise + self.marginSec, 'anchor':rise})
+      if set_ is not None and dusk is not None:
+        windows.append({'kind':'sunset', 'start':set_ - self.marginSec,
+                        'end':dusk + self.marginSec, 'anchor':set_})
+      if len(self._windows) > 7:
+        self._windows.clear()
+      self._windows[date] = windows
+    return self._windows[date]
+
+  # Returns (mode, window) for epoch seconds timeNow.
+  # mode is 'day', 'night' or 'twilight' when inside a twilight window.
+  # mode is None when the sun does not rise or set so the scene must be probed.
+  def modeAt(self, timeNow):
+    utcDate = datetime.datetime.utcfromtimestamp(timeNow).date()
+    windows = []
+    for days in (-1, 0, 1):
+      windows.extend(self.windows(utcDate + datetime.timedelta(days=days)))
+    if len(windows) < 6:
+      return None, None
+    windows.sort(key=lambda window: window['start'])
+    lastWindow = None
+    for window in windows:
+      if window['start'] <= timeNow <= window['end']:
+        return 'twilight', window
+      if window['end'] < timeNow:
+        lastWindow = window
+    if lastWindow is None:
+      return None, None
+    if lastWindow['kind'] == 'sunrise':
+      return 'day', None
+    return 'night', None
+
+if __name__ == '__main__':
+  if len(sys.argv) < 3:
+    print "Usage: python ./sunclock.py latitude longitude"
+    sys.exit(1)
+  lat = float(sys.argv[1])
+  lon = float(sys.argv[2])
+  today = datetime.date.today()
+  names = ('Civil Dawn', 'Sunrise', 'Sunset', 'Civil Dusk')
+  for name, event in zip(names, sunTimes(today, lat, lon)):
+    if event is None:
+      print "%-12s - None" % name
+    else:
+      print "%-12s - %s" % (name, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event)))
+  mode, window = SunSchedule(lat, lon).modeAt(time.time())
+  print "Mode Now     - %s" % mode
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# telemetry.py - Compact on disk history of scene probes for rpi-timelapse.py
+#
+# One fixed size binary record (numpy dtype RECORD) is appended for every
+# frame the scene was probed: time, scene light level, mean luma, a 32 bin
+# luma histogram, probe exposure and gain, the day/night file sizes in
+# filesize meterMode, the mode chosen and the shutter used for the image.
+# There is no header so the file is read back with numpy.memmap and months of
+# history load instantly.  A record cut short by a power failure is ignored.
+#
+# tune.py replays the mode logic over this history to search for better
+# thresholds and twilight ramp settings without taking any new images.
+#
+# python ./telemetry.py rpi-timelapse.telemetry    summary of a telemetry file
+
+import os
+import sys
+import time
+import numpy
+
+HIST_BINS = 32
+MODES = ('night', 'twilight', 'day')
+RECORD = numpy.dtype([
+  ('time', '<f8'),        # time.time() of the frame
+  ('mode', 'u1'),         # index into MODES
+  ('level', '<f4'),       # scene light level (see lightmeter.sceneLevel)
+  ('mean', '<f4'),        # probe mean luma
+  ('exposure', '<u4'),    # probe exposure microseconds
+  ('gain', '<f4'),        # probe analog * digital gain
+  ('shutter', '<u4'),     # exposure microseconds of the stored image
+  ('daySize', '<u4'),     # filesize meterMode day image size
+  ('nightSize', '<u4'),   # filesize meterMode night image size
+  ('hist', '<u2', (HIST_BINS,)),  # luma histogram of the probe
+])
+
+# Reduce a 256 bin luma histogram to HIST_BINS bins that fit the record
+def compactHist(hist):
+  bins = numpy.asarray(hist, dtype=numpy.int64).reshape(HIST_BINS, -1).sum(axis=1)
+  return numpy.minimum(bins, 65535)
+
+class TelemetryStore(object):
+  # Appends records with one write() each. Not fsynced, a lost record only loses history
+  def __init__(self, filename):
+    self.filename = filename
+    self.fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    size = os.fstat(self.fd).st_size
+    if size % RECORD.itemsize:
+      os.ftruncate(self.fd, size - size % RECORD.itemsize)
+    self.record = numpy.zeros(1, dtype=RECORD)
+
+  def append(self, timeNow, mode, probe=None, shutter=0, daySize=0, nightSize=0):
+    record = self.record
+    record[0] = 0
+    record['time'] = timeNow
+    record['mode'] = MODES.index(mode) if mode in MODES else 0
+    if probe is not None:
+      record['level'] = probe['level']
+      record['mean'] = probe['mean']
+      record['exposure'] = probe['exposure']
+      record['gain'] = probe['gain']
+      record['hist'] = compactHist(probe['hist'])
+    record['shutter'] = shutter
+    record['daySize'] = daySize
+    record['nightSize'] = nightSize
+    os.write(self.fd, record.tobytes())
+
+  def close(self):
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
+
+# Memory map a telemetry file as a numpy record array. Empty array if no records
+def load(filename):
+  count = os.path.getsize(filename) // RECORD.itemsize
+  if count == 0:
+    return numpy.zeros(0, dtype=RECORD)
+  return numpy.memmap(filename, dtype=RECORD, mode='r', shape=(count,))
+
+if __name__ == '__main__':
+  if len(sys.argv) < 2:
+    print "Usage: python ./telemetry.py telemetryfile"
+    sys.exit(1)
+  history = load(sys.argv[1])
+  print "telemetry.py - %i records of %i bytes" % (len(history), RECORD.itemsize)
+  if len(history):
+    print "               %s to %s" % (time.strftime('%Y-%m-%d %H:%M', time.localtime(history['time'][0])),
+                                       time.strftime('%Y-%m-%d %H:%M', time.localtime(history['time'][-1])))
+    for index, mode in enumerate(MODES):
+      chosen = history['mode'] == index
+      if chosen.any():
+        print "               %-8s %6i probes  level %.1f to %.1f" % (mode, chosen.sum(),
+                history['level'][chosen].min(), history['level'][chosen].max())
@@ -0,0 +1,47 @@
+# Tests run against the modules in the folder above with the fake camera backend
+#
+# python -m pytest tests
+
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import timelapsecam
+
+# Capture a jpeg from the fake camera with a steady light level and fixed
+# exposure so the image brightness follows lux. 1000 lux is mean luma 100
+def fakeJpeg(lux=1000, size=(320, 180)):
+  camera = timelapsecam.FakeCamera(lightCurve=lambda timeNow: lux, sleep=lambda secs: None)
+  camera.resolution = size
+  camera.exposure_mode = 'off'
+  camera.shutter_speed = 10000
+  stream = io.BytesIO()
+  camera.capture(stream)
+  return stream.getvalue()
+
+@pytest.fixture
+def jpeg():
+  return fakeJpeg
+
+# Store count fake images in images/ and record them in a manifest. Returns the manifest path
+def makeFrames(folder, count, start=10000, size=1000):
+  import manifest
+  manifestPath = str(folder.join('rpi-timelapse.manifest'))
+  frameManifest = manifest.FrameManifest(manifestPath)
+  imageDir = folder.ensure('images', dir=True)
+  for seq in range(start, start + count):
+    filename = str(imageDir.join('front-%i.jpg' % seq))
+    with open(filename, 'wb') as f:
+      f.write('x' * size)
+    frameManifest.append({'seq':seq, 'time':1792300000 + seq, 'mode':'day', 'level':1.5,
+                          'bytes':size, 'path':frameManifest.relativePath(filename)})
+  frameManifest.close()
+  return manifestPath
+
+@pytest.fixture
+def frames():
+  return makeFrames
@@ -0,0 +1,44 @@
+import os
+import re
+import subprocess
+import sys
+import urllib2
+
+import pytest
+
+ALIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'align.py')
+
+# python ./align.py --fake --port 0. Yields the preview url
+@pytest.fixture
+def preview():
+  process = subprocess.Popen([sys.executable, '-u', ALIGN_PATH, '--fake', '--port', '0', '--seconds', '30'],
+                             stdout=subprocess.PIPE)
+  try:
+    match = re.search(r'http://\S+?:(\d+)/', process.stdout.readline())
+    assert match is not None
+    yield 'http://127.0.0.1:%s' % match.group(1)
+  finally:
+    process.terminate()
+    process.wait()
+
+def test_snapshot(preview):
+  response = urllib2.urlopen(preview + '/snapshot.jpg', timeout=10)
+  assert response.info()['Content-Type'] == 'image/jpeg'
+  assert response.read()[:2] == '\xff\xd8'
+
+def test_stream_frame_and_sharpness(preview):
+  response = urllib2.urlopen(preview + '/stream.mjpg', timeout=10)
+  assert response.info()['Content-Type'] == 'multipart/x-mixed-replace; boundary=FRAME'
+  assert response.readline() == '--FRAME\r\n'
+  headers = {}
+  line = response.readline()
+  while line != '\r\n':
+    name, value = line.split(':', 1)
+    headers[name] = value.strip()
+    line = response.readline()
+  assert headers['Content-Type'] == 'image/jpeg'
+  frame = response.read(int(headers['Content-Length']))
+  assert frame[:2] == '\xff\xd8' and frame[-2:] == '\xff\xd9'
+  assert response.read(2) == '\r\n'
+  response.close()
+  assert float(urllib2.urlopen(preview + '/sharpness', timeout=10).read()) > 0
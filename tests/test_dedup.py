@@ -0,0 +1,65 @@
+import os
+
+import dedup
+
+def frame(tmpdir, seq, data, mode='night'):
+  return {'seq':seq, 'filename':str(tmpdir.join('front-%i.jpg' % seq)), 'data':data, 'mode':mode}
+
+def store(deduplicator, frame, ref=0):
+  with open(frame['filename'], 'wb') as f:
+    f.write(frame['data'])
+  deduplicator.stored(frame, ref)
+
+def test_unchanged_frame_refers_to_kept_frame(tmpdir, jpeg):
+  data = jpeg()
+  deduplicator = dedup.FrameDeduplicator()
+  kept = deduplicator.process(frame(tmpdir, 1, data))
+  assert not kept.get('ref')
+  # Kept frame is still in the pipeline so it can be referred to
+  repeat = deduplicator.process(frame(tmpdir, 2, data))
+  assert repeat['ref'] == 1
+  assert repeat['refFilename'] == kept['filename']
+
+def test_changed_frame_is_kept(tmpdir, jpeg):
+  deduplicator = dedup.FrameDeduplicator()
+  deduplicator.process(frame(tmpdir, 1, jpeg(lux=1000)))
+  assert not deduplicator.process(frame(tmpdir, 2, jpeg(lux=2000))).get('ref')
+
+def test_mode_change_and_max_run_keep_frame(tmpdir, jpeg):
+  data = jpeg()
+  deduplicator = dedup.FrameDeduplicator(maxRun=1)
+  deduplicator.process(frame(tmpdir, 1, data))
+  assert deduplicator.process(frame(tmpdir, 2, data)).get('ref') == 1
+  assert not deduplicator.process(frame(tmpdir, 3, data)).get('ref')
+  assert not deduplicator.process(frame(tmpdir, 4, data, mode='day')).get('ref')
+
+def test_deleted_kept_frame_is_not_referred_to(tmpdir, jpeg):
+  data = jpeg()
+  deduplicator = dedup.FrameDeduplicator()
+  kept = deduplicator.process(frame(tmpdir, 1, data))
+  store(deduplicator, kept)
+  assert deduplicator.process(frame(tmpdir, 2, data))['ref'] == 1
+  os.remove(kept['filename'])   # eg offloaded
+  replacement = deduplicator.process(frame(tmpdir, 3, data))
+  assert not replacement.get('ref')
+  store(deduplicator, replacement)
+  assert deduplicator.process(frame(tmpdir, 4, data))['ref'] == 3
+
+def test_frame_stored_in_place_of_missing_image_is_referred_to(tmpdir, jpeg):
+  data = jpeg()
+  deduplicator = dedup.FrameDeduplicator()
+  deduplicator.process(frame(tmpdir, 1, data))   # never stored eg storage full
+  repeat = deduplicator.process(frame(tmpdir, 2, data))
+  assert repeat['ref'] == 1
+  # Store stage finds the image missing and stores this frame instead
+  repeat['ref'] = 0
+  store(deduplicator, repeat, ref=1)
+  assert deduplicator.process(frame(tmpdir, 3, data))['refFilename'] == repeat['filename']
+
+def test_late_store_of_older_frame_does_not_move_reference(tmpdir, jpeg):
+  data = jpeg()
+  deduplicator = dedup.FrameDeduplicator()
+  old = deduplicator.process(frame(tmpdir, 1, data))
+  new = deduplicator.process(frame(tmpdir, 2, jpeg(lux=2000)))
+  store(deduplicator, old)
+  assert deduplicator.reference() == (2, new['filename'])
@@ -0,0 +1,53 @@
+import os
+import threading
+
+import manifest
+
+def test_records_round_trip(tmpdir, frames):
+  frameManifest = manifest.FrameManifest(frames(tmpdir, 5), readOnly=True)
+  assert frameManifest.count() == 5
+  assert frameManifest.last()['seq'] == 10004
+  assert frameManifest.find(10002)['path'] == os.path.join('images', 'front-10002.jpg')
+  assert frameManifest.record(0)['level'] == 1.5
+  assert [record['seq'] for record in frameManifest.records(3)] == [10003, 10004]
+
+def test_partial_record_is_removed_on_open(tmpdir, frames):
+  manifestPath = frames(tmpdir, 3)
+  with open(manifestPath, 'ab') as f:
+    f.write('10003,1792310003,day')   # power failure part way through a write
+  frameManifest = manifest.FrameManifest(manifestPath)
+  assert frameManifest.count() == 3
+  assert os.path.getsize(manifestPath) == 3 * manifest.RECORD_SIZE
+  frameManifest.append({'seq':10003, 'path':'images/front-10003.jpg'})
+  assert frameManifest.last()['seq'] == 10003
+
+def test_record_without_newline_is_removed_on_open(tmpdir, frames):
+  manifestPath = frames(tmpdir, 2)
+  with open(manifestPath, 'ab') as f:
+    f.write('x' * manifest.RECORD_SIZE)
+  assert manifest.FrameManifest(manifestPath).count() == 2
+
+def test_read_only_open_does_not_truncate(tmpdir, frames):
+  manifestPath = frames(tmpdir, 2)
+  with open(manifestPath, 'ab') as f:
+    f.write('10002,')   # rpi-timelapse.py is appending this record
+  frameManifest = manifest.FrameManifest(manifestPath, readOnly=True)
+  assert frameManifest.count() == 2
+  assert os.path.getsize(manifestPath) == 2 * manifest.RECORD_SIZE + 6
+
+def test_path_too_long_does_not_fit():
+  assert manifest.recordFits({'seq':1, 'path':'images/front-1.jpg'})
+  assert not manifest.recordFits({'seq':1, 'path':'x' * manifest.RECORD_SIZE})
+
+def test_reads_while_another_thread_appends(tmpdir, frames):
+  frameManifest = manifest.FrameManifest(frames(tmpdir, 1))
+  def appendFrames():
+    for seq in range(10001, 10401):
+      frameManifest.append({'seq':seq, 'path':'images/front-%i.jpg' % seq})
+  appender = threading.Thread(target=appendFrames)
+  appender.start()
+  while appender.is_alive():
+    assert frameManifest.record(0)['seq'] == 10000
+    assert [record['seq'] for record in frameManifest.records()][:1] == [10000]
+  appender.join()
+  assert [record['seq'] for record in frameManifest.records()] == range(10000, 10401)
@@ -0,0 +1,52 @@
+import os
+
+import manifest
+import offload
+
+def test_cursor_moves_past_copied_images(tmpdir, frames):
+  manifestPath = frames(tmpdir, 5)
+  destination = str(tmpdir.join('xbmc'))
+  offloader = offload.Offloader(manifestPath, destination)
+  assert offloader.runOnce() == 5
+  assert offload.readCursor(manifestPath) == 5
+  assert os.path.exists(os.path.join(destination, 'images', 'front-10004.jpg'))
+  assert not os.path.exists(str(tmpdir.join('images', 'front-10004.jpg')))
+  assert offloader.runOnce() == 0
+
+def test_only_new_images_are_copied(tmpdir, frames):
+  manifestPath = frames(tmpdir, 3)
+  offloader = offload.Offloader(manifestPath, str(tmpdir.join('xbmc')), delete=False)
+  offloader.runOnce()
+  frameManifest = manifest.FrameManifest(manifestPath)
+  filename = str(tmpdir.join('images', 'front-10003.jpg'))
+  with open(filename, 'wb') as f:
+    f.write('y' * 10)
+  frameManifest.append({'seq':10003, 'bytes':10, 'path':frameManifest.relativePath(filename)})
+  frameManifest.close()
+  assert offloader.runOnce() == 1
+  assert offload.readCursor(manifestPath) == 4
+
+def test_failed_copy_stops_the_cursor(tmpdir, frames, monkeypatch):
+  manifestPath = frames(tmpdir, 6)
+  offloader = offload.Offloader(manifestPath, str(tmpdir.join('xbmc')), batchSize=2)
+  copyFrame = offloader.copyFrame
+  def failing(frameManifest, record):
+    if record['seq'] == 10003:
+      return None
+    return copyFrame(frameManifest, record)
+  monkeypatch.setattr(offloader, 'copyFrame', failing)
+  offloader.runOnce()
+  assert offload.readCursor(manifestPath) == 3   # 10003 is in the second batch
+  monkeypatch.setattr(offloader, 'copyFrame', copyFrame)
+  offloader.runOnce()
+  assert offload.readCursor(manifestPath) == 6
+
+def test_dedup_records_are_skipped(tmpdir, frames):
+  manifestPath = frames(tmpdir, 1)
+  frameManifest = manifest.FrameManifest(manifestPath)
+  frameManifest.append({'seq':10001, 'bytes':0, 'path':'images/front-10000.jpg', 'ref':10000})
+  frameManifest.close()
+  offloader = offload.Offloader(manifestPath, str(tmpdir.join('xbmc')), delete=False)
+  assert offloader.runOnce() == 1
+  assert offloader.skipped == 1
+  assert offload.readCursor(manifestPath) == 2
@@ -0,0 +1,60 @@
+import pytest
+
+import scenestate
+import stats
+
+NIGHT_EDGE = 0.0
+DAY_EDGE = 1.0   # Hysteresis margin is 0.1
+
+def sceneState():
+  return scenestate.SceneState(NIGHT_EDGE, DAY_EDGE, hysteresis=0.1, dwellSec=300, maxProbeSec=1800, probeSafety=0.5)
+
+# Probes as (seconds, value). The first sets the mode without hysteresis
+DWELL = [
+  # probes, mode after the last probe
+  ([(0, 2.0), (60, 0.95), (120, 1.05), (180, 0.85)], 'day'),         # Below the day threshold inside dwellSec
+  ([(0, 2.0), (60, -0.5)], 'day'),                                   # Even a jump to night waits for dwellSec
+  ([(0, 0.5), (60, 1.0), (120, 1.09), (400, 1.0)], 'twilight'),      # On the day threshold but not past the margin
+  ([(0, -1.0), (60, 0.0), (120, 0.1), (400, 0.05)], 'night'),        # Sitting on the night threshold
+  ([(0, 2.0), (60, 0.85), (300, 0.85)], 'twilight'),                 # Changes once dwellSec has passed
+  ([(0, 0.5), (400, 1.1)], 'day'),
+]
+
+@pytest.mark.parametrize('probes,mode', DWELL)
+def test_mode_holds_at_a_threshold(probes, mode):
+  state = sceneState()
+  first = state.update(probes[0][1], probes[0][0])
+  for timeNow, value in probes[1:]:
+    assert state.update(value, timeNow) in (first, mode)
+  assert state.state == mode
+
+def test_dwell_holds_are_counted():
+  stats.reset()
+  state = sceneState()
+  state.update(2.0, 0)
+  state.update(0.5, 60)
+  state.update(0.5, 120)
+  assert state.state == 'day'
+  assert stats.registry.snapshot()['counters']['mode_dwell_holds'] == 2
+
+# Seconds to the next probe after the last of the probes
+PROBE_WAIT = [
+  # probes, seconds to the next probe
+  ([(0, 10.0)], 0),                                # No trend yet
+  ([(0, 10.0), (60, 9.9), (120, 9.8)], 1800),      # Threshold hours away. Capped by maxProbeSec
+  ([(0, 10.0), (60, 10.1), (120, 10.2)], 900),     # Moving away from the threshold
+  ([(0, 2.0), (60, 1.8), (120, 1.6)], 105),        # 0.7 above the day threshold falling 0.2 a minute
+  ([(0, -2.0), (60, -1.9), (120, -1.8)], 570),     # 1.9 below the night threshold rising 0.1 a minute
+  ([(0, 0.4), (60, 0.5), (120, 0.6)], 0),          # Twilight is probed every frame
+  ([(0, 1.0), (60, 0.95), (120, 0.9)], 0),         # Day already at the threshold
+]
+
+@pytest.mark.parametrize('probes,wait', PROBE_WAIT)
+def test_next_probe_follows_the_trend(probes, wait):
+  state = sceneState()
+  for timeNow, value in probes:
+    state.update(value, timeNow)
+  timeNow = probes[-1][0]
+  assert state.nextProbe - timeNow == pytest.approx(wait)
+  assert not state.probeDue(timeNow + wait - 1) or wait == 0
+  assert state.probeDue(timeNow + wait + 1)
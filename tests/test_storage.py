@@ -0,0 +1,61 @@
+import datetime
+import os
+
+import pytest
+
+import manifest
+import offload
+import storage
+
+MB = storage.MB
+
+# Pretend the images are on a file system of capacity MB. Each image is 1 MB
+@pytest.fixture
+def store(tmpdir, frames, monkeypatch):
+  def makeStore(count, capacity, offloaded=0, **options):
+    manifestPath = frames(tmpdir, count, size=MB)
+    def freeBytes(path):
+      used = sum([os.path.getsize(os.path.join(folder, name))
+                  for folder, dirs, files in os.walk(str(tmpdir.join('images'))) for name in files])
+      return capacity * MB - used
+    monkeypatch.setattr(storage, 'freeBytes', freeBytes)
+    with open(offload.cursorPath(manifestPath), 'w') as f:
+      f.write("%i\n" % offloaded)
+    frameManifest = manifest.FrameManifest(manifestPath)
+    return storage.FrameStore(str(tmpdir.join('images')), frameManifest, **options)
+  return makeStore
+
+def images(tmpdir):
+  return sorted(os.listdir(str(tmpdir.join('images'))))
+
+def test_shard_folders():
+  rightNow = datetime.datetime(2026, 10, 18, 17, 5)
+  assert storage.shardDir(rightNow, 'hour') == '20261018/17'
+  assert storage.shardDir(rightNow, 'day') == '20261018'
+  assert storage.shardDir(rightNow, None) == ''
+
+def test_write_above_low_watermark_deletes_nothing(tmpdir, store):
+  frameStore = store(5, capacity=20, offloaded=5, lowFreeMB=5, highFreeMB=10, stopFreeMB=1)
+  assert frameStore.write(str(tmpdir.join('images', 'new.jpg')), 'x' * MB)
+  assert frameStore.deleted == 0
+
+def test_low_watermark_deletes_oldest_until_high(tmpdir, store):
+  frameStore = store(8, capacity=12, offloaded=8, lowFreeMB=4, highFreeMB=7, stopFreeMB=1)
+  assert frameStore.write(str(tmpdir.join('images', 'new.jpg')), 'x' * MB)
+  # 4 MB free was below 4 + 1 MB so the 3 oldest images were deleted for 7 MB free
+  assert frameStore.deleted == 3
+  assert images(tmpdir)[0] == 'front-10003.jpg'
+  assert frameStore.cursor() == 3
+
+def test_only_offloaded_images_are_deleted(tmpdir, store):
+  frameStore = store(8, capacity=12, offloaded=1, lowFreeMB=4, highFreeMB=7, stopFreeMB=1)
+  frameStore.write(str(tmpdir.join('images', 'new.jpg')), 'x' * MB)
+  assert frameStore.deleted == 1
+  assert images(tmpdir)[0] == 'front-10001.jpg'
+
+def test_stop_watermark_skips_image(tmpdir, store):
+  frameStore = store(8, capacity=10, offloaded=0, lowFreeMB=4, highFreeMB=7, stopFreeMB=2)
+  filename = str(tmpdir.join('images', 'new.jpg'))
+  assert not frameStore.write(filename, 'x' * MB)
+  assert not os.path.exists(filename)
+  assert frameStore.skipped == 1
@@ -0,0 +1,40 @@
+import calendar
+import datetime
+
+import pytest
+
+import sunclock
+
+# Published sunrise and sunset times (UTC) for a date and location
+PUBLISHED = [
+  # latitude, longitude, date, sunrise, sunset
+  (51.5074, -0.1278, datetime.date(2024, 6, 21), (2024, 6, 21, 3, 43), (2024, 6, 21, 20, 21)),       # London
+  (40.7128, -74.0060, datetime.date(2024, 12, 21), (2024, 12, 21, 12, 16), (2024, 12, 21, 21, 32)),  # New York
+  (-33.8688, 151.2093, datetime.date(2024, 6, 21), (2024, 6, 20, 21, 0), (2024, 6, 21, 6, 54)),      # Sydney
+  (45.42, -75.69, datetime.date(2026, 3, 20), (2026, 3, 20, 11, 5), (2026, 3, 20, 23, 17)),          # Ottawa
+]
+
+# Locations and dates where the sun does not rise or does not set
+POLAR = [
+  (69.6492, 18.9553, datetime.date(2024, 6, 21)),    # Tromso midnight sun
+  (69.6492, 18.9553, datetime.date(2024, 12, 21)),   # Tromso polar night. Civil twilight only
+  (-77.8463, 166.6683, datetime.date(2024, 12, 21)), # McMurdo midnight sun
+  (78.2232, 15.6267, datetime.date(2024, 12, 21)),   # Longyearbyen polar night
+]
+
+def utc(when):
+  return calendar.timegm(when + (0,))
+
+@pytest.mark.parametrize('latitude,longitude,date,sunrise,sunset', PUBLISHED)
+def test_sunrise_and_sunset_match_published_times(latitude, longitude, date, sunrise, sunset):
+  dawn, rise, set_, dusk = sunclock.sunTimes(date, latitude, longitude)
+  assert abs(rise - utc(sunrise)) < 3 * 60
+  assert abs(set_ - utc(sunset)) < 3 * 60
+  assert dawn < rise and dusk > set_
+
+@pytest.mark.parametrize('latitude,longitude,date', POLAR)
+def test_polar_day_and_night_have_no_window(latitude, longitude, date):
+  assert sunclock.sunEvent(date, latitude, longitude) is None
+  schedule = sunclock.SunSchedule(latitude, longitude)
+  assert schedule.windows(date) == []
+  assert schedule.modeAt(utc((date.year, date.month, date.day, 12, 0))) == (None, None)
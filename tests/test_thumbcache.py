@@ -0,0 +1,36 @@
+import os
+
+import manifest
+import thumbcache
+
+# Store a fake camera image and record it like rpi-timelapse.py storeImage()
+def storeFrame(tmpdir, frameManifest, seq, data):
+  filename = str(tmpdir.ensure('images', dir=True).join('front-%i.jpg' % seq))
+  with open(filename, 'wb') as f:
+    f.write(data)
+  frame = {'seq':seq, 'time':1792300000 + seq, 'filename':filename, 'data':data,
+           'path':frameManifest.relativePath(filename), 'bytes':len(data)}
+  frame['index'] = frameManifest.append(frame)
+  return frame
+
+def test_pipeline_frames_move_the_cursor(tmpdir, jpeg):
+  manifestPath = str(tmpdir.join('rpi-timelapse.manifest'))
+  frameManifest = manifest.FrameManifest(manifestPath)
+  cache = thumbcache.ThumbCache(str(tmpdir.join('thumbs')), manifestPath, (160, 80))
+  for seq in (10000, 10001):
+    cache.addFrame(storeFrame(tmpdir, frameManifest, seq, jpeg()))
+  assert cache.state['cursor'] == 2
+  assert cache.findThumb(10001, 80) is not None
+  assert cache.update() == 0
+
+def test_image_removed_before_thumbnails(tmpdir, jpeg):
+  manifestPath = str(tmpdir.join('rpi-timelapse.manifest'))
+  frameManifest = manifest.FrameManifest(manifestPath)
+  cache = thumbcache.ThumbCache(str(tmpdir.join('thumbs')), manifestPath, (160, 80))
+  frame = storeFrame(tmpdir, frameManifest, 10000, jpeg())
+  os.remove(frame['filename'])   # Deleted by retention or offload
+  assert cache.addFrame(frame) is frame
+  assert cache.findThumb(10000, 80) is None
+  assert cache.state['cursor'] == 0
+  cache.addFrame(storeFrame(tmpdir, frameManifest, 10001, jpeg()))
+  assert cache.state['cursor'] == 2
@@ -0,0 +1,51 @@
+import simulate
+import stats
+import timelapsecam
+
+# Camera session on the fake backend with the simulator virtual clock
+def fakeSession(lux=1000, **options):
+  clock = simulate.VirtualClock(1792300000)
+  lightCurve = lux if callable(lux) else lambda timeNow: lux
+  camera = timelapsecam.FakeCamera(lightCurve=lightCurve, clock=clock.time, sleep=clock.sleep)
+  session = timelapsecam.CameraSession(camera, 320, 180, sleep=clock.sleep, clock=clock.time, **options)
+  return session, clock
+
+def test_session_switches_modes_on_one_camera():
+  session, clock = fakeSession()
+  camera = session.camera
+  session.setDayMode(0)
+  assert (session.mode, camera.exposure_mode, camera.framerate) == ('day', 'auto', 30)
+  session.setNightMode(6000000, 800)
+  assert (session.mode, camera.exposure_mode, camera.shutter_speed, camera.iso) == ('night', 'off', 6000000, 800)
+  session.setDayMode(0)
+  assert session.camera is camera and not camera.closed
+  assert camera.resolution == (320, 180)
+  # The same settings again are left alone without settling
+  started = clock.time()
+  session.setDayMode(0)
+  session.setDayMode(0)
+  assert clock.time() == started
+  session.close()
+  assert camera.closed
+
+def test_settle_returns_once_the_camera_converges():
+  stats.reset()
+  session, clock = fakeSession(daySettleSec=2)
+  session.setDayMode(0)
+  assert 0 < session.lastSettle < session.daySettleSec
+  timer = stats.registry.snapshot()['timers']['camera_settle']
+  assert timer['count'] == 1 and timer['sum'] == session.lastSettle
+  assert 'camera_settle_timeouts' not in stats.registry.snapshot()['counters']
+
+def test_settle_stops_at_the_timeout_without_converging():
+  stats.reset()
+  dusk = lambda timeNow: 1000 * 0.5 ** (timeNow - 1792300000)   # Halves every second
+  session, clock = fakeSession(dusk, daySettleSec=2, nightSettleSec=10)
+  session.setDayMode(0)
+  assert session.lastSettle == session.daySettleSec
+  session.setNightMode(6000000, 800)
+  assert session.lastSettle == session.nightSettleSec
+  snapshot = stats.registry.snapshot()
+  assert snapshot['timers']['camera_settle']['count'] == 2
+  assert snapshot['counters']['camera_settle_timeouts'] == 2
+  assert session.settleTotal == session.daySettleSec + session.nightSettleSec
@@ -0,0 +1,335 @@
+#!/usr/bin/python
+# thumbcache.py - Incremental thumbnail and contact sheet cache for rpi-timelapse.py images
+#
+# Each image gets thumbnails in several widths (a pyramid eg 640, 320, 160).
+# The jpeg is decoded once at reduced size using the jpeg draft mode (1/2,
+# 1/4 or 1/8 scale in the decoder) and each smaller width is scaled from the
+# one before, so a full size decode and resize is never done.
+#
+# Thumbnails are named by image sequence number and image file mtime
+#   thumbs/<width>/<seq/1000>/<seq>-<mtime>.jpg
+# so a replaced image (new mtime) gets new thumbnails and the stale ones are
+# removed.  New images are found from the frame manifest starting where the
+# last run stopped so existing thumbnails are not checked again.
+#
+# Every hour gets a contact sheet of up to sheetMax of its smallest thumbnails
+#   thumbs/sheets/<yyyymmdd>/<yyyymmdd-hh>.jpg
+#
+# When the cache is bigger than its size budget the largest thumbnails of
+# the oldest images are deleted first, so the small thumbnails and contact
+# sheets of the whole archive are kept as long as possible.
+#
+# rpi-timelapse.py can add thumbnails as each image is stored (thumbCacheDir).
+# Otherwise run from cron or by hand
+#
+# python ./thumbcache.py                  add thumbnails for new images
+# python ./thumbcache.py check            check every image mtime and the cache size
+# python ./thumbcache.py sheet 20261018-17    print (and build) the contact sheet for an hour
+# python ./thumbcache.py thumb 10050 320      print the thumbnail for an image
+
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+import manifest
+
+cacheDir = "./thumbs"              # Cache folder
+manifestPath = "./rpi-timelapse.manifest"
+altImageDirs = []                  # Other folders to look for images that were moved eg ['./xbmc']
+thumbSizes = (640, 320, 160)       # Thumbnail widths largest first
+cacheMB = 500                      # Size budget in MB. 0=No limit
+sheetColumns = 10                  # Thumbnails across a contact sheet
+sheetMax = 60                      # Max thumbnails per hour contact sheet. Spread evenly over the hour
+thumbWorkers = multiprocessing.cpu_count()
+QUALITY = 75
+
+# Decode a jpeg (file name or file object) once at reduced size and save a
+# thumbnail for each width in sizes (largest first) to paths.
+# Written to temp files then renamed. Returns bytes written
+def writeThumbs(source, sizes, paths, quality=QUALITY):
+  img = Image.open(source)
+  width, height = img.size
+  img.draft('RGB', (sizes[0], max(height * sizes[0] // width, 1)))
+  if img.mode != 'RGB':
+    img = img.convert('RGB')
+  written = 0
+  for size, path in zip(sizes, paths):
+    img.thumbnail((size, max(height * size // width, 1)), Image.BILINEAR)
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+      try:
+        os.makedirs(folder)
+      except OSError:
+        pass   # Made by another worker
+    img.save(path + '.tmp', 'JPEG', quality=quality)
+    os.rename(path + '.tmp', path)
+    written += os.path.getsize(path)
+  return written
+
+# Remove older thumbnails of the same image as each path. Returns bytes removed
+def removeStale(paths):
+  removed = 0
+  for path in paths:
+    folder = os.path.dirname(path)
+    prefix = os.path.basename(path).split('-')[0] + '-'
+    if not os.path.isdir(folder):
+      continue
+    for name in os.listdir(folder):
+      fullName = os.path.join(folder, name)
+      if name.startswith(prefix) and fullName != path:
+        removed += os.path.getsize(fullName)
+        os.remove(fullName)
+  return removed
+
+# Runs in a worker process
+def _thumbWorker(job):
+  source, sizes, paths = job
+  try:
+    written = writeThumbs(source, sizes, paths)
+    return written - removeStale(paths)
+  except (IOError, OSError) as err:
+    print "thumbcache - ERROR %s %s" % (source, err)
+    return 0
+
+def hourKey(timeNow):
+  return time.strftime('%Y%m%d-%H', time.localtime(timeNow))
+
+class ThumbCache(object):
+  def __init__(self, cacheDir, manifestPath, sizes=thumbSizes, maxBytes=cacheMB * 1024 * 1024,
+               altImageDirs=(), workers=1, verbose=False):
+    self.cacheDir = cacheDir
+    self.manifestPath = manifestPath
+    self.sizes = tuple(sorted(sizes, reverse=True))
+    self.maxBytes = maxBytes
+    self.altImageDirs = altImageDirs
+    self.workers = workers
+    self.verbose = verbose
+    self.statePath = os.path.join(cacheDir, 'state.json')
+    self.lastHour = None
+    if not os.path.isdir(cacheDir):
+      os.makedirs(cacheDir)
+    self.state = self.readState()
+
+  # cursor is the manifest position of the next image. bytes is the cache size
+  def readState(self):
+    try:
+      with open(self.statePath, 'r') as f:
+        return json.load(f)
+    except (IOError, ValueError):
+      return {'cursor':0, 'bytes':self.scanBytes()}
+
+  def saveState(self):
+    with open(self.statePath + '.tmp', 'w') as f:
+      json.dump(self.state, f)
+    os.rename(self.statePath + '.tmp', self.statePath)
+
+  def scanBytes(self):
+    total = 0
+    for folder, dirs, names in os.walk(self.cacheDir):
+      for name in names:
+        if name.endswith('.jpg'):
+          total += os.path.getsize(os.path.join(folder, name))
+    return total
+
+  def thumbPath(self, seq, width, mtime):
+    return os.path.join(self.cacheDir, str(width), str(seq // 1000), "%i-%i.jpg" % (seq, mtime))
+
+  def thumbPaths(self, seq, mtime):
+    return [self.thumbPath(seq, width, mtime) for width in self.sizes]
+
+  def sheetPath(self, hour):
+    return os.path.join(self.cacheDir, 'sheets', hour[:8], hour + '.jpg')
+
+  # Newest cached thumbnail for an image or None
+  def findThumb(self, seq, width):
+    folder = os.path.dirname(self.thumbPath(seq, width, 0))
+    if not os.path.isdir(folder):
+      return None
+    names = [name for name in os.listdir(folder) if name.startswith("%i-" % seq) and name.endswith('.jpg')]
+    if not names:
+      return None
+    return os.path.join(folder, max(names, key=lambda name: int(name[:-4].split('-')[1])))
+
+  # Image file for a manifest record in the images folder or altImageDirs
+  def findImage(self, frameManifest, record):
+    filename = frameManifest.imagePath(record)
+    if os.path.exists(filename):
+      return filename
+    for altDir in self.altImageDirs:
+      for altName in (os.path.join(altDir, record['path']), os.path.join(altDir, os.path.basename(filename))):
+        if os.path.exists(altName):
+          return altName
+    return None
+
+  # Pipeline stage for rpi-timelapse.py. Makes thumbnails from the in memory
+  # image just stored and builds the contact sheet when an hour is finished.
+  # The cursor moves past the frame's manifest record so update() skips it
+  def addFrame(self, frame):
+    if not frame.get('ref'):
+      try:
+        mtime = int(os.path.getmtime(frame['filename']))
+      except OSError as err:
+        # Removed by retention or offload before its thumbnails were made
+        print "thumbcache - ERROR %s %s" % (frame['filename'], err)
+        return frame
+      paths = self.thumbPaths(frame['seq'], mtime)
+      self.state['bytes'] += writeThumbs(io.BytesIO(frame['data']), self.sizes, paths) - removeStale(paths)
+    if 'index' in frame:
+      self.state['cursor'] = max(self.state['cursor'], frame['index'] + 1)
+    hour = hourKey(frame['time'])
+    if self.lastHour is not None and hour != self.lastHour:
+      self.buildSheet(self.lastHour)
+      self.evict()
+      self.saveState()
+    self.lastHour = hour
+    return frame
+
+  # Add thumbnails for images added to the manifest since the last run.
+  # checkAll=True checks every image mtime and recounts the cache size
+  def update(self, checkAll=False):
+    if not os.path.exists(self.manifestPath):
+      return 0
+    if checkAll:
+      self.state['cursor'] = 0
+      self.state['bytes'] = self.scanBytes()
+    frameManifest = manifest.FrameManifest(self.manifestPath, readOnly=True)
+    count = frameManifest.count()
+    jobs = []
+    hours = set()
+    for record in frameManifest.records(self.state['cursor']):
+      if record.get('ref'):
+        hours.add(hourKey(record['time']))
+        continue   # Repeats an earlier image. See dedup.py
+      source = self.findImage(frameManifest, record)
+      if source is None:
+        continue
+      paths = self.thumbPaths(record['seq'], int(os.path.getmtime(source)))
+      if all([os.path.exists(path) for path in paths]):
+        continue
+      jobs.append((source, self.sizes, paths))
+      hours.add(hourKey(record['time']))
+    frameManifest.close()
+    if jobs:
+      if self.workers > 1:
+        pool = multiprocessing.Pool(self.workers)
+        results = pool.imap_unordered(_thumbWorker, jobs, 8)
+      else:
+        pool = None
+        results = (_thumbWorker(job) for job in jobs)
+      for done, written in enumerate(results, 1):
+        self.state['bytes'] += written
+        if self.verbose and done % 500 == 0:
+          print "thumbcache - %i of %i images" % (done, len(jobs))
+      if pool is not None:
+        pool.close()
+        pool.join()
+    for hour in sorted(hours):
+      self.buildSheet(hour)
+    self.state['cursor'] = count
+    self.evict()
+    self.saveState()
+    if self.verbose:
+      print "thumbcache - %i new thumbnail sets  %i hour sheets  cache %.1f MB" % (
+              len(jobs), len(hours), self.state['bytes'] / 1048576.0)
+    return len(jobs)
+
+  # Contact sheet of up to sheetMax of an hour's smallest thumbnails
+  def buildSheet(self, hour):
+    start = time.mktime(time.strptime(hour, '%Y%m%d-%H'))
+    frameManifest = manifest.FrameManifest(self.manifestPath, readOnly=True)
+    index = frameManifest.bisect('time', start)
+    records = []
+    for record in frameManifest.records(index):
+      if record['time'] >= start + 3600:
+        break
+      records.append(record)
+    frameManifest.close()
+    if len(records) > sheetMax:
+      step = len(records) / float(sheetMax)
+      records = [records[int(i * step)] for i in range(sheetMax)]
+    width = self.sizes[-1]
+    tiles = []
+    for record in records:
+      # Frames recorded by dedup.py show the thumbnail of the image they repeat
+      thumb = self.findThumb(record.get('ref') or record['seq'], width)
+      if thumb is not None:
+        tiles.append((record, thumb))
+    if not tiles:
+      return None
+    tileHeight = Image.open(tiles[0][1]).size[1]
+    rows = (len(tiles) + sheetColumns - 1) // sheetColumns
+    sheet = Image.new('RGB', (sheetColumns * width, rows * tileHeight), (0, 0, 0))
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default()
+    for i, (record, thumb) in enumerate(tiles):
+      x = (i % sheetColumns) * width
+      y = (i // sheetColumns) * tileHeight
+      sheet.paste(Image.open(thumb), (x, y))
+      draw.text((x + 2, y + 2), time.strftime('%H:%M:%S', time.localtime(record['time'])),
+                (255, 255, 0), font=font)
+    path = self.sheetPath(hour)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    oldBytes = os.path.getsize(path) if os.path.exists(path) else 0
+    sheet.save(path + '.tmp', 'JPEG', quality=QUALITY)
+    os.rename(path + '.tmp', path)
+    self.state['bytes'] += os.path.getsize(path) - oldBytes
+    return path
+
+  # Delete the largest thumbnails of the oldest images until the cache is
+  # back under 90% of its budget, then smaller sizes, then contact sheets
+  def evict(self):
+    if self.maxBytes <= 0 or self.state['bytes'] <= self.maxBytes:
+      return 0
+    target = self.maxBytes * 0.9
+    removed = 0
+    def seqKey(name):
+      part = name.split('-')[0].split('.')[0]
+      return (int(part) if part.isdigit() else 0, name)
+    for tier in [str(width) for width in self.sizes] + ['sheets']:
+      tierDir = os.path.join(self.cacheDir, tier)
+      if not os.path.isdir(tierDir):
+        continue
+      for shard in sorted(os.listdir(tierDir), key=seqKey):
+        shardDir = os.path.join(tierDir, shard)
+        for name in sorted(os.listdir(shardDir), key=seqKey):
+          fullName = os.path.join(shardDir, name)
+          size = os.path.getsize(fullName)
+          os.remove(fullName)
+          self.state['bytes'] -= size
+          removed += 1
+          if self.state['bytes'] <= target:
+            break
+        if not os.listdir(shardDir):
+          os.rmdir(shardDir)
+        if self.state['bytes'] <= target:
+          break
+      if self.state['bytes'] <= target:
+        break
+    if self.verbose:
+      print "thumbcache - Evicted %i files. Cache %.1f MB" % (removed, self.state['bytes'] / 1048576.0)
+    return removed
+
+if __name__ == '__main__':
+  cache = ThumbCache(cacheDir, manifestPath, thumbSizes, cacheMB * 1024 * 1024,
+                     altImageDirs, thumbWorkers, verbose=True)
+  command = sys.argv[1] if len(sys.argv) > 1 else 'update'
+  if command == 'update':
+    cache.update()
+  elif command == 'check':
+    cache.update(checkAll=True)
+  elif command == 'sheet':
+    path = cache.buildSheet(sys.argv[2])
+    print path or "No thumbnails for %s" % sys.argv[2]
+    cache.saveState()
+  elif command == 'thumb':
+    print cache.findThumb(int(sys.argv[2]), int(sys.argv[3])) or "Not Found"
+  else:
+    print "Usage: python ./thumbcache.py [update|check|sheet yyyymmdd-hh|thumb seq width]"
+    sys.exit(1)
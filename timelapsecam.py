@@ -0,0 +1,455 @@
+#!/usr/bin/python
+# timelapsecam.py - Camera backends and persistent camera session for rpi-timelapse.py
+#
+# The camera is opened once and kept open for the life of the program.
+# Day, Night and Twilight settings are switched in place on the open camera
+# so each frame does not pay for sensor initialization.
+#
+# Backends
+# --------
+# picamera - Raspberry Pi camera module using python-picamera
+# fake     - Software camera that needs no camera hardware.  Produces jpeg
+#            images with a brightness calculated from a light curve and
+#            the current exposure settings.  Use for testing on any linux box.
+#
+# Raw Bayer data
+# --------------
+# With bayer=True picamera appends the raw sensor data to the jpeg.  The raw
+# block is a 32768 byte header starting with BRCM then the 10 bit pixels
+# packed 4 to 5 bytes in rows padded to 32 bytes.  Its size tells which
+# sensor took it.  develop.py develops it into the final image.
+
+import io
+import math
+import struct
+import time
+from fractions import Fraction
+
+import stats
+
+MICRO2SECOND = 1000000  # Constant for converting Shutter Speed to Seconds
+
+RAW_HEADER_SIZE = 32768
+# Raw block size: sensor name, width, height, black level (10 bit)
+RAW_SENSORS = {
+  6404096:  ('ov5647', 2592, 1944, 16),   # camera module v1
+  10270208: ('imx219', 3280, 2464, 64),   # camera module v2
+}
+# Start of the raw header. 'BRCM', sensor name, width, height, padding right and down,
+# transform, format, bayer order (0 RGGB 1 GBRG 2 BGGR 3 GRBG) and bayer format
+RAW_HEADER = struct.Struct('<4s172x32sHHHH24xHHBB')
+
+# Size of the raw Bayer block at the end of jpeg data. 0 if there is none
+def rawSize(data):
+  for size in RAW_SENSORS:
+    if len(data) > size and data[-size:-size + 4] == 'BRCM':
+      return size
+  return 0
+
+# Split captured data into the jpeg and the raw Bayer block. raw is None if there is none
+def splitBayer(data):
+  size = rawSize(data)
+  if not size:
+    return data, None
+  return data[:-size], data[-size:]
+
+# Open a camera backend by name. picamera is only imported if required
+# so the fake backend works on computers without camera hardware.
+def openCamera(backend='picamera', lightCurveFile=None, clock=time.time, sleep=time.sleep):
+  if backend == 'picamera':
+    import picamera
+    return picamera.PiCamera()
+  elif backend == 'fake':
+    lightCurve = None
+    if lightCurveFile:
+      lightCurve = loadLightCurve(lightCurveFile)
+    return FakeCamera(lightCurve=lightCurve, clock=clock, sleep=sleep)
+  raise ValueError("Unknown camera backend %s" % backend)
+
+# Read a light curve csv file with lines of  secondsOfDay,lux
+# Returns a function that converts a time.time() value to a lux level.
+# Values between entries are interpolated on a log scale
+def loadLightCurve(filename):
+  points = []
+  with open(filename, 'r') as f:
+    for line in f:
+      line = line.strip()
+      if not line or line.startswith('#'):
+        continue
+      secs, lux = line.split(',')[0:2]
+      points.append((float(secs), max(float(lux), 0.001)))
+  points.sort()
+  if not points:
+    raise ValueError("No light curve entries found in %s" % filename)
+  def lightCurve(timeNow):
+    local = time.localtime(timeNow)
+    secs = local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec + (timeNow % 1)
+    if secs <= points[0][0]:
+      return points[0][1]
+    for i in range(1, len(points)):
+      if secs <= points[i][0]:
+        s0, l0 = points[i - 1]
+        s1, l1 = points[i]
+        ratio = (secs - s0) / (s1 - s0)
+        return math.exp(math.log(l0) + (math.log(l1) - math.log(l0)) * ratio)
+    return points[-1][1]
+  return lightCurve
+
+# Built in light curve.  Sun is highest at noon and sets at 18:00
+# Lux ranges from about 100000 at noon to 0.05 in the middle of the night
+def defaultLightCurve(timeNow):
+  local = time.localtime(timeNow)
+  secs = local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec + (timeNow % 1)
+  sunHeight = math.sin(2 * math.pi * (secs / 86400.0 - 0.25))
+  return max(10 ** (1.0 + 4.0 * sunHeight), 0.05)
+
+class FakeCamera(object):
+  # Mimics the parts of picamera.PiCamera used by rpi-timelapse.py
+  # luma = lux * exposureSec * gain * SENSITIVITY clipped to 0-255
+  # Auto exposure and awb do not jump to new values. They converge
+  # exponentially with time constants CONVERGE_SEC and AWB_CONVERGE_FRAMES
+  # so settling after a settings change can be tested.
+  SENSITIVITY = 10.0
+  TARGET_LUMA = 110.0
+  MAX_GAIN = 8.0
+  CONVERGE_SEC = 0.3         # Auto exposure time constant
+  AWB_CONVERGE_FRAMES = 3    # Auto white balance time constant in frames
+
+  def __init__(self, lightCurve=None, clock=time.time, sleep=time.sleep):
+    if lightCurve is None:
+      lightCurve = defaultLightCurve
+    self.lightCurve = lightCurve
+    self.clock = clock
+    self.sleep = sleep
+    self.resolution = (1920, 1080)
+    self.framerate = 30
+    self.iso = 0
+    self.shutter_speed = 0
+    self.exposure_mode = 'auto'
+    self.awb_mode = 'auto'
+    self._awbFixed = (1.5, 1.5)
+    self.vflip = False
+    self.hflip = False
+    self.closed = False
+    self.captureCount = 0
+    self._texture = None
+    # Sensor state when the camera starts. Converges from here
+    self._state = (self._maxExposure(), 1.0, (1.5, 1.5))
+    self._stateTime = clock()
+
+  def start_preview(self):
+    pass
+
+  def stop_preview(self):
+    pass
+
+  def close(self):
+    self.closed = True
+
+  def lightLevel(self):
+    return self.lightCurve(self.clock())
+
+  def _maxExposure(self):
+    return int(MICRO2SECOND / float(self.framerate))
+
+  # Work out exposure (microseconds) and gain the way camera auto exposure would
+  def _exposure(self):
+    maxExposure = self._maxExposure()
+    if self.exposure_mode == 'off':
+      exposure = self.shutter_speed or maxExposure
+      return min(exposure, maxExposure), max(self.iso / 100.0, 1.0)
+    needed = self.TARGET_LUMA / (self.lightLevel() * self.SENSITIVITY)  # exposureSec * gain
+    if self.iso:
+      gain = self.iso / 100.0
+    else:
+      gain = 1.0
+    exposure = min(max(needed / gain, 0.0001), maxExposure / float(MICRO2SECOND))
+    if not self.iso and exposure * gain < needed:
+      gain = min(needed / exposure, self.MAX_GAIN)
+    return int(exposure * MICRO2SECOND), gain
+
+  # Auto white balance red and blue gains. Warmer in low light
+  def _awbTarget(self):
+    warm = 1.0 / (1.0 + self.lightLevel() / 50.0)
+    return (1.3 + 0.5 * warm, 1.6 - 0.3 * warm)
+
+  # Move the sensor state towards the auto exposure/awb targets for the time
+  # passed since the last call. Manual settings apply straight away.
+  def _current(self):
+    now = self.clock()
+    elapsed = max(now - self._stateTime, 0.0)
+    exposure, gain, awb = self._state
+    targetExposure, targetGain = self._exposure()
+    if self.exposure_mode == 'off':
+      exposure, gain = targetExposure, targetGain
+    else:
+      step = 1.0 - math.exp(-elapsed / self.CONVERGE_SEC)
+      exposure = math.exp(math.log(exposure) + (math.log(max(targetExposure, 1)) - math.log(exposure)) * step)
+      gain = math.exp(math.log(gain) + (math.log(targetGain) - math.log(gain)) * step)
+    if self.awb_mode == 'off':
+      awb = self._awbFixed
+    else:
+      awbSec = max(self.CONVERGE_SEC, self.AWB_CONVERGE_FRAMES / float(self.framerate))
+      step = 1.0 - math.exp(-elapsed / awbSec)
+      awb = tuple([old + (new - old) * step for old, new in zip(awb, self._awbTarget())])
+    self._state = (max(int(exposure), 1), gain, awb)
+    self._stateTime = now
+    return self._state
+
+  @property
+  def exposure_speed(self):
+    return self._current()[0]
+
+  @property
+  def analog_gain(self):
+    return Fraction(self._current()[1]).limit_denominator(256)
+
+  @property
+  def digital_gain(self):
+    return Fraction(1)
+
+  @property
+  def awb_gains(self):
+    return tuple([Fraction(g).limit_denominator(256) for g in self._current()[2]])
+
+  @awb_gains.setter
+  def awb_gains(self, gains):
+    self._awbFixed = tuple([float(g) for g in gains])
+
+  # Average scene brightness before clipping so over exposed images are flat white
+  def luma(self):
+    exposure, gain, awb = self._current()
+    return self.lightLevel() * exposure / float(MICRO2SECOND) * gain * self.SENSITIVITY
+
+  def _makeImage(self, size=None):
+    from PIL import Image
+    size = tuple(size or self.resolution)
+    if self._texture is None or self._texture.size != size:
+      self._texture = Image.effect_noise(size, 64)
+    luma = self.luma()
+    lut = [int(min(luma * (0.5 + p / 255.0), 255)) for p in range(256)]
+    grey = self._texture.point(lut)
+    return Image.merge('RGB', (grey, grey, grey))
+
+  # Raw Bayer block like a v1 camera. The same texture as the jpeg as linear
+  # 10 bit values in a BGGR mosaic with red and blue less sensitive than green
+  def _makeRaw(self):
+    import numpy
+    from PIL import Image
+    size = 6404096
+    name, width, height, black = RAW_SENSORS[size]
+    texture = numpy.asarray(self._texture.resize((width, height), Image.BILINEAR), dtype=numpy.float32)
+    linear = numpy.clip(self.luma() * (0.5 + texture / 255.0) / 255.0, 0.0, 1.0) ** 2.2
+    mosaic = linear * (1023 - black) + black
+    mosaic[0::2, 0::2] /= 1.5
+    mosaic[1::2, 1::2] /= 1.5
+    values = mosaic.astype(numpy.uint16).reshape(height, width // 4, 4)
+    pixels = numpy.empty((height, width // 4, 5), dtype=numpy.uint8)
+    pixels[:, :, :4] = values >> 2
+    pixels[:, :, 4] = ((values[:, :, 0] & 3) << 6 | (values[:, :, 1] & 3) << 4 |
+                       (values[:, :, 2] & 3) << 2 | (values[:, :, 3] & 3))
+    stride = (width * 5 // 4 + 31) // 32 * 32
+    packed = numpy.zeros(((size - RAW_HEADER_SIZE) // stride, stride), dtype=numpy.uint8)
+    packed[:height, :width * 5 // 4] = pixels.reshape(height, -1)
+    header = bytearray(RAW_HEADER_SIZE)
+    header[:RAW_HEADER.size] = RAW_HEADER.pack('BRCM', name, width, height, 0, 0, 0, 0, 2, 0)
+    return bytes(header) + packed.tobytes()
+
+  # Capture an image to a filename or file like object.
+  # Takes as long as the exposure would on a real camera. resize=(w, h) like picamera
+  def capture(self, output, format='jpeg', **options):
+    exposure = self._current()[0]
+    self.sleep(exposure / float(MICRO2SECOND))
+    img = self._makeImage(options.get('resize'))
+    img.save(output, 'JPEG', quality=options.get('quality', 85))
+    if options.get('bayer'):
+      output.write(self._makeRaw())
+    self.captureCount += 1
+
+  # Capture images into output one after another. Yields output after each
+  def capture_continuous(self, output, format='jpeg', use_video_port=False, **options):
+    while not self.closed:
+      self.capture(output, format, **options)
+      yield output
+
+class CameraSession(object):
+  # Owns the camera for the life of the program and switches between
+  # day and night settings in place.  Settling is only needed when the
+  # camera mode changes or exposure is frozen, and stops as soon as the
+  # camera gains, exposure and awb stop changing.  daySettleSec and
+  # nightSettleSec are the longest it will wait.
+  def __init__(self, camera, width, height, vflip=False, hflip=False,
+               preview=False, daySettleSec=2, nightSettleSec=10,
+               verbose=False, sleep=time.sleep, clock=time.time,
+               settleTolerance=0.02, settlePollSec=0.1, settleStableSec=0.2):
+    self.camera = camera
+    self.verbose = verbose
+    self.sleep = sleep
+    self.clock = clock
+    self.daySettleSec = daySettleSec
+    self.nightSettleSec = nightSettleSec
+    self.settleTolerance = settleTolerance  # Max relative change between polls when settled
+    self.settlePollSec = settlePollSec      # Seconds between polls. At least one frame
+    self.settleStableSec = settleStableSec  # Seconds values must stay within tolerance
+    self.mode = None       # Current camera settings 'day' or 'night'
+    self.settings = None   # Settings tuple last applied to camera
+    self.settleTotal = 0.0
+    self.lastSettle = 0.0  # Seconds the last settle took
+    camera.resolution = (width, height)
+    if vflip:
+      camera.vflip = vflip
+    if hflip:
+      camera.hflip = hflip
+    if preview:
+      camera.start_preview()
+
+  def close(self):
+    if self.camera is not None:
+      self.camera.close()
+      self.camera = None
+
+  # Camera values that auto exposure and awb adjust
+  def _readings(self):
+    camera = self.camera
+    red, blue = camera.awb_gains
+    return (float(camera.exposure_speed), float(camera.analog_gain),
+            float(camera.digital_gain), float(red), float(blue))
+
+  def _stable(self, last, reading):
+    for old, new in zip(last, reading):
+      if abs(new - old) > self.settleTolerance * max(abs(old), 1e-6):
+        return False
+    return True
+
+  # Wait for exposure, gains and awb to stop changing, or timeout seconds.
+  # Returns the seconds taken
+  def _settle(self, timeout):
+    if timeout <= 0:
+      return 0.0
+    started = self.clock()
+    last = self._readings()
+    stable = 0.0
+    while stable < self.settleStableSec:
+      remaining = timeout - (self.clock() - started)
+      if remaining <= 0:
+        stats.count('camera_settle_timeouts')
+        break
+      # Camera values only change once per frame so never poll faster
+      interval = min(max(self.settlePollSec, 1.0 / float(self.camera.framerate)), remaining)
+      self.sleep(interval)
+      reading = self._readings()
+      if self._stable(last, reading):
+        stable += interval
+      else:
+        stable = 0.0
+      last = reading
+    seconds = self.clock() - started
+    stats.observe('camera_settle', seconds)
+    self.lastSettle = seconds
+    self.settleTotal += seconds
+    if self.verbose:
+      print "CameraSession     - Settled in %.1f sec (max %i sec)" % ( seconds, timeout )
+    return seconds
+
+  # Day Mode. auto=True leaves camera exposure and awb on Auto.
+  # auto=False meters the scene then freezes exposure and awb gains.
+  def setDayMode(self, iso, auto=True):
+    settings = ('day', iso, auto)
+    if auto and settings == self.settings:
+      return
+    camera = self.camera
+    modeChanged = self.mode != 'day'
+    if modeChanged:
+      camera.framerate = 30
+    camera.shutter_speed = 0
+    camera.iso = iso
+    camera.exposure_mode = 'auto'
+    camera.awb_mode = 'auto'
+    if not auto:
+      # Give the camera's auto-exposure and auto-white-balance algorithms
+      # some time to measure the scene and determine appropriate values
+      self._settle(self.daySettleSec)
+      # Now fix the values
+      camera.shutter_speed = camera.exposure_speed
+      camera.exposure_mode = 'off'
+      g = camera.awb_gains
+      camera.awb_mode = 'off'
+      camera.awb_gains = g
+    elif modeChanged:
+      self._settle(self.daySettleSec)
+    if modeChanged:
+      stats.count('camera_mode_changes')
+    self.mode = 'day'
+    self.settings = settings
+
+  # Night Mode. auto=True uses camera auto settings for No Low Light conditions.
+  # auto=False sets a long exposure shutter speed and iso for Low Light conditions.
+  def setNightMode(self, shutspeed, iso, auto=False):
+    settings = ('night', int(shutspeed), iso, auto)
+    if settings == self.settings:
+      return
+    camera = self.camera
+    modeChanged = self.mode != 'night'
+    if auto:
+      camera.framerate = 30
+      camera.shutter_speed = 0
+      camera.iso = 0
+      camera.exposure_mode = 'auto'
+      camera.awb_mode = 'auto'
+      if modeChanged:
+        self._settle(self.daySettleSec)
+    else:
+      # Set a frame rate of 1/6 fps, then set shutter
+      # speed and ISO for Low Light Conditions
+      camera.framerate = Fraction(1, 6)
+      camera.shutter_speed = int(shutspeed)
+      camera.exposure_mode = 'off'
+      camera.iso = iso
+      camera.awb_mode = 'auto'
+      # Give the camera a good long time to measure AWB
+      # Only needed when changing from day to night settings.
+      if modeChanged:
+        self._settle(self.nightSettleSec)
+    if modeChanged:
+      stats.count('camera_mode_changes')
+    self.mode = 'night'
+    self.settings = settings
+
+  def capture(self, output, **options):
+    self.camera.capture(output, **options)
+
+  # Freeze exposure and awb at their current values eg for a burst so every
+  # image has the same brightness. The next setDayMode/setNightMode unlocks
+  def lockExposure(self):
+    camera = self.camera
+    camera.shutter_speed = camera.exposure_speed
+    camera.exposure_mode = 'off'
+    g = camera.awb_gains
+    camera.awb_mode = 'off'
+    camera.awb_gains = g
+    self.settings = ('locked',) + tuple(self.settings or ())
+
+  # Generator of (jpeg data, exposure speed, gain) from a continuous capture.
+  # The camera keeps streaming between images so there is no per image setup.
+  # use_video_port is faster but lower quality. Call close() when done
+  def captureStream(self, useVideoPort=True, **options):
+    stream = io.BytesIO()
+    camera = self.camera
+    for unused in camera.capture_continuous(stream, format='jpeg', use_video_port=useVideoPort, **options):
+      data = stream.getvalue()
+      stream.seek(0)
+      stream.truncate()
+      stats.count('captures')
+      yield data, camera.exposure_speed, float(camera.analog_gain) * float(camera.digital_gain)
+
+  # Capture a jpeg into memory. Returns the jpeg data plus the
+  # exposure speed (microseconds) and total gain the camera used.
+  # bayer=True appends the raw sensor data (see develop.py)
+  def captureToMemory(self, **options):
+    stream = io.BytesIO()
+    with stats.timer('camera_capture'):
+      self.camera.capture(stream, format='jpeg', **options)
+    stats.count('captures')
+    camera = self.camera
+    gain = float(camera.analog_gain) * float(camera.digital_gain)
+    return stream.getvalue(), camera.exposure_speed, gain
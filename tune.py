@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# tune.py - Offline tuning of the Day/Twilight/Night settings from telemetry.py history
+#
+# Replays the scenestate.py mode logic over the recorded probes for a grid of
+# settings and scores each by how well exposed the images would have been.
+# No images are taken.  The recorded scene light level is exposure independent
+# so the mean luma an image would get in each mode is predicted from the
+# camera settings for that mode
+#
+#   mean luma = level * shutter seconds * iso / 100
+#
+# Day (and sunrise twilight) auto exposure reaches targetLuma unless the
+# longest auto exposure is not enough.  Sunset twilight uses the sigmoid
+# shutter ramp from durationOfTwilightSec and twilightShutMaxSec.  The score
+# is the average log exposure error plus transitionCost for each mode change
+# per day above the four of a normal day, so thresholds that flip back and
+# forth score worse.
+#
+# The replay is vectorized with numpy.  Hysteresis is two Schmitt triggers
+# (in/out of Day and in/out of Night) worked out with a running maximum.
+# modeDwellSec is not replayed.  Thresholds are searched first, then the
+# twilight ramp, twice over.
+#
+# python ./tune.py rpi-timelapse.telemetry
+# python ./tune.py rpi-timelapse.telemetry --set meterMode='filesize' --set dayLightISO=100
+
+import argparse
+import ast
+import math
+import sys
+import time
+import numpy
+
+import telemetry
+
+# Current rpi-timelapse.py settings. Change with --set to match your script
+SETTINGS = {
+  'meterMode': 'luma',
+  'meterDayLevel': 3000,
+  'meterNightLevel': 100,
+  'twilightZoneDay': 450000,
+  'twilightZoneNight': 230000,
+  'modeHysteresis': 0.1,
+  'durationOfTwilightSec': 20*60,
+  'twilightShutMaxSec': 6,
+  'nightLowShutSpeedSec': 6,
+  'nightLowLightISO': 800,
+  'dayLightISO': 200,
+  'imageNightAuto': False,
+  'dayMaxExposureSec': 1 / 30.0,  # Longest camera auto exposure
+  'targetLuma': 110.0,            # Mean luma of a well exposed image
+  'transitionCost': 0.05,         # Score added per extra mode change per day
+}
+
+# Settings searched and the values tried. Levels are spread on a log scale
+def searchGrid(settings, history):
+  if settings['meterMode'] == 'luma':
+    thresholds = {'meterDayLevel': [int(v) for v in numpy.geomspace(300, 30000, 11)],
+                  'meterNightLevel': [int(v) for v in numpy.geomspace(10, 1000, 11)]}
+  else:
+    sizes = numpy.abs(history['daySize'] - history['nightSize'])
+    steps = [int(v) for v in numpy.percentile(sizes, range(5, 100, 10))] if len(sizes) else []
+    thresholds = {'twilightZoneDay': steps, 'twilightZoneNight': steps}
+  thresholds['modeHysteresis'] = [0.0, 0.05, 0.1, 0.2]
+  ramp = {'durationOfTwilightSec': [m * 60 for m in (5, 10, 15, 20, 30, 45, 60)],
+          'twilightShutMaxSec': [s for s in (1, 2, 3, 4, 5, 6) if s <= settings['nightLowShutSpeedSec']]}
+  return thresholds, ramp
+
+# Contiguous float arrays of the fields used from a telemetry record array.
+# Much faster to replay many times than the strided memmap columns
+def prepare(history):
+  data = dict([(name, numpy.ascontiguousarray(history[name], dtype=numpy.float64))
+               for name in ('time', 'level', 'daySize', 'nightSize')])
+  data['level'] = numpy.maximum(data['level'], 0.01)
+  data['logLevel'] = numpy.log(data['level'])
+  return data
+
+# Running state of a Schmitt trigger. 1 after set, 0 after reset, initial before either
+def schmitt(setMask, resetMask, initial):
+  state = numpy.full(len(setMask), -1, dtype=numpy.int8)
+  state[resetMask] = 0
+  state[setMask] = 1
+  index = numpy.maximum.accumulate(numpy.where(state >= 0, numpy.arange(len(state)), -1))
+  return numpy.where(index >= 0, state[numpy.maximum(index, 0)], initial).astype(bool)
+
+# Value of an array at the last position where mask was True. fill before the first
+def lastWhere(mask, values, fill):
+  index = numpy.maximum.accumulate(numpy.where(mask, numpy.arange(len(mask)), -1))
+  return numpy.where(index >= 0, values[numpy.maximum(index, 0)], fill)
+
+# Mode index (0 night, 1 twilight, 2 day) for every record with these settings
+def replayModes(history, s):
+  if s['meterMode'] == 'luma':
+    x = history['logLevel']
+    low, high = math.log(s['meterNightLevel']), math.log(s['meterDayLevel'])
+  else:
+    x = history['daySize'] - history['nightSize']
+    low, high = -s['twilightZoneNight'], s['twilightZoneDay']
+  margin = s['modeHysteresis'] * (high - low)
+  day = schmitt(x >= high + margin, x < high - margin, x[0] >= high)
+  night = schmitt(x <= low - margin, x > low + margin, x[0] <= low)
+  return numpy.where(day, 2, numpy.where(night, 0, 1))
+
+# Predicted mean luma of each image with these settings, before clipping
+def predictLuma(history, modes, s):
+  t = history['time']
+  level = history['level']
+  target = s['targetLuma']
+  dayIso = s['dayLightISO'] / 100.0
+  dayLuma = numpy.minimum(level * s['dayMaxExposureSec'] * dayIso, target)
+  sunriseLuma = numpy.minimum(level * s['dayMaxExposureSec'] * min(dayIso * 3, 8.0), target)
+  nightIso = s['nightLowLightISO'] / 100.0
+  if s['imageNightAuto']:
+    nightLuma = numpy.minimum(level * s['dayMaxExposureSec'] * nightIso, target)
+  else:
+    nightLuma = level * s['nightLowShutSpeedSec'] * nightIso
+  # Sunset ramp. Same sigmoid as sigmoidShutter() from the start of each twilight
+  twilight = modes == 1
+  starts = twilight & numpy.concatenate(([True], modes[:-1] != 1))
+  startTime = lastWhere(starts, t, t[0])
+  sunset = lastWhere(~twilight, modes, 2) == 2
+  ramp = 6.0 * (t - startTime) / s['durationOfTwilightSec'] - 3.0
+  shutter = s['twilightShutMaxSec'] / (1.0 + numpy.exp(-ramp))
+  sunsetLuma = level * shutter * nightIso / 4.0
+  return numpy.select([modes == 2, modes == 0, sunset], [dayLuma, nightLuma, sunsetLuma], sunriseLuma)
+
+# Score for settings s. Lower is better. Returns (score, exposure error, changes per day)
+def score(history, s):
+  modes = replayModes(history, s)
+  luma = predictLuma(history, modes, s)
+  error = numpy.abs(numpy.log(numpy.maximum(luma, 0.5) / s['targetLuma'])).mean()
+  days = max((history['time'][-1] - history['time'][0]) / 86400.0, 1.0)
+  changes = numpy.count_nonzero(modes[1:] != modes[:-1]) / days
+  return error + s['transitionCost'] * max(changes - 4, 0), error, changes
+
+# Try every combination of grid values keeping the best settings
+def searchStage(history, settings, grid):
+  names = sorted(grid)
+  best = dict(settings)
+  bestScore = score(history, best)[0]
+  tried = 0
+  for values in numpy.array(numpy.meshgrid(*[grid[name] for name in names])).reshape(len(names), -1).T:
+    trial = dict(settings)
+    trial.update([(name, type(settings[name])(value)) for name, value in zip(names, values)])
+    if trial.get('meterNightLevel', 0) >= trial.get('meterDayLevel', 1):
+      continue
+    tried += 1
+    trialScore = score(history, trial)[0]
+    if trialScore < bestScore:
+      best, bestScore = trial, trialScore
+  return best, tried
+
+def tune(history, settings, rounds=2):
+  thresholds, ramp = searchGrid(settings, history)
+  best = dict(settings)
+  tried = 0
+  for i in range(rounds):
+    for grid in (thresholds, ramp):
+      if all(grid.values()):
+        best, count = searchStage(history, best, grid)
+        tried += count
+  return best, tried
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Tune rpi-timelapse.py mode settings from telemetry history')
+  parser.add_argument('telemetry', help='telemetry file written by rpi-timelapse.py')
+  parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                      help='current rpi-timelapse.py setting eg --set dayLightISO=100')
+  args = parser.parse_args()
+  settings = dict(SETTINGS)
+  for item in args.set:
+    name, value = item.split('=', 1)
+    settings[name] = ast.literal_eval(value)
+
+  started = time.time()
+  history = telemetry.load(args.telemetry)
+  history = prepare(history[history['level'] > 0])
+  if len(history['time']) < 2:
+    print "tune.py - Not enough probes in %s" % args.telemetry
+    sys.exit(1)
+  before = score(history, settings)
+  best, tried = tune(history, settings)
+  after = score(history, best)
+  print "tune.py - %i probes over %.1f days. %i settings tried in %.1f sec" % (
+          len(history['time']), (history['time'][-1] - history['time'][0]) / 86400.0, tried, time.time() - started)
+  print "          current score=%.3f exposure error=%.3f mode changes/day=%.1f" % before
+  print "          tuned   score=%.3f exposure error=%.3f mode changes/day=%.1f" % after
+  changed = [name for name in sorted(best) if best[name] != settings[name]]
+  if not changed:
+    print "Current settings are the best found"
+  else:
+    print "Suggested rpi-timelapse.py settings"
+    for name in changed:
+      print "%s = %r   # was %r" % (name, best[name], settings[name])